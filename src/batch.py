@@ -0,0 +1,193 @@
+'''Emulates every assembly file of some directories or glob patterns without the GUI, e.g. to grade submissions,
+   spreading the files over all the cores, and writes a JSON or CSV report on how each of them ran.
+
+   Usage: python src/batch.py [-j JOBS] [-f json|csv] [-o REPORT] [-n MAX_INSNS] [-T TIMEOUT_MS] [--check] PATH_OR_GLOB...'''
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from deserializer import *
+from emulator_progress import EmulatorProgress
+
+
+REPORT_FIELDS = (
+    'file', 'status', 'error',
+    'exit_value', 'insn_count', 'truncation', 'stack_overflow', 'overflow_addr', 'invalid_rsp',
+    'compile_s', 'load_s', 'emulate_s', 'serialize_s', 'parse_s', 'total_s',
+)
+'''The columns of the report, one row per file.'''
+PHASE_FIELDS = {
+    'compiling': 'compile_s',
+    'loading':   'load_s',
+    'emulating': 'emulate_s',
+}
+'''The columns the wall time of the phases reported by the emulator go into.'''
+TRUNCATION_NAMES = {
+    TRUNCATION_NONE:       '',
+    TRUNCATION_INSN_LIMIT: 'instruction limit',
+    TRUNCATION_TIMEOUT:    'time limit',
+}
+'''How the reasons of a truncated emulation are written into the report.'''
+
+
+
+def find_sources(patterns: list[str]) -> list[str]:
+    '''Returns the assembly files in the given directories and the files matching the given glob patterns, in order.'''
+
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files += sorted(glob.glob(os.path.join(pattern, '*.s')))
+        else:
+            files += sorted(glob.glob(pattern))
+
+    # a file matched by several patterns is only emulated once
+    return list(dict.fromkeys(files))
+
+def emulate_file(emulator_path: str, file_path: str, emulator_args: list[str]) -> dict:
+    '''Compiles and emulates a single file in a work directory of its own, and returns its row of the report.
+       Runs in the worker processes, every error is recorded in the row instead of being raised.'''
+
+    result = dict.fromkeys(REPORT_FIELDS, '')
+    result['file'] = file_path
+    result['status'] = 'ok'
+
+    started = time.monotonic()
+    work_dir = create_work_dir()
+
+    try:
+        process = subprocess.Popen([emulator_path, '--quiet', '--progress', '--workdir', work_dir, *emulator_args, file_path],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        progress = EmulatorProgress(process.stderr)
+        process.wait()
+        progress.join()
+
+        emulated = time.monotonic()
+        for phase, duration in progress.phase_durations(emulated).items():
+            if phase in PHASE_FIELDS:
+                result[PHASE_FIELDS[phase]] = round(duration, 4)
+
+        # writing the trace happens during the emulation, the emulator times it separately
+        if 'serializing' in progress.timings:
+            result['serialize_s'] = round(progress.timings['serializing'] / 1000, 4)
+
+        if process.returncode != 0:
+            # e.g. the errors of the compiler
+            raise RuntimeError('\n'.join(progress.messages) or f'The emulator exited with status { process.returncode }')
+
+        program = Deserializer().get_executed_program(os.path.join(work_dir, SERIALIZED_OUTPUT_NAME))
+        last_context = program.contexts[len(program.contexts) - 1]
+        ex_info = program.ex_info
+
+        result['exit_value'] = last_context.regs['AL']
+        result['insn_count'] = ex_info.insn_count
+        result['truncation'] = TRUNCATION_NAMES.get(ex_info.truncation_reason, str(ex_info.truncation_reason))
+        result['stack_overflow'] = bool(ex_info.has_stack_overflowed)
+        result['overflow_addr'] = f'{ ex_info.addr :#x}' if ex_info.has_stack_overflowed else ''
+        result['invalid_rsp'] = bool(ex_info.is_rsp_invalid)
+        result['parse_s'] = round(time.monotonic() - emulated, 4)
+    except Exception as ex:
+        result['status'] = 'error'
+        result['error'] = str(ex) or type(ex).__name__
+    finally:
+        remove_work_dir(work_dir)
+
+    result['total_s'] = round(time.monotonic() - started, 4)
+
+    return result
+
+def run_batch(emulator_path: str, files: list[str], emulator_args: list[str], jobs: int) -> list[dict]:
+    '''Emulates the files in a pool of `jobs` processes and returns their rows of the report, in the order of `files`.'''
+
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = { executor.submit(emulate_file, emulator_path, file, emulator_args): file for file in files }
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            file = futures[future]
+
+            try:
+                results[file] = future.result()
+            except Exception as ex:
+                # the worker process itself died, the other files are still reported
+                results[file] = { **dict.fromkeys(REPORT_FIELDS, ''), 'file': file, 'status': 'error', 'error': repr(ex) }
+
+            print(f'[{ done }/{ len(files) }] { file }: { results[file]["status"] }', file=sys.stderr)
+
+    return [results[file] for file in files]
+
+def check_results(results: list[dict]) -> list[str]:
+    '''Returns the problems of the rows of the report: files that failed, and files that ran to completion
+       without reporting a single executed instruction.'''
+
+    problems = []
+    for result in results:
+        if result['status'] != 'ok':
+            problems.append(f'{ result["file"] }: { result["error"] }')
+        elif not result['truncation'] and not result['insn_count']:
+            problems.append(f'{ result["file"] }: no executed instructions were reported')
+
+    return problems
+
+def write_report(results: list[dict], report_format: str, output) -> None:
+    '''Writes the rows of the report to the text stream `output`.'''
+
+    if report_format == 'json':
+        json.dump(results, output, indent=2)
+        output.write('\n')
+    else:
+        writer = csv.DictWriter(output, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulates a batch of assembly files and reports how each of them ran.')
+    parser.add_argument('paths', nargs='+', metavar='PATH_OR_GLOB',
+                        help='a directory, whose .s files are emulated, or a glob pattern matching the files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='the number of files emulated at once (default: the number of cores)')
+    parser.add_argument('-f', '--format', choices=('json', 'csv'), default='json', help='the format of the report')
+    parser.add_argument('-o', '--output', help='the file the report is written to (default: stdout)')
+    parser.add_argument('-n', '--max-insns', help="the emulator's instruction limit for every file")
+    parser.add_argument('-T', '--timeout', help="the emulator's time limit in milliseconds for every file")
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 if a file fails or reports no executed instructions, e.g. to test the emulator on a corpus')
+    parser.add_argument('--emulator', default=os.path.join(get_program_dir(), 'asemu'), help='the path of asemu')
+    args = parser.parse_args()
+
+    files = find_sources(args.paths)
+    if not files:
+        sys.exit('No assembly files found')
+
+    emulator_args = []
+    if args.max_insns is not None:
+        emulator_args += ['--max-insns', args.max_insns]
+    if args.timeout is not None:
+        emulator_args += ['--timeout', args.timeout]
+
+    results = run_batch(args.emulator, files, emulator_args, max(1, args.jobs))
+
+    if args.output is None:
+        write_report(results, args.format, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as file:
+            write_report(results, args.format, file)
+
+    if args.check and (problems := check_results(results)):
+        sys.exit('\n'.join(problems))
+
+
+
+
+#############################################
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,543 @@
+import operator
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Callable, Iterable, Sequence
+from emu_dataclasses import *
+
+
+_comparison_pattern = re.compile(r'(\w+)\s*(==|!=|<=|>=|<|>)\s*(\w+)')
+'''operand | comparison operator | value'''
+_change_pattern = re.compile(r'(\w+)\s+changed')
+'''operand'''
+_comparisons = {
+    '==': operator.eq, '!=': operator.ne,
+    '<':  operator.lt, '<=': operator.le,
+    '>':  operator.gt, '>=': operator.ge,
+}
+'''The comparison operators a condition can use.'''
+
+
+
+class LineOccurrences():
+    '''For every line of the assembly code, the sorted indices of the execution contexts about to execute it.
+
+       Answers "which context hits one of these lines next (or last)" with a binary search per line,
+       so continuing to a breakpoint does not have to step through the contexts in between.
+       The index is built lazily and extended when the trace grows while it is being streamed.'''
+
+    _occurrences: list[array]
+    '''The context indices of every line, in increasing order.'''
+    _num_indexed: int
+    '''The number of contexts that have been indexed so far.'''
+
+
+    def __init__(self,
+                 program: ExecutedProgram):
+
+        self.program = program
+        '''The program whose contexts are indexed.'''
+
+        self._occurrences = [array('I') for _ in range(program.code.num_lines)]
+        self._num_indexed = 0
+
+
+    def update(self) -> None:
+        '''Indexes the contexts that have been added to the program since the last update.'''
+
+        num_contexts = len(self.program.contexts)
+        occurrences = self._occurrences
+        get_line_index = self.program.get_line_index
+
+        for index in range(self._num_indexed, num_contexts):
+            occurrences[get_line_index(index)].append(index)
+
+        self._num_indexed = num_contexts
+
+    def of_line(self, line_idx: int) -> array:
+        '''Returns the indices of the contexts executing the line at `line_idx`, in increasing order.'''
+
+        self.update()
+
+        return self._occurrences[line_idx]
+
+    def next_hit(self, line_indices: Iterable[int], index: int) -> int | None:
+        '''Returns the first context after `index` that executes one of the lines, or None if there is none.'''
+
+        self.update()
+
+        hit = None
+        for line_idx in line_indices:
+            occurrences = self._occurrences[line_idx]
+            pos = bisect_right(occurrences, index)
+
+            if pos < len(occurrences) and (hit is None or occurrences[pos] < hit):
+                hit = occurrences[pos]
+
+        return hit
+
+    def previous_hit(self, line_indices: Iterable[int], index: int) -> int | None:
+        '''Returns the last context before `index` that executes one of the lines, or None if there is none.'''
+
+        self.update()
+
+        hit = None
+        for line_idx in line_indices:
+            occurrences = self._occurrences[line_idx]
+            pos = bisect_left(occurrences, index)
+
+            if pos > 0 and (hit is None or occurrences[pos - 1] > hit):
+                hit = occurrences[pos - 1]
+
+        return hit
+
+
+
+@dataclass
+class Signal:
+    '''A value over the whole trace, e.g. a register, that is constant between the contexts it changes at.'''
+
+    indices: Sequence[int]
+    '''The indices of the contexts the value changes at, in increasing order, starting with 0.'''
+    values: Sequence[int]
+    '''The value from each index in `indices` on.'''
+
+
+    def value_at(self, index: int) -> int:
+        '''Returns the value in the context at `index`.'''
+
+        return self.values[bisect_right(self.indices, index) - 1]
+
+    def map(self, transform: Callable[[int], int]) -> 'Signal':
+        '''Returns the signal of `transform` applied to the values, which only changes where the result does.'''
+
+        indices, values = array('I'), []
+
+        for index, value in zip(self.indices, map(transform, self.values)):
+            if not values or values[-1] != value:
+                indices.append(index)
+                values.append(value)
+
+        return Signal(indices, values)
+
+
+
+class TraceSignals():
+    '''The registers and the .data/.bss symbols of a program as `Signal`s.
+
+       The register signals are built with a single pass over the trace that only keeps the changes,
+       the signal of a symbol is built on first use by replaying only the deltas that wrote memory.
+       Both are extended when the trace grows while it is being streamed.'''
+
+    _register_indices: list[array]
+    '''The indices of the contexts every register changes at.'''
+    _register_values: list[array]
+    '''The values every register changes to.'''
+    _write_indices: array
+    '''The indices of the contexts whose preceding instruction wrote memory.'''
+    _symbol_signals: dict[str, tuple[int, Signal]]
+    '''The signals of the symbols used so far, with the number of contexts they were built from.'''
+    _num_indexed: int
+    '''The number of contexts that have been indexed so far.'''
+
+
+    def __init__(self,
+                 program: ExecutedProgram):
+
+        self.program = program
+        '''The program whose contexts are indexed.'''
+
+        self._register_indices = [array('I') for _ in REGISTER_NAMES]
+        self._register_values = [array('Q') for _ in REGISTER_NAMES]
+        self._write_indices = array('I')
+        self._symbol_signals = {}
+        self._num_indexed = 0
+
+
+    def __len__(self) -> int:
+        return self._num_indexed
+
+    def update(self) -> None:
+        '''Indexes the contexts that have been added to the program since the last update.'''
+
+        num_contexts = len(self.program.contexts)
+        start = self._num_indexed
+
+        if isinstance(self.program.contexts, list):
+            for index in range(start, num_contexts):
+                self._record_registers(index, enumerate(self.program.contexts[index].regs.values))
+        elif start < num_contexts:
+            # the deltas store the registers in the order the emulator reads them
+            slots = [REGISTER_SLOTS.get(name, -1) for name in self.program.register_names]
+
+            if start == 0:
+                self._record_registers(0, zip(slots, self.program.initial_state.regs))
+                start = 1
+
+            deltas = self.program.deltas
+            for index in range(start, num_contexts):
+                delta = deltas[index - 1]
+                self._record_registers(index, ((slots[slot], value) for slot, value in delta.regs))
+
+                if delta.writes:
+                    self._write_indices.append(index)
+
+        self._num_indexed = num_contexts
+
+    def has_operand(self, name: str) -> bool:
+        '''Whether `name` is a register, a sub-register, a flag or a symbol of .data or .bss.'''
+
+        return (name in REGISTER_SLOTS or name in SUB_REGISTERS or name in FLAG_BITS
+                or self._find_symbol(name) is not None)
+
+    def signal(self, name: str) -> Signal:
+        '''Returns the signal of a register, a sub-register, a flag or a symbol of .data or .bss.
+           The value of a symbol is its bytes read as a little-endian unsigned integer.'''
+
+        self.update()
+
+        slot = REGISTER_SLOTS.get(name)
+        if slot is not None:
+            return Signal(self._register_indices[slot], self._register_values[slot])
+
+        if name in FLAG_BITS:
+            reg, shift, mask = 'RFLAGS', FLAG_BITS[name], 1
+            return self.signal(reg).map(lambda value: (value >> shift) & mask)
+
+        if name in SUB_REGISTERS:
+            reg, shift, mask = SUB_REGISTERS[name]
+            return self.signal(reg).map(lambda value: (value >> shift) & mask)
+
+        cached = self._symbol_signals.get(name)
+        if cached is None or cached[0] != self._num_indexed:
+            cached = (self._num_indexed, self._build_symbol_signal(name))
+            self._symbol_signals[name] = cached
+
+        return cached[1]
+
+
+    def _record_registers(self, index: int, values: Iterable[tuple[int, int]]) -> None:
+        for slot, value in values:
+            if slot < 0:
+                continue
+
+            reg_values = self._register_values[slot]
+            if not reg_values or reg_values[-1] != value:
+                self._register_indices[slot].append(index)
+                reg_values.append(value)
+
+    def _symbol_segments(self) -> DynamicMemory:
+        '''The .data and .bss segments listing the symbols. Text traces only list them in their contexts,
+           their `dynamic_mem` stays empty.'''
+
+        mem = self.program.dynamic_mem
+        if not (mem.data.symbols or mem.bss.symbols) and isinstance(self.program.contexts, list) and self.program.contexts:
+            return self.program.contexts[0].dynamic_mem
+
+        return mem
+
+    def _find_symbol(self, name: str) -> tuple[MemorySegment, Symbol] | None:
+        mem = self._symbol_segments()
+        for segment in (mem.data, mem.bss):
+            for symbol in segment.symbols:
+                if symbol.name == name:
+                    return segment, symbol
+
+        return None
+
+    def _build_symbol_signal(self, name: str) -> Signal:
+        found = self._find_symbol(name)
+        if found is None:
+            raise ValueError(f'Unknown register or symbol: { name }')
+
+        segment, symbol = found
+        indices, values = array('I'), []
+
+        def record(index: int, sym_bytes: bytes | bytearray) -> None:
+            value = int.from_bytes(sym_bytes, 'little')
+            if not values or values[-1] != value:
+                indices.append(index)
+                values.append(value)
+
+        if isinstance(self.program.contexts, list):
+            for index in range(self._num_indexed):
+                mem = self.program.contexts[index].dynamic_mem
+                seg = mem.data if segment.name == 'data' else mem.bss
+                record(index, seg.bytes[symbol.addr - seg.addr:symbol.addr - seg.addr + symbol.size])
+
+            return Signal(indices, values)
+
+        state = self.program.initial_state
+        sym_bytes = bytearray((state.data if segment is self.program.dynamic_mem.data else state.bss)
+                              [symbol.addr - segment.addr:symbol.addr - segment.addr + symbol.size])
+        sym_end = symbol.addr + symbol.size
+        record(0, sym_bytes)
+
+        for index in self._write_indices:
+            for addr, written in self.program.deltas[index - 1].writes:
+                start = max(addr, symbol.addr)
+                end = min(addr + len(written), sym_end)
+
+                if start < end:
+                    sym_bytes[start - symbol.addr:end - symbol.addr] = written[start - addr:end - addr]
+
+            record(index, sym_bytes)
+
+        return Signal(indices, values)
+
+
+
+class Condition():
+    '''A condition on the registers, the flags and the .data/.bss symbols, compiled once and evaluated
+       over the whole trace at once into the ranges of contexts it holds in.
+
+       A condition is made of terms like `RCX == 0`, `ZF == 1`, `counter >= 0x10` or `counter changed`,
+       combined with `and` and `or`, where `and` binds tighter. The value of a symbol is its bytes read
+       as a little-endian unsigned integer, and `changed` holds in the contexts right after a write that
+       changed the value.'''
+
+    _clauses: list[list[tuple[str, Callable[[int], bool] | None]]]
+    '''The terms of the condition in disjunctive normal form: (operand, predicate) pairs,
+       where a `None` predicate stands for `changed`.'''
+    _intervals: tuple[int, array, array] | None
+    '''The number of contexts the condition was last evaluated over, and the starts and (exclusive)
+       ends of the ranges of contexts it holds in.'''
+
+
+    def __init__(self,
+                 text: str):
+
+        self.text = ' '.join(text.split())
+        '''The source of the condition.'''
+
+        self._clauses = [[self._parse_term(term) for term in re.split(r'\s+and\s+', clause)]
+                         for clause in re.split(r'\s+or\s+', self.text)]
+        self._intervals = None
+
+
+    def __str__(self) -> str:
+        return self.text
+
+    def operands(self) -> set[str]:
+        '''Returns the names of the registers and symbols the condition depends on.'''
+
+        return {name for clause in self._clauses for name, _ in clause}
+
+    def holds_at(self, signals: TraceSignals, index: int) -> bool:
+        '''Whether the condition holds in the context at `index`.'''
+
+        starts, ends = self.evaluate(signals)
+        k = bisect_right(starts, index) - 1
+
+        return k >= 0 and index < ends[k]
+
+    def first_at_or_after(self, signals: TraceSignals, index: int) -> int | None:
+        '''Returns the first context from `index` on that the condition holds in, or None if there is none.'''
+
+        starts, ends = self.evaluate(signals)
+        k = bisect_right(ends, index)
+
+        return max(starts[k], index) if k < len(starts) else None
+
+    def last_at_or_before(self, signals: TraceSignals, index: int) -> int | None:
+        '''Returns the last context up to `index` that the condition holds in, or None if there is none.'''
+
+        starts, ends = self.evaluate(signals)
+        k = bisect_right(starts, index) - 1
+
+        return min(ends[k] - 1, index) if k >= 0 else None
+
+    def evaluate(self, signals: TraceSignals) -> tuple[array, array]:
+        '''Returns the starts and (exclusive) ends of the ranges of contexts the condition holds in.
+
+           Every term is only evaluated where its operand changes, and the terms are only combined
+           where one of them changes, so the cost depends on the number of changes, not on the length of the trace.'''
+
+        signals.update()
+        num_contexts = len(signals)
+
+        if self._intervals is not None and self._intervals[0] == num_contexts:
+            return self._intervals[1:]
+
+        terms = [self._evaluate_term(signals.signal(name), predicate, num_contexts)
+                 for clause in self._clauses for name, predicate in clause]
+
+        # the positions of every clause's terms in `terms`
+        clause_terms, pos = [], 0
+        for clause in self._clauses:
+            clause_terms.append(range(pos, pos + len(clause)))
+            pos += len(clause)
+
+        current = [False] * len(terms)
+        cursors = [0] * len(terms)
+        starts, ends = array('I'), array('I')
+        holds = False
+
+        for index in sorted(set().union(*(term.indices for term in terms))):
+            for t, term in enumerate(terms):
+                cursor = cursors[t]
+                if cursor < len(term.indices) and term.indices[cursor] == index:
+                    current[t] = term.values[cursor]
+                    cursors[t] = cursor + 1
+
+            now_holds = any(all(current[t] for t in clause) for clause in clause_terms)
+            if now_holds != holds:
+                (starts if now_holds else ends).append(index)
+                holds = now_holds
+
+        if holds:
+            ends.append(num_contexts)
+
+        self._intervals = (num_contexts, starts, ends)
+
+        return starts, ends
+
+
+    @staticmethod
+    def _parse_term(term: str) -> tuple[str, Callable[[int], bool] | None]:
+        if (match := _change_pattern.fullmatch(term)) is not None:
+            return match[1], None
+
+        match = _comparison_pattern.fullmatch(term)
+        if match is None:
+            raise ValueError(f'Invalid condition: { term }')
+
+        name, op, value = match.groups()
+
+        try:
+            value = int(value, 0)
+        except ValueError:
+            raise ValueError(f'Invalid value: { value }') from None
+
+        compare = _comparisons[op]
+        return name, lambda operand: compare(operand, value)
+
+    @staticmethod
+    def _evaluate_term(signal: Signal, predicate: Callable[[int], bool] | None, num_contexts: int) -> Signal:
+        '''Returns the boolean signal of a term.'''
+
+        if predicate is not None:
+            return signal.map(predicate)
+
+        # `changed` only holds in the contexts the value changes at
+        indices, values = array('I', [0]), [False]
+        for index in signal.indices[1:]:
+            if indices[-1] == index:
+                values[-1] = True
+            else:
+                indices.append(index)
+                values.append(True)
+
+            if index + 1 < num_contexts:
+                indices.append(index + 1)
+                values.append(False)
+
+        return Signal(indices, values)
+
+
+
+class BreakpointEngine():
+    '''Finds the contexts of a recorded trace that hit a breakpoint, a conditional breakpoint or a watchpoint.'''
+
+    def __init__(self,
+                 program: ExecutedProgram):
+
+        self.program = program
+        '''The program whose trace is searched.'''
+        self.occurrences = LineOccurrences(program)
+        '''The contexts executing each line of the code.'''
+        self.signals = TraceSignals(program)
+        '''The registers and symbols over the trace, used to evaluate the conditions.'''
+
+
+    def next_hit(self,
+                 breakpoints: dict[int, Condition | None],
+                 watchpoints: Iterable[Condition],
+                 index: int) -> int | None:
+        '''Returns the first context after `index` that hits a breakpoint (mapping instruction addresses
+           to their conditions, `None` if unconditional) or a watchpoint, or None if there is none.'''
+
+        hits = []
+
+        unconditional = [self.program.code.index_of_address(addr) for addr, cond in breakpoints.items() if cond is None]
+        if unconditional:
+            hits.append(self.occurrences.next_hit(unconditional, index))
+
+        for addr, cond in breakpoints.items():
+            if cond is not None:
+                hits.append(self._next_conditional_hit(self.program.code.index_of_address(addr), cond, index))
+
+        for cond in watchpoints:
+            hits.append(cond.first_at_or_after(self.signals, index + 1))
+
+        return min((hit for hit in hits if hit is not None), default=None)
+
+    def previous_hit(self,
+                     breakpoints: dict[int, Condition | None],
+                     watchpoints: Iterable[Condition],
+                     index: int) -> int | None:
+        '''Returns the last context before `index` that hits a breakpoint or a watchpoint, or None if there is none.'''
+
+        if index <= 0:
+            return None
+
+        hits = []
+
+        unconditional = [self.program.code.index_of_address(addr) for addr, cond in breakpoints.items() if cond is None]
+        if unconditional:
+            hits.append(self.occurrences.previous_hit(unconditional, index))
+
+        for addr, cond in breakpoints.items():
+            if cond is not None:
+                hits.append(self._previous_conditional_hit(self.program.code.index_of_address(addr), cond, index))
+
+        for cond in watchpoints:
+            hits.append(cond.last_at_or_before(self.signals, index - 1))
+
+        return max((hit for hit in hits if hit is not None), default=None)
+
+
+    def _next_conditional_hit(self, line_idx: int, cond: Condition, index: int) -> int | None:
+        '''Leapfrogs between the occurrences of the line and the ranges the condition holds in.'''
+
+        occurrences = self.occurrences.of_line(line_idx)
+        starts, ends = cond.evaluate(self.signals)
+
+        candidate = index + 1
+        while True:
+            pos = bisect_left(occurrences, candidate)
+            if pos == len(occurrences):
+                return None
+
+            candidate = occurrences[pos]
+            k = bisect_right(starts, candidate) - 1
+            if k >= 0 and candidate < ends[k]:
+                return candidate
+
+            if k + 1 == len(starts):
+                return None
+
+            candidate = starts[k + 1]
+
+    def _previous_conditional_hit(self, line_idx: int, cond: Condition, index: int) -> int | None:
+        occurrences = self.occurrences.of_line(line_idx)
+        starts, ends = cond.evaluate(self.signals)
+
+        candidate = index - 1
+        while candidate >= 0:
+            pos = bisect_right(occurrences, candidate) - 1
+            if pos < 0:
+                return None
+
+            candidate = occurrences[pos]
+            k = bisect_right(starts, candidate) - 1
+            if k < 0:
+                return None
+
+            if candidate < ends[k]:
+                return candidate
+
+            candidate = ends[k] - 1
+
+        return None
@@ -1,42 +1,59 @@
 from typing import TYPE_CHECKING
 from utils import *
+from emu_dataclasses import TRUNCATION_INSN_LIMIT, TRUNCATION_TIMEOUT
+from breakpoints import Condition
 import dearpygui.dearpygui as dpg
 
 if TYPE_CHECKING:
-    from gui import GUI
+    from program_tab import ProgramTab
 
 
 
 class CodeWindow():
     '''The window that displays the assembly code.'''
 
+    code_view: int = 0
+    '''The tag of the scrolling window containing the code table.'''
     code_table: int = 0
     '''The tag of the table containing the assembly instructions.'''
-    row_tags: list[int] = []
-    '''The tags of the rows of the table containing the assembly instructions.'''
-    address_tags: list[int] = []
-    '''The tags of the selectable widgets containing the addresses of the assembly instructions.'''
-    text_tags: list[int] = []
-    '''The tags of the text widgets containing the assembly instructions.'''
+    pooled_rows: int = 100
+    '''The number of rows of the code table. Only the lines scrolled into view get a row,
+       the rows are reused for other lines as the code gets scrolled.'''
+    row_margin: int = 10
+    '''The number of lines rendered above the visible ones, so that scrolling does not rebind the rows on every frame.'''
+    first_rendered_row_idx: int = 0
+    '''The index of the line shown in the first row of the code table.'''
     emulation_failed_modal: int = 0
     '''The tag of the modal window that appears when the emulation fails.'''
+    emulation_failed_details: int = 0
+    '''The tag of the text showing what the emulator reported when it failed.'''
     row_height: int = 25
     '''The height of a row in the code table.'''
     highlighted_row_idx: int  = 0
-    '''The index of the currently highlighted row in the code table.'''
+    '''The index of the line of the current instruction.'''
+    _highlighted_table_row: int = -1
+    '''The row of the code table that is currently highlighted, or -1 if none is.'''
     highlighted_code_row_color: tuple[int, int, int, int] = (160, 22, 49, 200)
     '''The color of the highlighted row in the code table.'''
-    breakpoints: list[tuple[int, str]] = []
-    '''The list of breakpoints in the code.
-       A breakpoint is a tuple containing the tag of the selectable widget holding the address
-       and the address of the instruction.'''
 
 
     def __init__(self,
-                 gui: 'GUI'):
-
-        self.gui = gui
-        '''A reference to the main GUI object.'''
+                 tab: 'ProgramTab'):
+
+        self.tab = tab
+        '''The tab whose program the window shows.'''
+        self.row_tags: list[int] = []
+        '''The tags of the rows of the code table.'''
+        self.address_tags: list[int] = []
+        '''The tags of the selectable widgets containing the addresses of the assembly instructions, per row.'''
+        self.text_tags: list[int] = []
+        '''The tags of the text widgets containing the assembly instructions, per row.'''
+        self.breakpoints: dict[int, Condition | None] = {}
+        '''The breakpoints in the code, mapping the addresses of their instructions to their conditions,
+           or to `None` if they are unconditional.
+           The selectable widget of a breakpoint is found through the line index of its address.'''
+        self.watchpoints: list[Condition] = []
+        '''The conditions that stop the execution in any context they hold in, e.g. `counter changed`.'''
 
 
         with dpg.child_window(auto_resize_x=True) as self.window:
@@ -45,10 +62,21 @@ class CodeWindow():
 
                 dpg.add_text(default_value='Assembly code')
                 dpg.add_spacer(width=15)
-                dpg.add_button(label="Previous", tag='#prev', callback=self.gui.step, user_data=-1)
-                dpg.add_button(label="Next", tag='#next', callback=self.gui.step, user_data=1)
-                dpg.add_button(label="Continue", tag='#cont', callback=self.gui.continue_until_breakpoint, user_data=1)
-                dpg.add_button(label="Reset", tag='#reset', callback=self.gui.reset)
+                dpg.add_button(label="Previous", callback=self.tab.step, user_data=-1)
+                dpg.add_button(label="Next", callback=self.tab.step, user_data=1)
+                dpg.add_button(label="Back", callback=self.tab.continue_until_breakpoint, user_data=-1)
+                dpg.add_button(label="Continue", callback=self.tab.continue_until_breakpoint, user_data=1)
+                dpg.add_button(label="Reset", callback=self.tab.reset)
+
+            with dpg.group(horizontal=True):
+
+                self.condition_input = dpg.add_input_text(hint='Condition, e.g. RCX == 0 or counter changed', width=330)
+                '''The condition attached to the next breakpoint that gets set, or added as a watchpoint.'''
+                dpg.add_button(label="Watch", callback=self.add_watchpoint)
+                dpg.add_button(label="Clear", callback=self.clear_watchpoints)
+
+            self.conditions_text = dpg.add_text(wrap=500)
+            '''The text listing the conditions of the breakpoints and the watchpoints, or an error.'''
 
             dpg.add_separator()
 
@@ -62,29 +90,111 @@ class CodeWindow():
 
 
     def build_code_table(self):
-        '''Builds the table containing the instructions extracted by the emulator's preprocessor.'''
+        '''Builds the code table, once. Its rows are reused for every program that gets loaded.
+
+           The spacers above and below the table stand in for the lines that are not rendered,
+           so that the scrollbar covers the whole code.'''
+
+        if dpg.does_item_exist(self.code_table):
+            return
+
+        with dpg.child_window(parent=self.assembly_code_tab, border=False, horizontal_scrollbar=True) as self.code_view:
+
+            self.top_spacer = dpg.add_spacer(height=0)
+
+            with dpg.table(header_row=False, row_background=False, resizable=False,
+                           policy=dpg.mvTable_SizingFixedFit) as self.code_table:
+
+                dpg.add_table_column()
+                dpg.add_table_column()
+
+                for _ in range(self.pooled_rows):
+                    with dpg.table_row(height=self.row_height, show=False) as row:
+
+                        self.row_tags.append(row)
+
+                        addr = dpg.add_selectable(label='', callback=self.set_breakpoint, user_data=0)
+                        dpg.bind_item_theme(addr, self.tab.gui.addr_selectable_theme)
+                        self.address_tags.append(addr)
+
+                        text = dpg.add_text('')
+                        self.text_tags.append(text)
+
+            self.bottom_spacer = dpg.add_spacer(height=0)
+
+            with dpg.group(show=False) as self.program_end_group:
+                dpg.add_spacer(height=100)
+                self.program_end_text = dpg.add_text("Execution done.", color=(255, 0, 0, 255), wrap=300)
+
+        # scrolling is only visible from the scroll position, so it is checked on every frame the code is shown
+        with dpg.item_handler_registry() as self.code_view_handlers:
+            dpg.add_item_visible_handler(callback=self.render_scrolled_rows)
+        dpg.bind_item_handler_registry(self.code_view, self.code_view_handlers)
+
+    def render_rows(self, first_row_idx: int):
+        '''Binds the rows of the code table to the lines starting at `first_row_idx`.'''
+
+        code = self.tab.program.code
+        first_row_idx = max(0, min(first_row_idx, code.num_lines - self.pooled_rows))
+        num_rendered = min(self.pooled_rows, code.num_lines - first_row_idx)
+
+        self.first_rendered_row_idx = first_row_idx
+        dpg.configure_item(self.top_spacer, height=first_row_idx * self.row_height)
+        dpg.configure_item(self.bottom_spacer, height=(code.num_lines - first_row_idx - num_rendered) * self.row_height)
+
+        for pos in range(self.pooled_rows):
+            if pos >= num_rendered:
+                dpg.hide_item(self.row_tags[pos])
+                continue
+
+            line_idx = first_row_idx + pos
+            dpg.set_item_label(self.address_tags[pos], f'{ code.addresses[line_idx]:#08x}:')
+            dpg.set_item_user_data(self.address_tags[pos], line_idx)
+            dpg.set_value(self.text_tags[pos], code.lines[line_idx])
+            dpg.show_item(self.row_tags[pos])
+
+        self.refresh_rows()
+
+    def refresh_rows(self):
+        '''Updates the highlight of the current line and the colors of the rendered addresses.'''
+
+        if self._highlighted_table_row != -1:
+            dpg.unhighlight_table_row(self.code_table, row=self._highlighted_table_row)
+            self._highlighted_table_row = -1
+
+        code = self.tab.program.code
+        num_rendered = min(self.pooled_rows, code.num_lines - self.first_rendered_row_idx)
 
-        with dpg.table(parent=self.assembly_code_tab, header_row=False, row_background=False, scrollX=True,
-                       resizable=False, policy=dpg.mvTable_SizingFixedFit) as self.code_table:
+        for pos in range(num_rendered):
+            line_idx = self.first_rendered_row_idx + pos
 
-            dpg.add_table_column()
-            dpg.add_table_column()
+            if line_idx == self.highlighted_row_idx:
+                # color the highlighted row's address text to white so it can be seen better
+                theme = self.tab.gui.white_text
+                dpg.highlight_table_row(self.code_table, row=pos, color=self.highlighted_code_row_color)
+                self._highlighted_table_row = pos
+            elif code.addresses[line_idx] in self.breakpoints:
+                theme = self.tab.gui.break_point_theme
+            else:
+                theme = self.tab.gui.addr_selectable_theme
+
+            dpg.bind_item_theme(self.address_tags[pos], theme=theme)
 
-            for line, address in zip(self.gui.program.code.lines, self.gui.program.code.addresses):
-                with dpg.table_row(parent=self.code_table) as row:
+    def render_scrolled_rows(self):
+        '''Rebinds the rows of the code table if the visible lines are no longer all rendered.'''
 
-                    self.row_tags.append(row)
+        if self.tab.program is None or self.tab.program.code.num_lines == 0:
+            return
 
-                    addr = dpg.add_selectable(label=f'{address:#08x}:', callback=self.set_breakpoint)
-                    dpg.set_item_user_data(item=addr, user_data=addr)
-                    dpg.bind_item_theme(addr, self.gui.addr_selectable_theme)
-                    self.address_tags.append(addr)
+        first_visible = int(dpg.get_y_scroll(self.code_view)) // self.row_height
+        num_visible = dpg.get_item_rect_size(self.code_view)[1] // self.row_height + 1
 
-                    text = dpg.add_text(line)
-                    self.text_tags.append(text)
+        if (first_visible < self.first_rendered_row_idx
+                or first_visible + num_visible > self.first_rendered_row_idx + self.pooled_rows):
+            self.render_rows(first_visible - self.row_margin)
 
-    def show_error_message(self):
-        '''Shows an error message when the emulation fails.'''
+    def show_error_message(self, details: str = ''):
+        '''Shows an error message when the emulation fails, along with the `details` the emulator reported.'''
 
         if not dpg.does_item_exist(self.emulation_failed_modal):
             pos = calculate_dialog_position(350, 150)
@@ -92,7 +202,12 @@ class CodeWindow():
                             modal=True, no_resize=True, no_move=True) as self.emulation_failed_modal:
 
                 dpg.add_text("The software cannot emulate this source code. Sorry!", color=[255, 0, 0], bullet=True, wrap=300)
-                dpg.add_button(label='  OK  ', pos=[15, 100], callback=lambda: dpg.hide_item(self.emulation_failed_modal))
+                self.emulation_failed_details = dpg.add_text('', wrap=300)
+                dpg.add_spacer(height=10)
+                dpg.add_button(label='  OK  ', callback=lambda: dpg.hide_item(self.emulation_failed_modal))
+
+        dpg.set_value(self.emulation_failed_details, details)
+        dpg.configure_item(self.emulation_failed_details, show=details != '')
 
         if dpg.is_item_shown(self.emulation_failed_modal):
             dpg.hide_item(self.emulation_failed_modal)
@@ -102,15 +217,15 @@ class CodeWindow():
     def reset_code_window(self):
         '''Resets the code window to a clean state.'''
 
-        if dpg.does_item_exist(self.code_table):
-            dpg.delete_item(self.code_table)
-
         self.breakpoints.clear()
+        self.watchpoints.clear()
+        dpg.set_value(self.conditions_text, '')
 
         self.highlighted_row_idx = 0
-        self.row_tags.clear()
-        self.address_tags.clear()
-        self.text_tags.clear()
+
+        if dpg.does_item_exist(self.code_view):
+            dpg.hide_item(self.program_end_group)
+            dpg.set_y_scroll(self.code_view, 0)
 
     def initialize_code_window(self):
         '''Initializes the code window.'''
@@ -118,81 +233,130 @@ class CodeWindow():
         self.reset_code_window()
 
         self.build_code_table()
+        self.render_rows(0)
         self.update_code_window()
 
-        raw_assembly = open(self.gui.file_path, 'r').read()
+        raw_assembly = open(self.tab.file_path, 'r').read()
         dpg.set_value(self.raw_assembly_text, raw_assembly)
 
 
     def update_code_window(self):
         '''Updates the code window to match the current execution context.'''
 
-        dpg.unhighlight_table_row(self.code_table, row=self.highlighted_row_idx)
+        self.highlighted_row_idx = self.tab.program.get_current_context().insn.index
 
-        # color the previously highlighted row's address text back to address theme
-        dpg.bind_item_theme(self.address_tags[self.highlighted_row_idx], theme=self.gui.addr_selectable_theme)
+        # scrolling renders the rows itself, otherwise only the highlight and the colors change
+        if not self.update_code_window_scroll_position(self.highlighted_row_idx):
+            self.refresh_rows()
 
-        self.highlighted_row_idx = self.gui.program.get_current_context().insn.index
-        dpg.highlight_table_row(self.code_table, row=self.highlighted_row_idx, color=self.highlighted_code_row_color)
+    def update_code_window_scroll_position(self, row_idx: int) -> bool:
+        '''Scrolls the line at `row_idx` to the middle of the code window if it is not visible.
 
-        # color the highlighted row's address text to white so it can be seen better
-        dpg.bind_item_theme(self.address_tags[self.highlighted_row_idx], theme=self.gui.white_text)
+           Returns: whether the code window got scrolled.'''
 
-        for bp in self.breakpoints:
-            dpg.bind_item_theme(bp[0], theme=self.gui.break_point_theme)
+        scroll = dpg.get_y_scroll(self.code_view)
+        view_height = dpg.get_item_rect_size(self.code_view)[1]
+        row_y = row_idx * self.row_height
 
-        self.update_code_window_scroll_position(self.highlighted_row_idx)
+        if scroll <= row_y and row_y + self.row_height <= scroll + view_height:
+            return False
 
-    def update_code_window_scroll_position(self, row_idx: int):
-        # only do the calculations if the the row is not visible
-        if dpg.is_item_visible(self.address_tags[self.highlighted_row_idx]):
-            return
+        scroll = max(0, row_y - view_height // 2)
+        dpg.set_y_scroll(self.code_view, scroll)
 
-        row_y = self.highlighted_row_idx * self.row_height
+        # the new scroll position only takes effect on the next frame, so the rows are rendered right away
+        self.render_rows(scroll // self.row_height - self.row_margin)
 
-        # if row_y is closer to the top of the code window, scroll to the top, else scroll to the bottom
-        if row_y < dpg.get_viewport_client_height() - row_y:
-            scroll_height = 0
+        return True
+
+    def set_breakpoint(self, sender, app_data, user_data: int):
+        '''Toggles the breakpoint on the line at index `user_data`, attaching the condition typed in, if any.'''
+
+        addr = self.tab.program.code.addresses[user_data]
+
+        if addr in self.breakpoints:
+            del self.breakpoints[addr]
         else:
-            scroll_height = self.row_height * self.gui.program.contexts[len(self.gui.program.contexts) - 1].insn.index
+            condition = None
+            if dpg.get_value(self.condition_input).strip():
+                condition = self.parse_condition()
+                if condition is None:
+                    return
 
-        dpg.set_y_scroll(self.code_table, scroll_height)
+            self.breakpoints[addr] = condition
 
-    def set_breakpoint(self, sender, app_data, user_data):
-        dpg.bind_item_theme(item=user_data, theme=self.gui.break_point_theme)
+        self.refresh_rows()
+        self.update_conditions_text()
 
-        addr_text = int(dpg.get_item_label(user_data)[:-1], 16)
-        bp = (user_data, addr_text)
+    def add_watchpoint(self):
+        '''Adds the condition typed in as a watchpoint.'''
 
-        if bp in self.breakpoints:
-            self.breakpoints.remove(bp)
+        if dpg.get_value(self.condition_input).strip() and (condition := self.parse_condition()) is not None:
+            self.watchpoints.append(condition)
+            dpg.set_value(self.condition_input, '')
+            self.update_conditions_text()
 
-            is_highlighted_row = user_data == self.address_tags[self.highlighted_row_idx]
-            if is_highlighted_row:
-                dpg.bind_item_theme(item=user_data, theme=self.gui.white_text)
-            else:
-                dpg.bind_item_theme(item=user_data, theme=self.gui.addr_selectable_theme)
-        else:
-            self.breakpoints.append(bp)
+    def clear_watchpoints(self):
+        '''Removes every watchpoint.'''
 
-        sorted(self.breakpoints, key=lambda x: x[1])
+        self.watchpoints.clear()
+        self.update_conditions_text()
 
-    def indicate_program_end(self):
-        if not dpg.does_item_exist(self.code_table):
-            return
+    def parse_condition(self) -> Condition | None:
+        '''Compiles the condition typed in, or shows why it cannot be used and returns None.'''
 
-        if not dpg.does_item_exist("program_end_row_1"):
-            with dpg.table_row(parent=self.code_table, height=100, tag="program_end_row_1"):
-                pass
+        if self.tab.breakpoint_engine is None:
+            self.show_condition_error('Conditions need a recorded trace, they are not available in live mode.')
+            return None
 
-        if not dpg.does_item_exist("program_end_row_2"):
-            with dpg.table_row(parent=self.code_table, tag="program_end_row_2"):
-                dpg.add_text("Execution done.", color=(255, 0, 0, 255), wrap=90)
+        try:
+            condition = Condition(dpg.get_value(self.condition_input))
+        except ValueError as ex:
+            self.show_condition_error(str(ex))
+            return None
+
+        unknown = [name for name in condition.operands() if not self.tab.breakpoint_engine.signals.has_operand(name)]
+        if unknown:
+            self.show_condition_error(f'Unknown register or symbol: { unknown[0] }')
+            return None
+
+        return condition
+
+    def show_condition_error(self, message: str):
+        '''Shows why a condition cannot be used in place of the list of conditions.'''
+
+        dpg.set_value(self.conditions_text, message)
+        dpg.configure_item(self.conditions_text, color=(255, 0, 0))
+
+    def update_conditions_text(self):
+        '''Lists the conditions of the breakpoints and the watchpoints.'''
+
+        conditions = [f'{ addr:#08x}: { cond }' for addr, cond in sorted(self.breakpoints.items()) if cond is not None]
+        conditions += [f'watch: { cond }' for cond in self.watchpoints]
+
+        dpg.set_value(self.conditions_text, '   '.join(conditions))
+        dpg.configure_item(self.conditions_text, color=(255, 255, 255))
+
+    def get_program_end_message(self) -> str:
+        '''Returns the message shown after the last recorded instruction.'''
+
+        ex_info = self.tab.program.ex_info
+
+        if ex_info.truncation_reason == TRUNCATION_INSN_LIMIT:
+            return f"Execution stopped after { ex_info.insn_count } instructions (instruction limit)."
+        if ex_info.truncation_reason == TRUNCATION_TIMEOUT:
+            return f"Execution stopped after { ex_info.insn_count } instructions (time limit)."
+
+        return "Execution done."
+
+    def indicate_program_end(self):
+        if not dpg.does_item_exist(self.code_view):
+            return
 
-        if self.gui.program_ended:
-            dpg.show_item("program_end_row_1")
-            dpg.show_item("program_end_row_2")
-            dpg.set_y_scroll(self.code_table, 999999)
+        if self.tab.program_ended:
+            dpg.set_value(self.program_end_text, self.get_program_end_message())
+            dpg.show_item(self.program_end_group)
+            dpg.set_y_scroll(self.code_view, 999999)
+            self.render_rows(self.tab.program.code.num_lines - self.pooled_rows)
         else:
-            dpg.hide_item("program_end_row_1")
-            dpg.hide_item("program_end_row_2")
+            dpg.hide_item(self.program_end_group)
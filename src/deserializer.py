@@ -1,7 +1,100 @@
+import mmap
+import struct
+from array import array
+from typing import BinaryIO, Iterator
 from emu_dataclasses import *
+from trace_store import TraceStore, DeltaIndex, DEFAULT_KEYFRAME_INTERVAL
+from trace_columns import TraceColumns, COLUMNAR_STORE_ENABLED
 from utils import *
 
 
+SERIALIZED_OUTPUT_PATH = '/tmp/emu_output_240830.txt'
+'''The path of the file the emulator writes its output to.'''
+SERIALIZED_OUTPUT_NAME = 'emu_output'
+'''The name of the file the emulator writes its output to inside the work directory passed with `--workdir`.'''
+SERIALIZER_STDOUT = '-'
+'''The output path that makes the emulator stream its output to stdout.'''
+
+TRACE_MAGIC = b'HOHOTRC\0'
+'''The magic bytes at the start of a binary trace.'''
+TRACE_FORMAT_VERSION = 3
+'''The version of the binary trace format this deserializer understands.'''
+
+REC_ASSEMBLY = 1
+REC_REGISTER_NAMES = 2
+REC_LAYOUT = 3
+REC_CONTEXT = 4
+REC_END = 5
+REC_DELTA = 6
+REC_POSITION = 7
+REC_MEMORY = 8
+REC_TRUNCATED = 9
+
+_trace_header = struct.Struct('<8sII')
+'''magic | version | reserved'''
+_record_header = struct.Struct('<HHI')
+'''type | reserved | payload length'''
+_segment_header = struct.Struct('<QQH')
+'''address | size | number of symbols'''
+_symbol_header = struct.Struct('<QQH')
+'''address | size | name length'''
+_delta_header = struct.Struct('<iIQ16sHH')
+'''instruction index | instruction size | instruction address | bytecode | number of changed registers | number of writes'''
+_delta_line_index = struct.Struct('<i')
+'''instruction index, the first field of a delta record'''
+_write_header = struct.Struct('<QI')
+'''address | size'''
+_truncated_record = struct.Struct('<II')
+'''truncation reason | number of executed instructions'''
+_end_record = struct.Struct('<I')
+'''number of executed instructions'''
+
+
+
+def read_binary_header(stream: BinaryIO) -> None:
+    '''Reads and checks the header at the start of a binary trace.'''
+
+    header = stream.read(_trace_header.size)
+    if len(header) != _trace_header.size:
+        raise EOFError('the trace ended before its header')
+
+    check_binary_header(header)
+
+def check_binary_header(header: bytes) -> None:
+    '''Checks the magic bytes and the version at the start of a binary trace.'''
+
+    magic, version, _ = _trace_header.unpack_from(header, 0)
+    if magic != TRACE_MAGIC:
+        raise ValueError('not a binary trace')
+    if version != TRACE_FORMAT_VERSION:
+        raise ValueError(f'Unsupported trace format version: {version}')
+
+def read_binary_record(stream: BinaryIO) -> tuple[int, memoryview] | None:
+    '''Reads the next record of a binary trace.
+
+       Returns: the type and the payload of the record, or `None` if the stream ended.'''
+
+    header = stream.read(_record_header.size)
+    if not header:
+        return None
+
+    if len(header) != _record_header.size:
+        raise EOFError('the trace ended in the middle of a record')
+
+    rec_type, _, length = _record_header.unpack(header)
+
+    payload = stream.read(length)
+    if len(payload) != length:
+        raise EOFError('the trace ended in the middle of a record')
+
+    return rec_type, memoryview(payload)
+
+def decode_binary_line_index(buffer: bytes | bytearray, offset: int) -> int:
+    '''Decodes only the code line index of the delta record whose payload starts at `offset` in `buffer`.'''
+
+    return _delta_line_index.unpack_from(buffer, offset)[0]
+
+
 
 class Deserializer():
     '''A class that deserializes the output of the emulator.'''
@@ -12,18 +105,260 @@ class Deserializer():
     '''The deserialized `ExecutedProgram`.'''
 
 
-    def __init__(self):
-        self._program = create_empty_executed_program()
+    def __init__(self,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+                 program: ExecutedProgram = None):
 
+        self._program = program if program is not None else create_empty_executed_program()
+        self.keyframe_interval = keyframe_interval
+        '''The number of contexts between two keyframes of the `TraceStore` built from binary traces.'''
 
-    def get_executed_program(self) -> ExecutedProgram:
-        '''Returns the deserialized `ExecutedProgram`.'''
+
+    def get_executed_program(self, path: str = SERIALIZED_OUTPUT_PATH) -> ExecutedProgram:
+        '''Returns the `ExecutedProgram` deserialized from the trace file the emulator wrote to `path`.'''
 
         self._program = create_empty_executed_program()
-        self._input = open('/tmp/emu_output_240830.txt', 'r').read()
+
+        with open(path, 'rb') as file:
+            # the text format is only produced when the emulator was asked for it for debugging purposes
+            if file.peek(len(TRACE_MAGIC)).startswith(TRACE_MAGIC):
+                # the mapping stays valid after the file gets closed
+                return self.parse_mapped_trace(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+            self._input = file.read().decode()
 
         return self.parse_input_file()
 
+    def parse_mapped_trace(self, trace: mmap.mmap) -> ExecutedProgram:
+        '''Parses a memory-mapped binary trace and returns an `ExecutedProgram`.
+
+           Only the offsets of the delta records get stored, they are decoded when their contexts
+           are accessed, so loading takes time and memory proportional to the number of records only.'''
+
+        check_binary_header(trace)
+
+        self._program.deltas = DeltaIndex(trace, self.decode_binary_context_delta, decode_binary_line_index)
+
+        offset = _trace_header.size
+        while offset < len(trace):
+            rec_type, _, length = _record_header.unpack_from(trace, offset)
+            offset += _record_header.size
+
+            if rec_type == REC_DELTA:
+                self._program.deltas.add(offset)
+            elif rec_type == REC_END:
+                self.deserialize_binary_end(memoryview(trace[offset:offset + length]))
+                break
+            else:
+                self.deserialize_binary_record(rec_type, memoryview(trace[offset:offset + length]))
+
+            offset += length
+
+        if self._program.initial_state is None:
+            raise ValueError('the trace does not hold any execution contexts')
+
+        self._program.contexts.is_complete = True
+
+        return self._program
+
+    def stream_binary_trace(self, stream: BinaryIO) -> Iterator[int]:
+        '''Parses a binary trace record by record as it is read from `stream`, which can be a pipe
+           the emulator is still writing to. Yields the type of every deserialized record.
+
+           The program being built is available through `program` while the trace is streamed,
+           its contexts as soon as the first one has been deserialized.'''
+
+        read_binary_header(stream)
+
+        self._program.deltas = DeltaIndex(bytearray(), self.decode_binary_context_delta, decode_binary_line_index)
+
+        while (record := read_binary_record(stream)) is not None:
+            rec_type, payload = record
+
+            if rec_type == REC_END:
+                self.deserialize_binary_end(payload)
+                break
+
+            self.deserialize_binary_record(rec_type, payload)
+
+            yield rec_type
+
+        if self._program.initial_state is None:
+            raise ValueError('the trace does not hold any execution contexts')
+
+        self._program.contexts.is_complete = True
+
+    @property
+    def program(self) -> ExecutedProgram:
+        '''The `ExecutedProgram` being deserialized.'''
+
+        return self._program
+
+    def deserialize_binary_record(self, rec_type: int, payload: memoryview) -> None:
+        '''Deserializes a single binary record into the `ExecutedProgram` being built.'''
+
+        if rec_type == REC_DELTA:
+            self.deserialize_binary_context_delta(payload)
+        elif rec_type == REC_CONTEXT:
+            self.deserialize_binary_execution_context(payload)
+        elif rec_type == REC_ASSEMBLY:
+            self.deserialize_binary_assembly(payload)
+        elif rec_type == REC_REGISTER_NAMES:
+            self.deserialize_binary_register_names(payload)
+        elif rec_type == REC_LAYOUT:
+            self.deserialize_binary_mem_layout(payload)
+        elif rec_type == REC_TRUNCATED:
+            self.deserialize_binary_truncation(payload)
+
+    def deserialize_binary_assembly(self, payload: memoryview) -> None:
+        '''Deserializes the assembly code from a binary record.'''
+
+        num_lines, = struct.unpack_from('<I', payload, 0)
+        offset = 4
+        instructions = []
+        addresses = []
+
+        for _ in range(num_lines):
+            addr, length = struct.unpack_from('<QH', payload, offset)
+            offset += 10
+            addresses.append(addr)
+            instructions.append(str(payload[offset:offset + length], 'utf-8').rstrip())
+            offset += length
+
+        self._program.code = AssemblyCode(instructions, addresses, num_lines)
+
+    def deserialize_binary_register_names(self, payload: memoryview) -> None:
+        '''Deserializes the names of the registers stored in every execution context.'''
+
+        num_regs, = struct.unpack_from('<H', payload, 0)
+        offset = 2
+        self._program.register_names = []
+
+        for _ in range(num_regs):
+            length = payload[offset]
+            self._program.register_names.append(str(payload[offset + 1:offset + 1 + length], 'ascii'))
+            offset += 1 + length
+
+    def _unpack_binary_segment(self, payload: memoryview, offset: int) -> tuple[tuple, int]:
+        '''Unpacks a segment and its symbol table from a binary record.
+
+           Returns: the segment's (address, size, number of symbols, bytes, symbols) and the offset after it.'''
+
+        addr, size, num_symbols = _segment_header.unpack_from(payload, offset)
+        offset += _segment_header.size
+        seg_bytes = bytes(payload[offset:offset + size])
+        offset += size
+
+        symbols = []
+        for _ in range(num_symbols):
+            sym_addr, sym_size, name_len = _symbol_header.unpack_from(payload, offset)
+            offset += _symbol_header.size
+            symbols.append((str(payload[offset:offset + name_len], 'utf-8'), sym_addr, sym_size))
+            offset += name_len
+
+        return (addr, size, num_symbols, seg_bytes, symbols), offset
+
+    def deserialize_binary_mem_layout(self, payload: memoryview) -> None:
+        '''Deserializes the memory layout and the static segments from a binary record.'''
+
+        text_start, bss_end, stack_start, stack_end, main_addr, stack_bytes = struct.unpack_from('<5QH', payload, 0)
+        offset = 42
+
+        self._program.mem_layout = MemoryLayout(text_start, bss_end, stack_start, stack_end)
+
+        text, offset = self._unpack_binary_segment(payload, offset)
+        rodata, offset = self._unpack_binary_segment(payload, offset)
+        data, offset = self._unpack_binary_segment(payload, offset)
+        bss, offset = self._unpack_binary_segment(payload, offset)
+
+        self._program.static_mem = StaticMemory(
+            text=TextSegment(
+                name='text',
+                main_addr=main_addr,
+                addr=text[0],
+                size=text[1],
+                bytes=text[3],
+                num_symbols=text[2],
+                symbols=[]),
+            rodata=self._build_binary_segment('rodata', rodata))
+
+        self._program.dynamic_mem = DynamicMemory(
+            data=self._build_binary_segment('data', data),
+            bss=self._build_binary_segment('bss', bss))
+
+        self._context_struct = struct.Struct(
+            f'<iIQ16s{len(self._program.register_names)}Q{stack_bytes}s{data[1]}s{bss[1]}s')
+
+    def _build_binary_segment(self, name: str, segment: tuple) -> MemorySegment:
+        '''Builds a memory segment and its relevant symbols from an unpacked binary segment.'''
+
+        addr, size, num_symbols, seg_bytes, symbols = segment
+
+        return MemorySegment(
+            name=name,
+            addr=addr,
+            size=size,
+            bytes=seg_bytes,
+            num_symbols=num_symbols,
+            symbols=[Symbol(sym_name, sym_addr, sym_size, seg_bytes[sym_addr - addr:sym_addr - addr + sym_size])
+                     for sym_name, sym_addr, sym_size in symbols if sym_name not in irrelevant_symbols])
+
+    def deserialize_binary_state(self, payload: memoryview) -> ExecutionState:
+        '''Deserializes the full machine state stored in a binary execution context record.'''
+
+        index, size, addr, bytecode, *reg_values, stack, data, bss = self._context_struct.unpack(payload)
+
+        return ExecutionState((index, size, addr, bytecode[:size]), reg_values,
+                              bytearray(stack), bytearray(data), bytearray(bss))
+
+    def deserialize_binary_execution_context(self, payload: memoryview) -> None:
+        '''Deserializes a full execution context from a binary record.'''
+
+        self._program.initial_state = self.deserialize_binary_state(payload)
+        self._program.contexts = TraceStore(self._program, self.keyframe_interval)
+
+        if COLUMNAR_STORE_ENABLED:
+            self._program.columns = TraceColumns(self._program)
+
+    def deserialize_binary_context_delta(self, payload: memoryview) -> None:
+        '''Stores the changes since the previous execution context from a binary record, to be decoded later.'''
+
+        self._program.deltas.append(payload)
+
+    def decode_binary_context_delta(self, buffer: bytes | bytearray, offset: int) -> ContextDelta:
+        '''Decodes the changes since the previous execution context from the payload of a binary record
+           starting at `offset` in `buffer`.'''
+
+        index, size, addr, bytecode, num_regs, num_writes = _delta_header.unpack_from(buffer, offset)
+        offset += _delta_header.size
+
+        regs = list(struct.iter_unpack('<BQ', buffer[offset:offset + 9 * num_regs]))
+        offset += 9 * num_regs
+
+        writes = []
+        for _ in range(num_writes):
+            write_addr, write_size = _write_header.unpack_from(buffer, offset)
+            offset += _write_header.size
+            writes.append((write_addr, bytes(buffer[offset:offset + write_size])))
+            offset += write_size
+
+        return ContextDelta((index, size, addr, bytecode[:size]), regs, writes)
+
+    def deserialize_binary_truncation(self, payload: memoryview) -> None:
+        '''Deserializes the marker the emulator writes when a limit stopped it before the program ended.'''
+
+        reason, insn_count = _truncated_record.unpack(payload)
+
+        self._program.ex_info.truncation_reason = reason
+        self._program.ex_info.insn_count = insn_count
+
+    def deserialize_binary_end(self, payload: memoryview) -> None:
+        '''Deserializes the record closing the trace, which holds the number of executed instructions.'''
+
+        insn_count, = _end_record.unpack(payload)
+
+        self._program.ex_info.insn_count = insn_count
+
     def parse_input_file(self) -> ExecutedProgram:
         '''Parses the input file and returns an `ExecutedProgram`.'''
 
@@ -35,6 +370,9 @@ class Deserializer():
 
         self.deserialize_insns_execution_contexts(parts[2:])
 
+        if COLUMNAR_STORE_ENABLED:
+            self._program.columns = TraceColumns(self._program)
+
         return self._program
 
     def deserialize_assembly(self, str: str) -> None:
@@ -64,7 +402,7 @@ class Deserializer():
         rodata_symbols: list[Symbol] = []
         for line in lines[7:]:
             parts = line.split(' ')
-            sym_bytes = list(map(int, parts[2:]))
+            sym_bytes = bytes(map(int, parts[2:]))
             rodata_symbols.append(Symbol(parts[1], int(parts[0]), len(sym_bytes), sym_bytes))
 
         # remove irrelevant symbols from the rodata segment
@@ -76,14 +414,14 @@ class Deserializer():
                 main_addr=int(lines[4]),
                 addr=text_data[0],
                 size=text_data[1],
-                bytes=text_data[3:],
+                bytes=bytes(text_data[3:]),
                 num_symbols=text_data[2],
                 symbols=[]),
             rodata=MemorySegment(
                 name='rodata',
                 addr=rodata_data[0],
                 size=rodata_data[1],
-                bytes=text_data[3:],
+                bytes=bytes(rodata_data[3:]),
                 num_symbols=rodata_data[2],
                 symbols=rodata_symbols))
 
@@ -97,6 +435,11 @@ class Deserializer():
             context.has_program_ended = False
 
             line_parts = lines[0].split(' ')
+            if (line_parts[0][0] == '!'):
+                self._program.ex_info.truncation_reason = int(line_parts[0][1:])
+                self._program.ex_info.insn_count = int(line_parts[1])
+                break
+
             if (line_parts[0][0] == '#'):
                 self._program.contexts.append(context)
                 self._program.ex_info.has_stack_overflowed = 1
@@ -104,11 +447,10 @@ class Deserializer():
                 return
 
 
-            reg_values = list(map(int, line_parts))
-            rdict = {k : v for k, v in zip(list(Registers.__dataclass_fields__.keys())[:-1], reg_values)}
-            context.regs = Registers(*reg_values, rdict)
+            # the text format stores the registers in the fixed order of `REGISTER_NAMES`
+            context.regs = Registers(array('Q', map(int, line_parts)))
 
-            context.stack.content.extend(map(int, lines[1].split(' ')))
+            context.stack.content = bytes(map(int, lines[1].split(' ')))
 
 
             data_data = list(map(int, lines[2].split(' ')))
@@ -118,7 +460,7 @@ class Deserializer():
             data_symbols: list[Symbol] = []
             for line in lines[5:5+data_data[2]]:
                 parts = line.split(' ')
-                sym_bytes = list(map(int, parts[2:]))
+                sym_bytes = bytes(map(int, parts[2:]))
                 data_symbols.append(Symbol(parts[1], int(parts[0]), len(sym_bytes), sym_bytes))
 
             # remove irrelevant symbols from the data segment
@@ -128,7 +470,7 @@ class Deserializer():
             bss_symbols: list[Symbol] = []
             for line in lines[5+data_data[2]:5+data_data[2]+bss_data[2]]:
                 parts = line.split(' ')
-                sym_bytes = list(map(int, parts[2:]))
+                sym_bytes = bytes(map(int, parts[2:]))
                 bss_symbols.append(Symbol(parts[1], int(parts[0]), len(sym_bytes), sym_bytes))
 
             # remove irrelevant symbols from the bss segment
@@ -139,14 +481,14 @@ class Deserializer():
                         name='data',
                         addr=data_data[0],
                         size=data_data[1],
-                        bytes=data_data[3:],
+                        bytes=bytes(data_data[3:]),
                         num_symbols=data_data[2],
                         symbols=data_symbols),
                     bss=MemorySegment(
                         name='bss',
                         addr=bss_data[0],
                         size=bss_data[1],
-                        bytes=bss_data[3:],
+                        bytes=bytes(bss_data[3:]),
                         num_symbols=bss_data[2],
                         symbols=bss_symbols))
 
@@ -155,9 +497,9 @@ class Deserializer():
             context.insn = Instruction(
                     index=insn_data[0],
                     text=self._program.code.lines[insn_data[0]],
-                    addr=insn_data[1],
-                    size=insn_data[2],
-                    bytecode=insn_data[2:])
+                    addr=self._program.code.addresses[insn_data[0]],
+                    size=insn_data[1],
+                    bytecode=bytes(insn_data[2:]))
 
             if len(lines) == 6 and lines[5] == '@__@':
                 self._program.ex_info.is_rsp_invalid = 1
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+import dearpygui.dearpygui as dpg
+
+
+
+class DisplayCache():
+    '''Remembers the values the widgets of a section window show, so a refresh only touches the widgets whose
+       value has changed, and highlights the widgets that changed with the last refresh.
+
+       A refresh is done inside `refresh()`, the widgets whose value `changed` reports as changed have to be
+       updated by the caller, the cache only takes care of their highlight.'''
+
+
+    def __init__(self,
+                 highlight_theme: int):
+
+        self.highlight_theme = highlight_theme
+        '''The theme bound to the widgets that changed with the last refresh.'''
+        self._shown: dict[int, object] = {}
+        '''The value shown by each group of widgets, keyed by the first widget of the group.'''
+        self._highlighted: set[int] = set()
+        '''The widgets bound to the highlight theme.'''
+        self._changed: set[int] | None = None
+        '''The widgets changed by the refresh in progress, `None` outside of `refresh()`.'''
+
+
+    @contextmanager
+    def refresh(self):
+        '''Moves the highlight from the widgets changed by the previous refresh to the ones changed by this one.'''
+
+        self._changed = set()
+
+        try:
+            yield self
+        finally:
+            changed, self._changed = self._changed, None
+
+            for widget in self._highlighted - changed:
+                dpg.bind_item_theme(widget, 0)
+            for widget in changed - self._highlighted:
+                dpg.bind_item_theme(widget, self.highlight_theme)
+
+            self._highlighted = changed
+
+    def changed(self, widgets: tuple[int, ...], value, highlight: bool = True) -> bool:
+        '''Records `value` as the one shown by `widgets`, and returns whether it differs from the one shown so far.
+           The widgets get highlighted if they have shown another value before and `highlight` is true.'''
+
+        key = widgets[0]
+        if key in self._shown:
+            if self._shown[key] == value:
+                return False
+
+            if highlight and self._changed is not None:
+                self._changed.update(widgets)
+
+        self._shown[key] = value
+
+        return True
+
+    def remember(self, widgets: tuple[int, ...], value) -> None:
+        '''Records the value `widgets` were created with, so they are not updated until it changes.'''
+
+        self._shown[widgets[0]] = value
+
+    def forget(self, widgets: tuple[int, ...]) -> None:
+        '''Forgets the widgets, e.g. before they get deleted.'''
+
+        self._shown.pop(widgets[0], None)
+        self._highlighted.difference_update(widgets)
+
+    def clear(self) -> None:
+        '''Removes every highlight and forgets every value, so the next refresh updates every widget without
+           highlighting them, e.g. once another program has been loaded.'''
+
+        for widget in self._highlighted:
+            if dpg.does_item_exist(widget):
+                dpg.bind_item_theme(widget, 0)
+
+        self._highlighted.clear()
+        self._shown.clear()
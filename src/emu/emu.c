@@ -1,5 +1,6 @@
 #include <string.h>
 #include <fcntl.h>
+#include <time.h>
 
 #include "emu.h"
 #include "utils.h"
@@ -8,11 +9,102 @@
 
 
 uc_engine *uc;
-uc_hook insn_hook_handle, mem_access_handle, invalid_mem_access_handle;
-uint8_t *stack_content;
+uc_hook insn_hook_handle, mem_access_handle, mem_write_handle, invalid_mem_access_handle;
+uint8_t stack_content[STACK_BYTES_TO_WRITE];
 extern struct MemoryLayout mem_layout;
 extern struct AssemblyText assembly;
 
+// the register values of the previous execution context, used to find the registers that changed
+static uint64_t prev_reg_contents[NUM_OF_REGISTERS_TO_READ];
+static uint8_t changed_reg_slots[NUM_OF_REGISTERS_TO_READ];
+
+// the memory ranges written by the previous instruction, collected by `hook_mem_write`
+static struct MemoryWrite *pending_writes;
+static int num_pending_writes;
+static int pending_writes_cap;
+static uint8_t *written_bytes;
+static size_t written_bytes_cap;
+
+// the size of the memory mapped for the TEXT, RODATA, DATA and BSS segments
+static uint64_t mapped_mem_size;
+
+// why the emulation stopped before the program returned from `main`
+static enum TruncationReason truncation_reason;
+
+
+// every register and sub-register, read one by one before every instruction until the registers were read in a batch
+static const int legacy_x86_64_registers[] = {
+    UC_X86_REG_RAX,    UC_X86_REG_EAX,    UC_X86_REG_AX,   UC_X86_REG_AH,   UC_X86_REG_AL,
+    UC_X86_REG_RBX,    UC_X86_REG_EBX,    UC_X86_REG_BX,   UC_X86_REG_BH,   UC_X86_REG_BL,
+    UC_X86_REG_RCX,    UC_X86_REG_ECX,    UC_X86_REG_CX,   UC_X86_REG_CH,   UC_X86_REG_CL,
+    UC_X86_REG_RDX,    UC_X86_REG_EDX,    UC_X86_REG_DX,   UC_X86_REG_DH,   UC_X86_REG_DL,
+    UC_X86_REG_RSI,    UC_X86_REG_ESI,    UC_X86_REG_SI,   UC_X86_REG_SIL,
+    UC_X86_REG_RDI,    UC_X86_REG_EDI,    UC_X86_REG_DI,   UC_X86_REG_DIL,
+    UC_X86_REG_RBP,    UC_X86_REG_EBP,    UC_X86_REG_BP,   UC_X86_REG_BPL,
+    UC_X86_REG_RSP,    UC_X86_REG_ESP,    UC_X86_REG_SP,   UC_X86_REG_SPL,
+    UC_X86_REG_R8,     UC_X86_REG_R8D,    UC_X86_REG_R8W,  UC_X86_REG_R8B,
+    UC_X86_REG_R9,     UC_X86_REG_R9D,    UC_X86_REG_R9W,  UC_X86_REG_R9B,
+    UC_X86_REG_R10,    UC_X86_REG_R10D,   UC_X86_REG_R10W, UC_X86_REG_R10B,
+    UC_X86_REG_R11,    UC_X86_REG_R11D,   UC_X86_REG_R11W, UC_X86_REG_R11B,
+    UC_X86_REG_R12,    UC_X86_REG_R12D,   UC_X86_REG_R12W, UC_X86_REG_R12B,
+    UC_X86_REG_R13,    UC_X86_REG_R13D,   UC_X86_REG_R13W, UC_X86_REG_R13B,
+    UC_X86_REG_R14,    UC_X86_REG_R14D,   UC_X86_REG_R14W, UC_X86_REG_R14B,
+    UC_X86_REG_R15,    UC_X86_REG_R15D,   UC_X86_REG_R15W, UC_X86_REG_R15B,
+    UC_X86_REG_RIP,    UC_X86_REG_EIP,    UC_X86_REG_IP,
+    UC_X86_REG_RFLAGS, UC_X86_REG_EFLAGS, UC_X86_REG_FLAGS,
+    UC_X86_REG_CS,     UC_X86_REG_DS,     UC_X86_REG_SS,   UC_X86_REG_ES,   UC_X86_REG_FS, UC_X86_REG_GS,
+};
+
+#define NUM_OF_LEGACY_REGISTERS    ( (int)(sizeof(legacy_x86_64_registers) / sizeof(int)) )
+static uint64_t legacy_reg_contents[NUM_OF_LEGACY_REGISTERS];
+
+
+enum CapturePath
+{
+    CAPTURE_PER_REGISTER,   // `uc_reg_read` for every register and sub-register
+    CAPTURE_BATCH,          // a single `uc_reg_read_batch` for the architectural registers
+    NUM_OF_CAPTURE_PATHS,
+};
+
+static enum CapturePath bench_capture_path;
+
+
+enum LiveStopReason
+{
+    LIVE_STOP_NONE,
+    LIVE_STOP_TARGET,       // the requested execution context was reached
+    LIVE_STOP_ADDRESS,      // one of the requested addresses is about to be executed
+    LIVE_STOP_EXIT,         // the program is about to execute its last `ret` instruction
+};
+
+struct LiveSnapshot
+{
+    uc_context *cpu;        // the registers, saved with `uc_context_save`
+    uint8_t *memory;        // the content of the TEXT, RODATA, DATA and BSS segments' mapping
+    uint8_t *stack;         // the content of the whole stack
+};
+
+struct LiveState
+{
+    uint32_t index;                 // the index of the current execution context
+    uint32_t target_index;          // the index the current run stops at
+    uint32_t run_start_index;       // the index the current run started from
+    int64_t end_index;              // the index of the last execution context, or -1 if not reached yet
+    enum LiveStopReason stop_reason;
+
+    uint64_t *stop_addrs;
+    int num_stop_addrs;
+
+    uint64_t insn_addr;             // the address of the instruction about to be executed
+    uint32_t insn_size;             // the size of the instruction about to be executed
+
+    struct LiveSnapshot *snapshots; // snapshots[k] holds the state of the (k * LIVE_SNAPSHOT_INTERVAL)-th context
+    int num_snapshots;
+    int snapshots_cap;
+};
+
+static struct LiveState live;
+
 
 static uc_err _uc_err_check(uc_err err, const char *expr)
 {
@@ -42,22 +134,52 @@ static uc_err _uc_err_check(uc_err err, const char *expr)
 
 
 
+/**
+ * @brief Read and save the contents of the registers listed in `x86_64_registers` with a single Unicorn call
+ */
+static void capture_registers()
+{
+    static void *reg_content_ptrs[NUM_OF_REGISTERS_TO_READ];
+
+    if (reg_content_ptrs[0] == NULL)
+    {
+        for (int i = 0; i < NUM_OF_REGISTERS_TO_READ; i++)
+            reg_content_ptrs[i] = &reg_contents[i];
+    }
+
+    if (UC_ERR_CHECK( uc_reg_read_batch(uc, (int *)x86_64_registers, reg_content_ptrs, NUM_OF_REGISTERS_TO_READ) ))
+        ABORT()
+}
+
+/**
+ * @brief Read every register and sub-register one by one, the way the registers used to be captured;
+ *        only kept to compare against `capture_registers` in the benchmark mode
+ */
+static void capture_registers_per_register()
+{
+    for (int i = 0; i < NUM_OF_LEGACY_REGISTERS; i++)
+    {
+        if (UC_ERR_CHECK( uc_reg_read(uc, legacy_x86_64_registers[i], &legacy_reg_contents[i]) ))
+            ABORT()
+    }
+}
+
 /**
  * @brief Read and save the contents of the registers listed in `x86_64_registers`
  */
 static void read_registers()
 {
+    capture_registers();
+
+    if (!IS_VERBOSE(VERBOSITY_TRACE))
+        return;
+
     puts("\n\n----------NEW EXECUTION CONTEXT----------"\
          "\n\n!!!!THIS IS THE STATE OF THE PROCESSOR AFTER THE LAST EXECUTED INSTRUCTION!!!!"\
          "\n\nREGISTERS:\n");
 
     for (int i = 0; i < NUM_OF_REGISTERS_TO_READ; i++)
-    {
-        if (UC_ERR_CHECK( uc_reg_read(uc, x86_64_registers[i], &reg_contents[i]) ))
-            ABORT()
-
         printf("    %10s:   %ld\n", x86_64_register_names[i], reg_contents[i]);
-    }
 }
 
 /**
@@ -66,11 +188,13 @@ static void read_registers()
 static void read_stack()
 {
     size_t stack_size = STACK_BYTES_TO_WRITE;
-    stack_content = malloc(stack_size);
 
     if (UC_ERR_CHECK( uc_mem_read(uc, STACK_START_ADDR - STACK_BYTES_TO_WRITE, stack_content, stack_size) ))
         ABORT()
 
+    if (!IS_VERBOSE(VERBOSITY_TRACE))
+        return;
+
     printf("\nSIZE OF THE STACK: %zu bytes\nSTACK CONTENT:\n\t", stack_size);
     for (size_t i = 0; i < stack_size; i++)
     {
@@ -80,41 +204,136 @@ static void read_stack()
     puts("");
 }
 
-static void write_symbols_from_dynamic_memory_segments()
+/**
+ * @brief Read the current content of the DATA and BSS segments
+ */
+static void read_dynamic_memory_segments()
+{
+    if (UC_ERR_CHECK( uc_mem_read(uc, mem_layout.data.addr, mem_layout.data.bytes, mem_layout.data.size) ))
+        ABORT()
+
+    if (UC_ERR_CHECK( uc_mem_read(uc, mem_layout.bss.addr, mem_layout.bss.bytes, mem_layout.bss.size) ))
+        ABORT()
+}
+
+/**
+ * @brief Read the bytes of the memory ranges written by the previous instruction
+ */
+static void read_written_memory()
 {
-    for (int i = 0; i < mem_layout.data.num_symbols; i++)
+    size_t total_size = 0;
+    for (int i = 0; i < num_pending_writes; i++)
+        total_size += pending_writes[i].size;
+
+    if (total_size > written_bytes_cap)
     {
-        if (UC_ERR_CHECK( uc_mem_read(uc, mem_layout.data.symbols[i]->addr, mem_layout.data.symbols[i]->bytes, mem_layout.data.symbols[i]->size) ) )
+        written_bytes_cap = total_size * 2;
+        written_bytes = realloc(written_bytes, written_bytes_cap);
+    }
+
+    size_t offset = 0;
+    for (int i = 0; i < num_pending_writes; i++)
+    {
+        pending_writes[i].bytes = written_bytes + offset;
+
+        if (UC_ERR_CHECK( uc_mem_read(uc, pending_writes[i].addr, pending_writes[i].bytes, pending_writes[i].size) ))
             ABORT()
 
-        write_symbol_info(mem_layout.data.symbols[i]);
+        offset += pending_writes[i].size;
+    }
+}
+
+/**
+ * @brief Collect the slots of the registers whose value changed since the previous execution context
+ *
+ * @return the number of changed registers
+ */
+static int find_changed_registers()
+{
+    int num_changed = 0;
+
+    for (int i = 0; i < NUM_OF_REGISTERS_TO_READ; i++)
+    {
+        if (reg_contents[i] != prev_reg_contents[i])
+            changed_reg_slots[num_changed++] = i;
     }
 
-    for (int i = 0; i < mem_layout.bss.num_symbols; i++)
+    memcpy(prev_reg_contents, reg_contents, sizeof(reg_contents));
+
+    return num_changed;
+}
+
+/**
+ * @brief Remember the part of a memory write that falls into a region shown by the GUI
+ */
+static void track_write(uint64_t address, uint64_t size, uint64_t region_addr, uint64_t region_size)
+{
+    uint64_t start = (address > region_addr) ? address : region_addr;
+    uint64_t end = (address + size < region_addr + region_size) ? address + size : region_addr + region_size;
+
+    if (start >= end)
+        return;
+
+    // extend the previous range if this write continues or overlaps it (e.g. `push` after `push`)
+    if (num_pending_writes > 0)
     {
-        if (UC_ERR_CHECK( uc_mem_read(uc, mem_layout.bss.symbols[i]->addr, mem_layout.bss.symbols[i]->bytes, mem_layout.bss.symbols[i]->size) ) )
-            ABORT()
+        struct MemoryWrite *last = &pending_writes[num_pending_writes - 1];
 
-        write_symbol_info(mem_layout.bss.symbols[i]);
+        if (start >= last->addr && start <= last->addr + last->size)
+        {
+            if (end > last->addr + last->size)
+                last->size = end - last->addr;
+
+            return;
+        }
+    }
+
+    if (num_pending_writes >= pending_writes_cap)
+    {
+        pending_writes_cap = (pending_writes_cap == 0) ? 16 : pending_writes_cap * 2;
+        pending_writes = realloc(pending_writes, pending_writes_cap * sizeof(struct MemoryWrite));
     }
+
+    pending_writes[num_pending_writes++] = (struct MemoryWrite){ .addr = start, .size = end - start, .bytes = NULL };
+}
+
+/**
+ * @brief Stop the emulation before the instruction over the budget gets executed,
+ *        so that the trace ends with a complete context
+ */
+static int has_exceeded_insn_budget(uint32_t insn_count)
+{
+    if (options.max_insns == 0 || insn_count < options.max_insns)
+        return 0;
+
+    truncation_reason = TRUNCATION_INSN_LIMIT;
+
+    if (UC_ERR_CHECK( uc_emu_stop(uc) ))
+        ABORT()
+
+    return 1;
 }
 
 static int should_stop_emulation(uint32_t size, __uint128_t insn_bytecode)
 {
+    int is_tracing = IS_VERBOSE(VERBOSITY_TRACE);
+
+    // only a `ret` can return from `main`, so the stack only has to be checked for those
+    if (!is_tracing && insn_bytecode != RET_INSN_BYTECODE)
+        return 0;
+
     uint64_t stack_at_rsp = 0;
     if (UC_ERR_CHECK( uc_mem_read(uc, REG_RSP, &stack_at_rsp, sizeof(stack_at_rsp)) ))
         ABORT()
 
-    printf("\nINSN'S BYTECODE: %#*llx\tSIZE OF INSN IN BYTES: %u\tRIP: %#lx\n", size, (long long)insn_bytecode, size, REG_RIP);
-    printf("\nRSP: %#08lx\tSTACK AT RSP: %#08lx\n\n", REG_RSP, stack_at_rsp);
-
-
-    uint8_t should_stop = (insn_bytecode == RET_INSN_BYTECODE && stack_at_rsp == STACK_CANARY);
-    if (!should_stop)
-        write_separator();
+    if (is_tracing)
+    {
+        printf("\nINSN'S BYTECODE: %#*llx\tSIZE OF INSN IN BYTES: %u\tRIP: %#lx\n", size, (long long)insn_bytecode, size, REG_RIP);
+        printf("\nRSP: %#08lx\tSTACK AT RSP: %#08lx\n\n", REG_RSP, stack_at_rsp);
+    }
 
 
-    return should_stop;
+    return (insn_bytecode == RET_INSN_BYTECODE && stack_at_rsp == STACK_CANARY);
 }
 
 /**
@@ -126,25 +345,35 @@ static int should_stop_emulation(uint32_t size, __uint128_t insn_bytecode)
  */
 static void hook_insn(uc_engine *uc, uint64_t address, uint32_t size, void *user_data)
 {
+    if ( has_exceeded_insn_budget(*(uint32_t *)user_data) )
+        return;
+
     // increase the counter (passed in through `user_data`) that
     // counts the number of instructions executed
     (*(uint32_t *)user_data)++;
 
-    read_registers();
-    read_stack();
+    if (*(uint32_t *)user_data % PROGRESS_INTERVAL == 0)
+        report_progress("emulating", *(uint32_t *)user_data);
 
-    write_registers(NUM_OF_REGISTERS_TO_READ, reg_contents);
-    // STACK_START_ADDR - REG_RSP
-    write_stack_content(STACK_BYTES_TO_WRITE, stack_content);
+    // the first execution context is a full snapshot, every following one only holds what changed,
+    // unless the text format was requested, which always holds every value
+    int is_full_context = (options.output_format == OUTPUT_FORMAT_TEXT) || (*(uint32_t *)user_data == 1);
 
+    read_registers();
 
-    uc_mem_read(uc, mem_layout.data.addr, mem_layout.data.bytes, mem_layout.data.size);
-    uc_mem_read(uc, mem_layout.bss.addr, mem_layout.bss.bytes, mem_layout.bss.size);
-    write_memory_layout(&mem_layout, STACK_START_ADDR, STACK_END_ADDR, 0);
+    if (is_full_context)
+    {
+        read_stack();
+        read_dynamic_memory_segments();
+    }
+    else
+    {
+        read_written_memory();
+    }
 
 
-    int index = index_of_memory_address(assembly.addresses, assembly.num_lines, address);
-    if ( index != -1 )
+    int index = index_of_memory_address(&assembly, address);
+    if ( index != -1 && IS_VERBOSE(VERBOSITY_TRACE) )
         printf("Isns at address[%#lx]: %s\n", assembly.addresses[index], assembly.lines[index]);
 
         // an x86-64 instruction can be up to 15 bytes in length
@@ -153,9 +382,23 @@ static void hook_insn(uc_engine *uc, uint64_t address, uint32_t size, void *user
         ABORT()
 
 
-    write_instruction_info(index, size, insn_bytecode);
+    if (is_full_context)
+    {
+        write_execution_context(index, address, size, insn_bytecode,
+                                NUM_OF_REGISTERS_TO_READ, reg_contents, STACK_BYTES_TO_WRITE, stack_content, &mem_layout);
+
+        memcpy(prev_reg_contents, reg_contents, sizeof(reg_contents));
+    }
+    else
+    {
+        int num_changed_regs = find_changed_registers();
+
+        write_execution_context_delta(index, address, size, insn_bytecode,
+                                      num_changed_regs, changed_reg_slots, reg_contents,
+                                      num_pending_writes, pending_writes);
+    }
 
-    write_symbols_from_dynamic_memory_segments();
+    num_pending_writes = 0;
 
     // if we are about to execute the last `ret` instruction, stop the emulation
     if ( should_stop_emulation(size, insn_bytecode) )
@@ -165,6 +408,96 @@ static void hook_insn(uc_engine *uc, uint64_t address, uint32_t size, void *user
     }
 }
 
+/**
+ * @brief Check whether the instruction at `address` is the `ret` returning from `main`
+ */
+static int is_program_exit(uint64_t address, uint32_t size)
+{
+    if (size != 1)
+        return 0;
+
+    uint8_t opcode = 0;
+    uint64_t rsp = 0;
+    uint64_t stack_at_rsp = 0;
+
+    if (UC_ERR_CHECK( uc_mem_read(uc, address, &opcode, 1) ))
+        ABORT()
+
+    if (opcode != RET_INSN_BYTECODE)
+        return 0;
+
+    if (UC_ERR_CHECK( uc_reg_read(uc, UC_X86_REG_RSP, &rsp) ))
+        ABORT()
+
+    if (UC_ERR_CHECK( uc_mem_read(uc, rsp, &stack_at_rsp, sizeof(stack_at_rsp)) ))
+        ABORT()
+
+    return stack_at_rsp == STACK_CANARY;
+}
+
+/**
+ * @brief Callback function for the benchmark mode (UC_HOOK_CODE), only captures the registers
+ */
+static void hook_bench_insn(uc_engine *uc, uint64_t address, uint32_t size, void *user_data)
+{
+    if ( has_exceeded_insn_budget(*(uint32_t *)user_data) )
+        return;
+
+    (*(uint32_t *)user_data)++;
+
+    if (bench_capture_path == CAPTURE_PER_REGISTER)
+        capture_registers_per_register();
+    else
+        capture_registers();
+
+    if ( is_program_exit(address, size) )
+    {
+        if (UC_ERR_CHECK( uc_emu_stop(uc) ))
+            ABORT()
+    }
+}
+
+/**
+ * @brief Callback function for the live mode (UC_HOOK_CODE), decides where a run stops
+ *
+ * @param address: address where the code is being executed
+ * @param size: size of machine instruction(s) being executed, or 0 when size is unknown
+ * @param user_data: user data passed to tracing APIs.
+ */
+static void hook_live_insn(uc_engine *uc, uint64_t address, uint32_t size, void *user_data)
+{
+    (void)user_data;
+
+    live.insn_addr = address;
+    live.insn_size = size;
+
+    if (live.index == live.target_index)
+        live.stop_reason = LIVE_STOP_TARGET;
+
+    // don't stop at the address the run started from
+    for (int i = 0; i < live.num_stop_addrs && live.index != live.run_start_index; i++)
+    {
+        if (address == live.stop_addrs[i])
+            live.stop_reason = LIVE_STOP_ADDRESS;
+    }
+
+    if (live.stop_reason == LIVE_STOP_NONE && is_program_exit(address, size))
+    {
+        live.stop_reason = LIVE_STOP_EXIT;
+        live.end_index = live.index;
+    }
+
+    if (live.stop_reason != LIVE_STOP_NONE)
+    {
+        if (UC_ERR_CHECK( uc_emu_stop(uc) ))
+            ABORT()
+
+        return;
+    }
+
+    live.index++;
+}
+
 /**
  * @brief Callback function for hooking memory (READ, WRITE & FETCH)
  *
@@ -206,6 +539,30 @@ static void hook_mem_access(uc_engine *uc, uc_mem_type type, uint64_t address, i
     }
 }
 
+/**
+ * @brief Callback function for recording memory writes (UC_HOOK_MEM_WRITE)
+ *
+ * Only the parts of the write that fall into the stack window, the DATA or the BSS segment are
+ * recorded; their bytes are read after the instruction completed, in the next `hook_insn` call.
+ *
+ * @param type: always UC_MEM_WRITE
+ * @param address: address where the data is being written
+ * @param size: size of data being written
+ * @param value: value of data being written to memory
+ * @param user_data: user data passed to tracing APIs
+ */
+static void hook_mem_write(uc_engine *uc, uc_mem_type type, uint64_t address, int size, uint64_t value, void *user_data)
+{
+    (void)uc;
+    (void)type;
+    (void)value;
+    (void)user_data;
+
+    track_write(address, size, STACK_START_ADDR - STACK_BYTES_TO_WRITE, STACK_BYTES_TO_WRITE);
+    track_write(address, size, mem_layout.data.addr, mem_layout.data.size);
+    track_write(address, size, mem_layout.bss.addr, mem_layout.bss.size);
+}
+
 /**
  * @brief Callback function for handling invalid memory access events (UNMAPPED and PROT events)
  *
@@ -268,13 +625,17 @@ static void hook_mem_invalid(uc_engine *uc, uc_mem_type type, uint64_t address,
 
 static void init_virtual_mem(struct MemoryLayout *mem)
 {
-    printf("\n--------- ALLOCATING VIRTUAL MEMORY FOR TEXT, RODATA, DATA and BSS segments ---------\n");
-    printf("STARTING ADDRESSES:\nTEXT:   %#lx\nRODATA: %#lx\nDATA:   %#lx\nBSS:    %#lx\n\n",
-            mem->text.seg.addr, mem->rodata.addr, mem->data.addr, mem->bss.addr);
+    if (IS_VERBOSE(VERBOSITY_SUMMARY))
+    {
+        printf("\n--------- ALLOCATING VIRTUAL MEMORY FOR TEXT, RODATA, DATA and BSS segments ---------\n");
+        printf("STARTING ADDRESSES:\nTEXT:   %#lx\nRODATA: %#lx\nDATA:   %#lx\nBSS:    %#lx\n\n",
+                mem->text.seg.addr, mem->rodata.addr, mem->data.addr, mem->bss.addr);
+    }
 
 
     // the `& 0xfffff000` part rounds up the address to the next biggest number divisible by 4096 (4kB)
     uint64_t mem_size_to_map = ((mem->memory_end_addr - CODE_START_ADDR) + (UC_MEM_ALIGN_SIZE - 1)) & 0xfffff000;
+    mapped_mem_size = mem_size_to_map;
 
     // allocate memory for the TEXT, RODATA, DATA and BSS segments
     if (UC_ERR_CHECK( uc_mem_map(uc, CODE_START_ADDR, mem_size_to_map, UC_PROT_ALL) ))
@@ -330,11 +691,36 @@ static void init_virtual_mem(struct MemoryLayout *mem)
 
 static void init_hooks(int *instruction_count)
 {
-    if (UC_ERR_CHECK( ADD_HOOK(insn_hook_handle,          UC_HOOK_CODE,         hook_insn, instruction_count) ))
-        ABORT()
+    if (options.live)
+    {
+        if (UC_ERR_CHECK( ADD_HOOK(insn_hook_handle,      UC_HOOK_CODE,         hook_live_insn, NULL) ))
+            ABORT()
+    }
+    else if (options.bench)
+    {
+        if (UC_ERR_CHECK( ADD_HOOK(insn_hook_handle,      UC_HOOK_CODE,         hook_bench_insn, instruction_count) ))
+            ABORT()
+    }
+    else
+    {
+        if (UC_ERR_CHECK( ADD_HOOK(insn_hook_handle,      UC_HOOK_CODE,         hook_insn, instruction_count) ))
+            ABORT()
+    }
 
-    if (UC_ERR_CHECK( ADD_HOOK(mem_access_handle,         UC_HOOK_MEM_VALID,    hook_mem_access, NULL) ))
-        ABORT()
+    // reporting every memory access is by far the most expensive diagnostic, so it is only hooked when tracing
+    if (IS_VERBOSE(VERBOSITY_TRACE))
+    {
+        if (UC_ERR_CHECK( ADD_HOOK(mem_access_handle,     UC_HOOK_MEM_VALID,    hook_mem_access, NULL) ))
+            ABORT()
+    }
+
+    // the text format dumps every value in every context, so it doesn't need to know what was written,
+    // the live mode always reports full contexts and the benchmark mode doesn't report any
+    if (options.output_format == OUTPUT_FORMAT_BINARY && !options.live && !options.bench)
+    {
+        if (UC_ERR_CHECK( ADD_HOOK(mem_write_handle,      UC_HOOK_MEM_WRITE,    hook_mem_write, NULL) ))
+            ABORT()
+    }
 
     if (UC_ERR_CHECK( ADD_HOOK(invalid_mem_access_handle, UC_HOOK_MEM_UNMAPPED, hook_mem_invalid, NULL) ))
         ABORT()
@@ -361,36 +747,344 @@ void init_emu(struct MemoryLayout *memory_layout, int *instruction_count)
     if (UC_ERR_CHECK( uc_open(UC_ARCH_X86, UC_MODE_64, &uc) ))
         ABORT()
 
+    truncation_reason = TRUNCATION_NONE;
+
     init_virtual_mem(memory_layout);
     init_hooks(instruction_count);
     init_regs(memory_layout->text.seg.addr);
 }
 
 
-int emulate(struct TextSegment *text_segment)
+enum TruncationReason emulate(struct TextSegment *text_segment)
 {
-    // emulate code in infinite time, unlimited number of instructions
-    if (UC_ERR_CHECK( uc_emu_start(uc, text_segment->main_addr, text_segment->seg.addr + text_segment->seg.size, 0, 0) ))
+    // the instruction budget is enforced in `hook_insn`, the time limit by Unicorn itself
+    uint64_t timeout_us = (uint64_t)options.timeout_ms * 1000;
+
+    if (UC_ERR_CHECK( uc_emu_start(uc, text_segment->main_addr, text_segment->seg.addr + text_segment->seg.size, timeout_us, 0) ))
         ABORT()
 
+    size_t timed_out = 0;
+    if (UC_ERR_CHECK( uc_query(uc, UC_QUERY_TIMEOUT, &timed_out) ))
+        ABORT()
+
+    if (timed_out && truncation_reason == TRUNCATION_NONE)
+        truncation_reason = TRUNCATION_TIMEOUT;
+
+
 
 
     /////////////////////////////////////////////////////////////////////
     /////         EMULATION DONE || RETRIEVE AX AND CLEAN UP
     /////////////////////////////////////////////////////////////////////
-    puts("\n\n-----------------------------------------------------\n"
-             "               ### EMULATION DONE ###\n"
-             "-----------------------------------------------------");
+    if (IS_VERBOSE(VERBOSITY_SUMMARY))
+    {
+        puts("\n\n-----------------------------------------------------\n"
+                 "               ### EMULATION DONE ###\n"
+                 "-----------------------------------------------------");
 
 
-    printf("Contents of AL register:\n  "            \
-           "hex: %#x   dec: %u\n\n", (uint8_t)REG_RAX, (uint8_t)REG_RAX);
+        printf("Contents of AL register:\n  "            \
+               "hex: %#x   dec: %u\n\n", (uint8_t)REG_RAX, (uint8_t)REG_RAX);
+    }
 
 
     uc_hook_del(uc, insn_hook_handle);
     uc_hook_del(uc, mem_access_handle);
     uc_close(uc);
 
+    free(pending_writes);
+    pending_writes = NULL;
+    free(written_bytes);
+    written_bytes = NULL;
+
+
+    return truncation_reason;
+}
+
+void run_capture_benchmark(struct MemoryLayout *memory_layout)
+{
+    static const char *capture_path_names[NUM_OF_CAPTURE_PATHS] = {
+        [CAPTURE_PER_REGISTER] = "uc_reg_read per register",
+        [CAPTURE_BATCH]        = "uc_reg_read_batch",
+    };
+
+    for (int path = 0; path < NUM_OF_CAPTURE_PATHS; path++)
+    {
+        int insn_cnt = 0;
+        struct timespec start, end;
+
+        bench_capture_path = path;
+
+        // every run starts from a fresh Unicorn instance, so they all execute the same instructions
+        init_emu(memory_layout, &insn_cnt);
+
+        clock_gettime(CLOCK_MONOTONIC, &start);
+        emulate(&memory_layout->text);
+        clock_gettime(CLOCK_MONOTONIC, &end);
+
+        double seconds = (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9;
+
+        printf("BENCHMARK: %-26s %10d instructions in %8.3f s: %12.0f instructions/s\n",
+               capture_path_names[path], insn_cnt, seconds, (seconds > 0) ? insn_cnt / seconds : 0);
+    }
+}
+
+
+
+static void live_save_snapshot()
+{
+    // snapshots are taken in order, so the snapshot of this interval might already exist
+    if (live.index % LIVE_SNAPSHOT_INTERVAL != 0 || (int)(live.index / LIVE_SNAPSHOT_INTERVAL) < live.num_snapshots)
+        return;
+
+    if (live.num_snapshots >= live.snapshots_cap)
+    {
+        live.snapshots_cap = (live.snapshots_cap == 0) ? 16 : live.snapshots_cap * 2;
+        live.snapshots = realloc(live.snapshots, live.snapshots_cap * sizeof(struct LiveSnapshot));
+    }
+
+    struct LiveSnapshot *snapshot = &live.snapshots[live.num_snapshots++];
+    snapshot->memory = malloc(mapped_mem_size);
+    snapshot->stack = malloc(STACK_SIZE);
+
+    if (UC_ERR_CHECK( uc_context_alloc(uc, &snapshot->cpu) ))
+        ABORT()
+
+    if (UC_ERR_CHECK( uc_context_save(uc, snapshot->cpu) ))
+        ABORT()
+
+    if (UC_ERR_CHECK( uc_mem_read(uc, CODE_START_ADDR, snapshot->memory, mapped_mem_size) ))
+        ABORT()
+
+    if (UC_ERR_CHECK( uc_mem_read(uc, STACK_END_ADDR, snapshot->stack, STACK_SIZE) ))
+        ABORT()
+}
+
+static void live_restore_snapshot(int k)
+{
+    struct LiveSnapshot *snapshot = &live.snapshots[k];
+
+    if (UC_ERR_CHECK( uc_context_restore(uc, snapshot->cpu) ))
+        ABORT()
+
+    if (UC_ERR_CHECK( uc_mem_write(uc, CODE_START_ADDR, snapshot->memory, mapped_mem_size) ))
+        ABORT()
+
+    if (UC_ERR_CHECK( uc_mem_write(uc, STACK_END_ADDR, snapshot->stack, STACK_SIZE) ))
+        ABORT()
+
+    live.index = k * LIVE_SNAPSHOT_INTERVAL;
+}
+
+/**
+ * @brief Emulate until the `target`-th execution context, one of the `stop_addrs` or the end of the program
+ *
+ * The emulation is split at every LIVE_SNAPSHOT_INTERVAL-th context so that a snapshot can be taken there.
+ */
+static void live_run_to(struct TextSegment *text_segment, uint32_t target, uint64_t *stop_addrs, int num_stop_addrs)
+{
+    live.stop_addrs = stop_addrs;
+    live.num_stop_addrs = num_stop_addrs;
+    live.run_start_index = live.index;
+
+    do
+    {
+        uint32_t next_snapshot_index = (live.index / LIVE_SNAPSHOT_INTERVAL + 1) * LIVE_SNAPSHOT_INTERVAL;
+        live.target_index = (target < next_snapshot_index) ? target : next_snapshot_index;
+        live.stop_reason = LIVE_STOP_NONE;
+
+        uint64_t rip;
+        if (UC_ERR_CHECK( uc_reg_read(uc, UC_X86_REG_RIP, &rip) ))
+            ABORT()
+
+        if (UC_ERR_CHECK( uc_emu_start(uc, rip, text_segment->seg.addr + text_segment->seg.size, 0, 0) ))
+            ABORT()
+
+        // the emulation ran off the end of the TEXT segment without reaching the last `ret`
+        if (live.stop_reason == LIVE_STOP_NONE)
+        {
+            live.stop_reason = LIVE_STOP_EXIT;
+            live.end_index = live.index;
+        }
+
+        live_save_snapshot();
+    }
+    while (live.stop_reason == LIVE_STOP_TARGET && live.index < target);
+
+    live.stop_addrs = NULL;
+    live.num_stop_addrs = 0;
+}
+
+static void live_goto(struct TextSegment *text_segment, int64_t target)
+{
+    if (target < 0)
+        target = 0;
+
+    if (live.end_index >= 0 && target > live.end_index)
+        target = live.end_index;
+
+    // going backwards: continue from the closest snapshot before the target
+    if (target < live.index)
+        live_restore_snapshot(target / LIVE_SNAPSHOT_INTERVAL);
+
+    live_run_to(text_segment, target, NULL, 0);
+}
+
+static void live_respond()
+{
+    read_registers();
+    read_stack();
+    read_dynamic_memory_segments();
+
+    __uint128_t insn_bytecode = 0;
+    if (UC_ERR_CHECK( uc_mem_read(uc, live.insn_addr, &insn_bytecode, live.insn_size) ))
+        ABORT()
+
+    int index = index_of_memory_address(&assembly, live.insn_addr);
+
+    write_live_position(live.index, live.end_index == live.index);
+    write_execution_context(index, live.insn_addr, live.insn_size, insn_bytecode,
+                            NUM_OF_REGISTERS_TO_READ, reg_contents, STACK_BYTES_TO_WRITE, stack_content, &mem_layout);
+    flush_serializer();
+}
+
+/**
+ * @brief Returns the number of bytes from `addr` to the end of the mapped memory region containing it,
+ *        or 0 if `addr` is not mapped.
+ */
+static uint64_t mapped_bytes_from(uint64_t addr)
+{
+    uc_mem_region *regions;
+    uint32_t num_regions;
+    if (UC_ERR_CHECK( uc_mem_regions(uc, &regions, &num_regions) ))
+        ABORT()
+
+    uint64_t num_bytes = 0;
+    for (uint32_t i = 0; i < num_regions; i++)
+    {
+        // the end of a region is inclusive
+        if (addr >= regions[i].begin && addr <= regions[i].end)
+            num_bytes = regions[i].end - addr + 1;
+    }
+
+    uc_free(regions);
+
+    return num_bytes;
+}
+
+static void live_respond_memory(const char *args)
+{
+    uint64_t addr = 0;
+    uint32_t size = 0;
+    if (sscanf(args, "%lu %u", &addr, &size) != 2)
+        size = 0;
+
+    // reading unmapped memory is not fatal here, the client simply gets the mapped part of the range back,
+    // which also bounds the size of the buffer the client can make us allocate
+    uint64_t mapped_size = mapped_bytes_from(addr);
+    if (size > mapped_size)
+        size = mapped_size;
+
+    uint8_t *bytes = malloc((size > 0) ? size : 1);
+    if (bytes == NULL)
+    {
+        perror("Failed to allocate the memory dump");
+        exit(1);
+    }
+
+    if (size > 0 && uc_mem_read(uc, addr, bytes, size) != UC_ERR_OK)
+        size = 0;
+
+    write_memory_dump(addr, size, bytes);
+    flush_serializer();
+
+    free(bytes);
+}
+
+
+int run_live_session(struct TextSegment *text_segment)
+{
+    live.end_index = -1;
+
+    // the emulation always continues from RIP, which has to point to `main` at first
+    uint64_t rip = text_segment->main_addr;
+    if (UC_ERR_CHECK( uc_reg_write(uc, UC_X86_REG_RIP, &rip) ))
+        ABORT()
+
+    live_save_snapshot();
+    live_run_to(text_segment, 0, NULL, 0);
+    live_respond();
+
+
+    char line[LIVE_COMMAND_SIZE];
+    uint64_t stop_addrs[LIVE_MAX_STOP_ADDRS];
+
+    while ( fgets(line, sizeof(line), stdin) != NULL )
+    {
+        char command[16];
+        int consumed = 0;
+
+        if (sscanf(line, "%15s%n", command, &consumed) != 1)
+            continue;
+
+        char *args = line + consumed;
+
+        if (strcmp(command, "step") == 0)
+        {
+            live_goto(text_segment, (int64_t)live.index + strtol(args, NULL, 10));
+        }
+        else if (strcmp(command, "goto") == 0)
+        {
+            live_goto(text_segment, strtoll(args, NULL, 10));
+        }
+        else if (strcmp(command, "run") == 0)
+        {
+            int num_stop_addrs = 0;
+            char *end = args;
+
+            while (num_stop_addrs < LIVE_MAX_STOP_ADDRS)
+            {
+                uint64_t addr = strtoull(args, &end, 10);
+                if (end == args)
+                    break;
+
+                stop_addrs[num_stop_addrs++] = addr;
+                args = end;
+            }
+
+            live_run_to(text_segment, live.index + LIVE_RUN_LIMIT, stop_addrs, num_stop_addrs);
+        }
+        else if (strcmp(command, "mem") == 0)
+        {
+            live_respond_memory(args);
+            continue;
+        }
+        else if (strcmp(command, "quit") == 0)
+        {
+            break;
+        }
+        else if (strcmp(command, "state") != 0)
+        {
+            fprintf(stderr, "Unknown live command: %s\n", command);
+        }
+
+        live_respond();
+    }
+
+
+    for (int i = 0; i < live.num_snapshots; i++)
+    {
+        uc_context_free(live.snapshots[i].cpu);
+        free(live.snapshots[i].memory);
+        free(live.snapshots[i].stack);
+    }
+
+    free(live.snapshots);
+    live.snapshots = NULL;
+
+    uc_hook_del(uc, insn_hook_handle);
+    uc_close(uc);
+
 
     return EXIT_SUCCESS;
 }
@@ -21,48 +21,33 @@
 // Instruction constants
 #define RET_INSN_BYTECODE     ( 0xc3 )                  // Bytecode for the `ret` instruction
 
+// Emulation limits, so that an infinite loop cannot write an unbounded trace
+#define DEFAULT_MAX_INSNS     ( 1000000 )               // Default instruction budget of a run
+#define DEFAULT_TIMEOUT_MS    ( 10000 )                 // Default wall-clock time limit of a run: 10 seconds
+
+// Live mode configuration
+#define LIVE_SNAPSHOT_INTERVAL  ( 1024 )                // Number of instructions between two snapshots used for stepping backwards
+#define LIVE_RUN_LIMIT          ( 1 << 22 )             // Maximum number of instructions a single `run` command may execute
+#define LIVE_MAX_STOP_ADDRS     ( 64 )                  // Maximum number of addresses a `run` command can stop at
+#define LIVE_COMMAND_SIZE       ( 2048 )                // Maximum length of a command line read from stdin
+
 // Registers
+// only the architectural registers are read, the sub-registers (EAX, AH, R8D, ...) are derived from them by the GUI
 static const int x86_64_registers[] = {
-    UC_X86_REG_RAX,    UC_X86_REG_EAX,    UC_X86_REG_AX,   UC_X86_REG_AH,   UC_X86_REG_AL,
-    UC_X86_REG_RBX,    UC_X86_REG_EBX,    UC_X86_REG_BX,   UC_X86_REG_BH,   UC_X86_REG_BL,
-    UC_X86_REG_RCX,    UC_X86_REG_ECX,    UC_X86_REG_CX,   UC_X86_REG_CH,   UC_X86_REG_CL,
-    UC_X86_REG_RDX,    UC_X86_REG_EDX,    UC_X86_REG_DX,   UC_X86_REG_DH,   UC_X86_REG_DL,
-    UC_X86_REG_RSI,    UC_X86_REG_ESI,    UC_X86_REG_SI,   UC_X86_REG_SIL,
-    UC_X86_REG_RDI,    UC_X86_REG_EDI,    UC_X86_REG_DI,   UC_X86_REG_DIL,
-    UC_X86_REG_RBP,    UC_X86_REG_EBP,    UC_X86_REG_BP,   UC_X86_REG_BPL,
-    UC_X86_REG_RSP,    UC_X86_REG_ESP,    UC_X86_REG_SP,   UC_X86_REG_SPL,
-    UC_X86_REG_R8,     UC_X86_REG_R8D,    UC_X86_REG_R8W,  UC_X86_REG_R8B,
-    UC_X86_REG_R9,     UC_X86_REG_R9D,    UC_X86_REG_R9W,  UC_X86_REG_R9B,
-    UC_X86_REG_R10,    UC_X86_REG_R10D,   UC_X86_REG_R10W, UC_X86_REG_R10B,
-    UC_X86_REG_R11,    UC_X86_REG_R11D,   UC_X86_REG_R11W, UC_X86_REG_R11B,
-    UC_X86_REG_R12,    UC_X86_REG_R12D,   UC_X86_REG_R12W, UC_X86_REG_R12B,
-    UC_X86_REG_R13,    UC_X86_REG_R13D,   UC_X86_REG_R13W, UC_X86_REG_R13B,
-    UC_X86_REG_R14,    UC_X86_REG_R14D,   UC_X86_REG_R14W, UC_X86_REG_R14B,
-    UC_X86_REG_R15,    UC_X86_REG_R15D,   UC_X86_REG_R15W, UC_X86_REG_R15B,
-    UC_X86_REG_RIP,    UC_X86_REG_EIP,    UC_X86_REG_IP,
-    UC_X86_REG_RFLAGS, UC_X86_REG_EFLAGS, UC_X86_REG_FLAGS,
+    UC_X86_REG_RAX,    UC_X86_REG_RBX,    UC_X86_REG_RCX,  UC_X86_REG_RDX,
+    UC_X86_REG_RSI,    UC_X86_REG_RDI,    UC_X86_REG_RBP,  UC_X86_REG_RSP,
+    UC_X86_REG_R8,     UC_X86_REG_R9,     UC_X86_REG_R10,  UC_X86_REG_R11,
+    UC_X86_REG_R12,    UC_X86_REG_R13,    UC_X86_REG_R14,  UC_X86_REG_R15,
+    UC_X86_REG_RIP,    UC_X86_REG_RFLAGS,
     UC_X86_REG_CS,     UC_X86_REG_DS,     UC_X86_REG_SS,   UC_X86_REG_ES,   UC_X86_REG_FS, UC_X86_REG_GS,
 };
 
 static const char *x86_64_register_names[] = {
-    "RAX",    "EAX",    "AX",   "AH",   "AL",
-    "RBX",    "EBX",    "BX",   "BH",   "BL",
-    "RCX",    "ECX",    "CX",   "CH",   "CL",
-    "RDX",    "EDX",    "DX",   "DH",   "DL",
-    "RSI",    "ESI",    "SI",   "SIL",
-    "RDI",    "EDI",    "DI",   "DIL",
-    "RBP",    "EBP",    "BP",   "BPL",
-    "RSP",    "ESP",    "SP",   "SPL",
-    "R8",     "R8D",    "R8W",  "R8B",
-    "R9",     "R9D",    "R9W",  "R9B",
-    "R10",    "R10D",   "R10W", "R10B",
-    "R11",    "R11D",   "R11W", "R11B",
-    "R12",    "R12D",   "R12W", "R12B",
-    "R13",    "R13D",   "R13W", "R13B",
-    "R14",    "R14D",   "R14W", "R14B",
-    "R15",    "R15D",   "R15W", "R15B",
-    "RIP",    "EIP",    "IP",
-    "RFLAGS", "EFLAGS", "FLAGS",
+    "RAX",    "RBX",    "RCX",  "RDX",
+    "RSI",    "RDI",    "RBP",  "RSP",
+    "R8",     "R9",     "R10",  "R11",
+    "R12",    "R13",    "R14",  "R15",
+    "RIP",    "RFLAGS",
     "CS",     "DS",     "SS",   "ES",   "FS", "GS",
 };
 
@@ -71,14 +56,45 @@ static const char *x86_64_register_names[] = {
 static uint64_t reg_contents[NUM_OF_REGISTERS_TO_READ];
 
 #define REG_RAX     reg_contents[0]
-#define REG_RSP     reg_contents[32]
-#define REG_RIP     reg_contents[68]
+#define REG_RSP     reg_contents[7]
+#define REG_RIP     reg_contents[16]
 
 
 
 void init_emu(struct MemoryLayout *memory_layout, int *instruction_count);
 
-int emulate(struct TextSegment *text_segment);
+/**
+ * @brief Emulates the program until it returns from `main` or runs out of its instruction or time budget.
+ *
+ * @return the limit that stopped the emulation early, or TRUNCATION_NONE if the program ended
+ */
+enum TruncationReason emulate(struct TextSegment *text_segment);
+
+/**
+ * @brief Emulates the program once with every register capture path and reports their throughput on stdout.
+ *
+ * No execution contexts are written, only the registers are captured before every instruction.
+ */
+void run_capture_benchmark(struct MemoryLayout *memory_layout);
+
+/**
+ * @brief Keeps the emulated program resident and emulates it on demand, driven by commands read from stdin.
+ *
+ * Every command is a single line; the state after the command is written to the serializer:
+ *
+ * - `step N`:          move N instructions forward (or backward if N is negative)
+ *
+ * - `goto I`:          move to the I-th execution context
+ *
+ * - `run ADDR...`:     run until one of the addresses is about to be executed or the program ends
+ *
+ * - `state`:           report the current execution context again
+ *
+ * - `mem ADDR SIZE`:   read SIZE bytes of memory starting at ADDR
+ *
+ * - `quit`:            end the session
+ */
+int run_live_session(struct TextSegment *text_segment);
 
 
 
@@ -1,7 +1,9 @@
 #include <unistd.h>
+#include <getopt.h>
 #include <errno.h>
 #include <sys/wait.h>
 #include <string.h>
+#include <limits.h>
 
 #include "preprocessor.h"
 #include "serializer.h"
@@ -11,11 +13,236 @@
 
 #define GCC_PATH   "/usr/bin/gcc"
 
+// bump it whenever a change can alter the trace of a program, the GUI keys its cache with it
+#define ASEMU_VERSION   "1.1.0"
+
 
 struct MemoryLayout mem_layout = {0};
 struct AssemblyText assembly   = {0};
+struct EmuOptions options      = {0};
+
 
 
+static void print_usage(const char *program_name)
+{
+    fprintf(stderr, "Usage: %s [options] <assembly_file>\n"
+                    "Options:\n"
+                    "  -t, --text            write the trace in the human readable text format instead of the binary one\n"
+                    "  -o, --output PATH     write the trace to PATH instead of " SERIALIZED_OUTPUT_PATH " (or DIR/" SERIALIZED_OUTPUT_NAME "\n"
+                    "                        with --workdir); '-' streams it to stdout and moves the diagnostic messages to stderr\n"
+                    "  -l, --live            keep the program resident and emulate it on demand, driven by commands read\n"
+                    "                        from stdin; the binary records are written to stdout\n"
+                    "  -n, --max-insns N     stop after N instructions (default: %d, 0: unlimited)\n"
+                    "  -T, --timeout MS      stop after MS milliseconds of emulation (default: %d, 0: unlimited)\n"
+                    "  -b, --bench           report the instructions per second of every register capture path\n"
+                    "                        instead of writing a trace\n"
+                    "  -v, --verbosity LEVEL 0: no diagnostics, 1: a summary of the program and the emulation,\n"
+                    "                        2: also trace every instruction and memory access (default: %d)\n"
+                    "  -q, --quiet           same as --verbosity 0\n"
+                    "  -B, --binary PATH     emulate the compiled file at PATH, the source is only compiled into it\n"
+                    "                        if it does not exist yet (default: always compile to " COMPILED_FILE_PATH ")\n"
+                    "  -w, --workdir DIR     keep the compiled file and the trace in DIR instead of /tmp, so several\n"
+                    "                        emulators can run at once without overwriting each other's files\n"
+                    "  -p, --progress        report the phases of the run and the number of emulated instructions\n"
+                    "                        on stderr with the elapsed milliseconds, as lines like 'progress emulating 65536 12.345'\n"
+                    "  -V, --version         print the version of the emulator and of its trace format, then exit\n",
+                    program_name, DEFAULT_MAX_INSNS, DEFAULT_TIMEOUT_MS, VERBOSITY_TRACE);
+}
+
+static int parse_limit(const char *str, uint32_t *limit)
+{
+    char *end = NULL;
+    errno = 0;
+    unsigned long value = strtoul(str, &end, 10);
+
+    if (errno != 0 || end == str || *end != '\0' || str[0] == '-' || value > UINT32_MAX)
+        return -1;
+
+    *limit = (uint32_t)value;
+    return 0;
+}
+
+/**
+ * @brief Returns the path of a file inside the work directory.
+ *
+ * The returned string is allocated and lives until the emulator exits.
+ */
+static char *workdir_path(const char *workdir, const char *file_name)
+{
+    char *path = malloc(PATH_MAX);
+    if (path == NULL)
+    {
+        perror("Memory allocation failed");
+        exit(1);
+    }
+
+    if ( snprintf(path, PATH_MAX, "%s/%s", workdir, file_name) >= PATH_MAX )
+    {
+        fprintf(stderr, "The path of the work directory is too long: %s\n", workdir);
+        exit(1);
+    }
+
+    return path;
+}
+
+static void parse_arguments(int argc, char *argv[], struct EmuOptions *opts)
+{
+    static const struct option long_options[] = {
+        { "text",      no_argument,       NULL, 't' },
+        { "output",    required_argument, NULL, 'o' },
+        { "live",      no_argument,       NULL, 'l' },
+        { "max-insns", required_argument, NULL, 'n' },
+        { "timeout",   required_argument, NULL, 'T' },
+        { "bench",     no_argument,       NULL, 'b' },
+        { "verbosity", required_argument, NULL, 'v' },
+        { "quiet",     no_argument,       NULL, 'q' },
+        { "binary",    required_argument, NULL, 'B' },
+        { "version",   no_argument,       NULL, 'V' },
+        { "progress",  no_argument,       NULL, 'p' },
+        { "workdir",   required_argument, NULL, 'w' },
+        { NULL,        0,                 NULL,  0  },
+    };
+
+    opts->output_format = OUTPUT_FORMAT_BINARY;
+    opts->output_path = NULL;
+    opts->max_insns = DEFAULT_MAX_INSNS;
+    opts->timeout_ms = DEFAULT_TIMEOUT_MS;
+    opts->verbosity = VERBOSITY_TRACE;
+
+    uint32_t verbosity;
+    int opt;
+    while ( (opt = getopt_long(argc, argv, "to:ln:T:bv:qB:Vpw:", long_options, NULL)) != -1 )
+    {
+        switch (opt)
+        {
+        case 't':
+            opts->output_format = OUTPUT_FORMAT_TEXT;
+            break;
+
+        case 'o':
+            opts->output_path = optarg;
+            break;
+
+        case 'l':
+            opts->live = 1;
+            break;
+
+        case 'b':
+            opts->bench = 1;
+            break;
+
+        case 'n':
+            if (parse_limit(optarg, &opts->max_insns) == -1)
+            {
+                fprintf(stderr, "Invalid instruction limit: %s\n", optarg);
+                exit(1);
+            }
+            break;
+
+        case 'T':
+            if (parse_limit(optarg, &opts->timeout_ms) == -1)
+            {
+                fprintf(stderr, "Invalid time limit: %s\n", optarg);
+                exit(1);
+            }
+            break;
+
+        case 'v':
+            if (parse_limit(optarg, &verbosity) == -1 || verbosity > VERBOSITY_TRACE)
+            {
+                fprintf(stderr, "Invalid verbosity level: %s\n", optarg);
+                exit(1);
+            }
+            opts->verbosity = (enum Verbosity)verbosity;
+            break;
+
+        case 'q':
+            opts->verbosity = VERBOSITY_QUIET;
+            break;
+
+        case 'B':
+            opts->binary_path = optarg;
+            break;
+
+        case 'p':
+            opts->progress = 1;
+            break;
+
+        case 'w':
+            opts->workdir = optarg;
+            break;
+
+        case 'V':
+            printf("asemu %s (trace format %d)\n", ASEMU_VERSION, TRACE_FORMAT_VERSION);
+            exit(0);
+
+        default:
+            print_usage(argv[0]);
+            exit(1);
+        }
+    }
+
+    if (optind != argc - 1)
+    {
+        print_usage(argv[0]);
+        exit(1);
+    }
+
+    if (opts->live && opts->output_format == OUTPUT_FORMAT_TEXT)
+    {
+        fprintf(stderr, "The live mode only supports the binary format\n");
+        exit(1);
+    }
+
+    if (opts->live && opts->bench)
+    {
+        fprintf(stderr, "The live and the benchmark modes cannot be combined\n");
+        exit(1);
+    }
+
+    opts->source_path = argv[optind];
+
+    if (opts->output_path == NULL)
+        opts->output_path = (opts->workdir != NULL) ? workdir_path(opts->workdir, SERIALIZED_OUTPUT_NAME) : SERIALIZED_OUTPUT_PATH;
+}
+
+/**
+ * @brief Compiles the assembly source file with GCC.
+ *
+ * @param target_path The path of the compiled file to create.
+ * @return The exit status of GCC.
+ */
+static int compile_source(const char *target_path)
+{
+    pid_t pid = fork();
+
+    if (pid == -1)
+    {
+        perror("Fork failed");
+        exit(1);
+    }
+    else if (pid == 0) // child
+    {
+        // execl will replace the currently running process with the call to GCC,
+        // so no lines of code will run after execl, but only if GCC successfully runs
+        execl(GCC_PATH, "gcc", options.source_path, "-g", "-o", target_path, "-no-pie", (char *)NULL);
+
+        // only runs if execl fails
+        perror("Failed to compile the assembly file");
+        exit(1);
+    }
+
+    // wait for the child process to die
+    int status;
+    if ( waitpid(pid, &status, 0) == -1 )
+    {
+        perror("Error waiting for the compiler");
+        exit(1);
+    }
+
+    return (WIFEXITED(status)) ? WEXITSTATUS(status) : 1;
+}
+
 
 void dispose_segment(struct MemorySegment *seg)
 {
@@ -58,6 +285,8 @@ void dispose(struct MemoryLayout *mem, struct AssemblyText *assembly)
     assembly->lines = NULL;
     free(assembly->addresses);
     assembly->addresses = NULL;
+    free(assembly->line_of_offset);
+    assembly->line_of_offset = NULL;
 }
 
 
@@ -68,87 +297,138 @@ int main(int argc, char *argv[])
     argc = 2;
     #endif
 
-    if (argc != 2)
+    start_clock();
+    parse_arguments(argc, argv, &options);
+
+    // when streaming (always the case in live mode) stdout carries the binary records,
+    // so it has to be claimed before anything gets printed,
+    // the benchmark mode records no trace, so it must not replace the last one
+    const char *serializer_path = options.live ? SERIALIZER_STDOUT : options.bench ? SERIALIZER_DISCARD : options.output_path;
+    initialize_serializer(options.output_format, serializer_path);
+
+    // a compiled file passed with --binary is reused as long as it exists,
+    // the default one is always compiled again
+    int needs_compiling = 1;
+    int is_shared_binary = (options.binary_path != NULL);
+
+    if (options.binary_path == NULL)
     {
-        fprintf(stderr, "Usage: %s <assembly_file>\n", argv[0]);
-        exit(1);
-    }
+        options.binary_path = (options.workdir != NULL) ? workdir_path(options.workdir, COMPILED_FILE_NAME) : COMPILED_FILE_PATH;
 
-    if ( remove(COMPILED_FILE_PATH) == -1 && errno != ENOENT )
+        if ( remove(options.binary_path) == -1 && errno != ENOENT )
+        {
+            perror("Error removing compiled assembly file");
+            exit(1);
+        }
+    }
+    else if ( access(options.binary_path, F_OK) == 0 )
     {
-        perror("Error removing compiled assembly file");
-        exit(1);
+        needs_compiling = 0;
     }
 
     #ifdef DEBUG
     system(GCC_PATH " -g ~/Desktop/assembly_files/printf_call.s -g -o " COMPILED_FILE_PATH " -no-pie");
     #else
-    pid_t pid = fork();
-
-    if (pid == -1)
-    {
-        perror("Fork failed");
-        exit(1);
-    }
-    else if (pid == 0) // child
+    if (needs_compiling && is_shared_binary)
     {
-        // execl will replace the currently running process with the call to GCC,
-        // so no lines of code will run after execl, but only if GCC successfully runs
-        execl(GCC_PATH, "gcc", argv[1], "-g", "-o", COMPILED_FILE_PATH, "-no-pie", (char *)NULL);
-
-        // only runs if execl fails
-        perror("Failed to compile the assembly file");
-        exit(1);
+        report_progress("compiling", 0);
+
+        // other emulators may be compiling or reading the same file at the same time, so it is compiled
+        // under a name of our own and only moved into place once it is complete
+        char temp_path[PATH_MAX];
+        if ( snprintf(temp_path, sizeof(temp_path), "%s.%ld.tmp", options.binary_path, (long)getpid()) >= (int)sizeof(temp_path) )
+        {
+            fprintf(stderr, "The path of the compiled file is too long: %s\n", options.binary_path);
+            exit(1);
+        }
+
+        if ( compile_source(temp_path) == 0 && rename(temp_path, options.binary_path) == -1 )
+        {
+            perror("Error moving the compiled file into place");
+            remove(temp_path);
+            exit(1);
+        }
     }
-    else // parent
+    else if (needs_compiling)
     {
-        // wait for the child process to die
-        waitpid(pid, NULL, 0);
-        // successful compilation, resume normal program execution
+        report_progress("compiling", 0);
+        compile_source(options.binary_path);
     }
     #endif
 
 
     int insn_cnt = 0;
 
-    // after compiling the assembly file, we disassemble it using objdump
-    // and process the resulting output
-    process_objdump_output(&mem_layout, &assembly);
+    // after compiling the assembly file, we read its sections, symbols
+    // and the source lines of its instructions directly from the ELF file
+    report_progress("loading", 0);
+    process_compiled_file(&mem_layout, &assembly);
 
 
-    initialize_serializer();
     write_assembly_instructions_and_addresses(&assembly);
-    write_memory_layout(&mem_layout, STACK_START_ADDR, STACK_END_ADDR, 1);
+    write_register_names(NUM_OF_REGISTERS_TO_READ, x86_64_register_names);
+    write_memory_layout(&mem_layout, STACK_START_ADDR, STACK_END_ADDR, STACK_BYTES_TO_WRITE);
 
 
-    printf("\n\n.TEXT:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.text.seg.size, mem_layout.text.seg.addr);
-    for (size_t i = 0; i < mem_layout.text.seg.size; i++)
-        printf("%02x ", mem_layout.text.seg.bytes[i]);
-    puts("");
+    if (IS_VERBOSE(VERBOSITY_SUMMARY))
+    {
+        printf("\n\n.TEXT:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.text.seg.size, mem_layout.text.seg.addr);
+        for (size_t i = 0; i < mem_layout.text.seg.size; i++)
+            printf("%02x ", mem_layout.text.seg.bytes[i]);
+        puts("");
+
+        printf("\n\n.RODATA:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.rodata.size, mem_layout.rodata.addr);
+        for (size_t i = 0; i < mem_layout.rodata.size; i++)
+            printf("%02x ", mem_layout.rodata.bytes[i]);
+        puts("");
+
+        printf("\n\n.DATA:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.data.size, mem_layout.data.addr);
+        for (size_t i = 0; i < mem_layout.data.size; i++)
+            printf("%02x ", mem_layout.data.bytes[i]);
+        puts("");
+
+        printf("\n\n.BSS:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.bss.size, mem_layout.bss.addr);
+        for (size_t i = 0; i < mem_layout.bss.size; i++)
+            printf("%02x ", mem_layout.bss.bytes[i]);
+        puts("");
+    }
+
 
-    printf("\n\n.RODATA:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.rodata.size, mem_layout.rodata.addr);
-    for (size_t i = 0; i < mem_layout.rodata.size; i++)
-        printf("%02x ", mem_layout.rodata.bytes[i]);
-    puts("");
+    // ##############  WHERE THE MAGIC HAPPENS  ##############
+    if (options.bench)
+    {
+        // the benchmark creates a fresh emulator for every run itself
+        run_capture_benchmark(&mem_layout);
+    }
+    else if (options.live)
+    {
+        init_emu(&mem_layout, &insn_cnt);
+        run_live_session(&mem_layout.text);
+    }
+    else
+    {
+        init_emu(&mem_layout, &insn_cnt);
 
-    printf("\n\n.DATA:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.data.size, mem_layout.data.addr);
-    for (size_t i = 0; i < mem_layout.data.size; i++)
-        printf("%02x ", mem_layout.data.bytes[i]);
-    puts("");
+        report_progress("emulating", 0);
+        enum TruncationReason truncation_reason = emulate(&mem_layout.text);
+        if (IS_VERBOSE(VERBOSITY_SUMMARY))
+            printf("Number of instructions executed: %d\n\n", insn_cnt);
 
-    printf("\n\n.BSS:\n\tBYTE-COUNT: %ld\n\t%#lx: ", mem_layout.bss.size, mem_layout.bss.addr);
-    for (size_t i = 0; i < mem_layout.bss.size; i++)
-        printf("%02x ", mem_layout.bss.bytes[i]);
-    puts("");
+        // the trace stays valid up to the last recorded context, the marker tells the reader why it stops there
+        if (truncation_reason != TRUNCATION_NONE)
+        {
+            fprintf(stderr, "Emulation truncated after %d instructions: %s\n", insn_cnt,
+                    (truncation_reason == TRUNCATION_INSN_LIMIT) ? "instruction limit reached" : "time limit reached");
 
+            write_trace_truncated(truncation_reason, insn_cnt);
+        }
 
-    // ##############  WHERE THE MAGIC HAPPENS  ##############
-    init_emu(&mem_layout, &insn_cnt);
-    emulate(&mem_layout.text);
+        write_end_of_trace(insn_cnt);
+        report_timing("serializing", get_serializing_time_ms());
+        report_progress("done", insn_cnt);
+    }
     // #######################################################
 
-    printf("Number of instructions executed: %d\n\n", insn_cnt);
-
     destroy_serializer();
     dispose(&mem_layout, &assembly);
 
@@ -1,138 +1,734 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
-#include <omp.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <elf.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 #include "preprocessor.h"
 #include "utils.h"
 
 
 
-static void process_symbol_table(FILE *fp, struct MemoryLayout *mem)
+#define INITIAL_BUFFER_CAPACITY  ( 64 )
+
+// the DWARF forms that can appear in the directory and file name tables of a version 5 line program header
+#define DW_FORM_block        ( 0x09 )
+#define DW_FORM_block1       ( 0x0a )
+#define DW_FORM_data1        ( 0x0b )
+#define DW_FORM_data2        ( 0x05 )
+#define DW_FORM_data4        ( 0x06 )
+#define DW_FORM_data8        ( 0x07 )
+#define DW_FORM_data16       ( 0x1e )
+#define DW_FORM_string       ( 0x08 )
+#define DW_FORM_strp         ( 0x0e )
+#define DW_FORM_udata        ( 0x0f )
+#define DW_FORM_line_strp    ( 0x1f )
+
+// the content types of the entries of the directory and file name tables
+#define DW_LNCT_path             ( 0x1 )
+#define DW_LNCT_directory_index  ( 0x2 )
+
+// the standard and extended opcodes of the line number program
+#define DW_LNS_copy                ( 1 )
+#define DW_LNS_advance_pc          ( 2 )
+#define DW_LNS_advance_line        ( 3 )
+#define DW_LNS_set_file            ( 4 )
+#define DW_LNS_const_add_pc        ( 8 )
+#define DW_LNS_fixed_advance_pc    ( 9 )
+#define DW_LNE_end_sequence        ( 1 )
+#define DW_LNE_set_address         ( 2 )
+
+
+
+/**
+ * @brief The compiled program mapped into memory, with its section headers located.
+ */
+struct ElfFile
+{
+    const uint8_t *base;
+    size_t size;
+    const Elf64_Shdr *sections;
+    uint16_t num_sections;
+    const char *section_names;
+};
+
+/**
+ * @brief A row of the DWARF line table: the source line an instruction was assembled from.
+ */
+struct LineRow
+{
+    uint64_t addr;
+    uint32_t file;      // index into the source files read so far
+    uint32_t line;      // 1-based line number, 0 if the instruction has no source line
+    uint32_t order;     // the position of the row in the line table, keeps the sort stable
+};
+
+/**
+ * @brief The contents of a source file referenced by the line table, split into lines.
+ */
+struct SourceFile
+{
+    char *path;
+    char *text;
+    char **lines;
+    uint32_t num_lines;
+};
+
+static struct SourceFile *source_files = NULL;
+static size_t num_source_files = 0;
+static size_t source_files_capacity = 0;
+
+
+
+/**
+ * @brief Makes sure a heap buffer can hold at least `needed` elements,
+ *        doubling its capacity as many times as necessary.
+ *
+ * @param buf The buffer to grow, or NULL to allocate a new one.
+ * @param capacity The number of elements the buffer can hold, updated when it grows.
+ * @param needed The number of elements the buffer has to be able to hold.
+ * @param elem_size The size of an element in bytes.
+ *
+ * @return The (possibly moved) buffer.
+ */
+static void *reserve(void *buf, size_t *capacity, size_t needed, size_t elem_size)
+{
+    if (needed <= *capacity)
+        return buf;
+
+    size_t new_capacity = (*capacity > 0) ? *capacity : INITIAL_BUFFER_CAPACITY;
+    while (new_capacity < needed)
+        new_capacity *= 2;
+
+    void *new_buf = realloc(buf, new_capacity * elem_size);
+    if (new_buf == NULL)
+    {
+        perror("Failed to grow a preprocessor buffer");
+        exit(1);
+    }
+
+    *capacity = new_capacity;
+    return new_buf;
+}
+
+static void invalid_elf_file(const char *reason)
+{
+    fprintf(stderr, "Invalid compiled file %s: %s\n", options.binary_path, reason);
+    exit(1);
+}
+
+
+
+static void map_elf_file(const char *path, struct ElfFile *elf)
+{
+    int fd = open(path, O_RDONLY);
+    if (fd == -1)
+    {
+        perror("Failed to open the compiled file");
+        exit(1);
+    }
+
+    struct stat st;
+    if (fstat(fd, &st) == -1)
+    {
+        perror("Failed to stat the compiled file");
+        exit(1);
+    }
+
+    if ((size_t)st.st_size < sizeof(Elf64_Ehdr))
+        invalid_elf_file("too small for an ELF header");
+
+    void *base = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+
+    if (base == MAP_FAILED)
+    {
+        perror("Failed to map the compiled file");
+        exit(1);
+    }
+
+    elf->base = base;
+    elf->size = st.st_size;
+
+    const Elf64_Ehdr *header = base;
+    if (memcmp(header->e_ident, ELFMAG, SELFMAG) != 0)
+        invalid_elf_file("not an ELF file");
+    if (header->e_ident[EI_CLASS] != ELFCLASS64 || header->e_ident[EI_DATA] != ELFDATA2LSB)
+        invalid_elf_file("not a little-endian 64-bit ELF file");
+    if (header->e_shoff + (uint64_t)header->e_shnum * sizeof(Elf64_Shdr) > elf->size || header->e_shstrndx >= header->e_shnum)
+        invalid_elf_file("the section header table is out of bounds");
+
+    elf->sections = (const Elf64_Shdr *)(elf->base + header->e_shoff);
+    elf->num_sections = header->e_shnum;
+    elf->section_names = (const char *)(elf->base + elf->sections[header->e_shstrndx].sh_offset);
+}
+
+static const Elf64_Shdr *find_section(const struct ElfFile *elf, const char *name)
+{
+    for (uint16_t i = 0; i < elf->num_sections; i++)
+    {
+        if ( strcmp(elf->section_names + elf->sections[i].sh_name, name) == 0 )
+            return &elf->sections[i];
+    }
+
+    return NULL;
+}
+
+static const uint8_t *section_contents(const struct ElfFile *elf, const Elf64_Shdr *section)
+{
+    if (section->sh_type == SHT_NOBITS)
+        return NULL;
+
+    if (section->sh_offset + section->sh_size > elf->size)
+        invalid_elf_file("a section is out of bounds");
+
+    return elf->base + section->sh_offset;
+}
+
+
+
+static void process_symbol_table(const struct ElfFile *elf, struct MemoryLayout *mem)
+{
+    const Elf64_Shdr *symtab = find_section(elf, ".symtab");
+    if (symtab == NULL || symtab->sh_link >= elf->num_sections)
+        invalid_elf_file("it has no symbol table");
+
+    const Elf64_Sym *syms = (const Elf64_Sym *)section_contents(elf, symtab);
+    const char *names = (const char *)section_contents(elf, &elf->sections[symtab->sh_link]);
+    size_t num_syms = symtab->sh_size / sizeof(Elf64_Sym);
+
+    for (size_t i = 0; i < num_syms; i++)
+    {
+        const char *name = names + syms[i].st_name;
+
+        if      ( strcmp(name, "_start") == 0 )
+            mem->memory_start_addr = syms[i].st_value;
+        else if ( strcmp(name, "_end") == 0 )
+            mem->memory_end_addr = syms[i].st_value;
+        else if ( strcmp(name, "__bss_start") == 0 )
+            mem->bss.addr = syms[i].st_value;
+        else if ( strcmp(name, "main") == 0 )
+            mem->text.main_addr = syms[i].st_value;
+    }
+}
+
+static void process_section_content(const struct ElfFile *elf, const char *section_name, struct MemorySegment *segment)
+{
+    const Elf64_Shdr *section = find_section(elf, section_name);
+
+    if (section != NULL)
+    {
+        segment->addr = section->sh_addr;
+        segment->size = section->sh_size;
+    }
+
+    // keep the buffer allocated even if the segment is empty
+    segment->bytes = malloc((segment->size > 0) ? segment->size : 1);
+    if (segment->size > 0)
+        memcpy(segment->bytes, section_contents(elf, section), segment->size);
+}
+
+
+
+static uint64_t read_uleb128(const uint8_t **p, const uint8_t *end)
+{
+    uint64_t result = 0;
+    int shift = 0;
+
+    while (*p < end)
+    {
+        uint8_t byte = *(*p)++;
+        if (shift < 64)
+            result |= (uint64_t)(byte & 0x7f) << shift;
+        shift += 7;
+
+        if ((byte & 0x80) == 0)
+            break;
+    }
+
+    return result;
+}
+
+static int64_t read_sleb128(const uint8_t **p, const uint8_t *end)
 {
-    char line_buf[256] = {0};
+    int64_t result = 0;
+    int shift = 0;
+    uint8_t byte = 0;
 
-    // We are processing a line like this:
-    // "0000000000401020 g     F .text	0000000000000026              _start"
-    while ( fgets(line_buf, sizeof(line_buf), fp) != NULL )
+    while (*p < end)
     {
-        if (line_buf[0] == '0')
+        byte = *(*p)++;
+        if (shift < 64)
+            result |= (int64_t)(byte & 0x7f) << shift;
+        shift += 7;
+
+        if ((byte & 0x80) == 0)
+            break;
+    }
+
+    // sign extend the result if the sign bit of the last byte is set
+    if (shift < 64 && (byte & 0x40))
+        result |= -((int64_t)1 << shift);
+
+    return result;
+}
+
+static uint64_t read_uint(const uint8_t **p, const uint8_t *end, int size)
+{
+    if (*p + size > end)
+        invalid_elf_file("the line table is truncated");
+
+    uint64_t result = 0;
+    for (int i = 0; i < size; i++)
+        result |= (uint64_t)(*p)[i] << (8 * i);
+
+    *p += size;
+    return result;
+}
+
+static const char *read_string(const uint8_t **p, const uint8_t *end)
+{
+    const char *str = (const char *)*p;
+    size_t len = strnlen(str, end - *p);
+
+    if (*p + len >= end)
+        invalid_elf_file("the line table is truncated");
+
+    *p += len + 1;
+    return str;
+}
+
+/**
+ * @brief Returns the index of a source file, reading it and splitting it into lines on first use.
+ *        A file that cannot be read is kept without lines, so its instructions get no source text.
+ */
+static uint32_t source_file_index(const char *dir, const char *name)
+{
+    char *path;
+    if (name[0] == '/' || dir == NULL || dir[0] == '\0')
+    {
+        path = strdup(name);
+    }
+    else
+    {
+        path = malloc(strlen(dir) + strlen(name) + 2);
+        sprintf(path, "%s/%s", dir, name);
+    }
+
+    for (size_t i = 0; i < num_source_files; i++)
+    {
+        if ( strcmp(source_files[i].path, path) == 0 )
         {
-            if (mem->memory_start_addr == 0)
-            {
-                if ( strstr(line_buf, " _start") != NULL )
-                    mem->memory_start_addr = strtoul(line_buf, NULL, 16);
-            }
+            free(path);
+            return i;
+        }
+    }
 
-            if (mem->memory_end_addr == 0)
-            {
-                if ( strstr(line_buf, " _end") != NULL )
-                    mem->memory_end_addr = strtoul(line_buf, NULL, 16);
-            }
+    source_files = reserve(source_files, &source_files_capacity, num_source_files + 1, sizeof(struct SourceFile));
+    struct SourceFile *file = &source_files[num_source_files];
+    *file = (struct SourceFile){ .path = path };
 
-            if (mem->bss.addr == 0)
-            {
-                if ( strstr(line_buf, " __bss_start") != NULL )
-                    mem->bss.addr = strtoul(line_buf, NULL, 16);
-            }
+    FILE *fp = fopen(path, "r");
+    if (fp != NULL)
+    {
+        fseek(fp, 0, SEEK_END);
+        long size = ftell(fp);
+        rewind(fp);
+
+        file->text = malloc(size + 1);
+        size = fread(file->text, 1, size, fp);
+        file->text[size] = '\0';
+        fclose(fp);
+
+        // split the text in place, the lines end at the newline characters
+        size_t lines_capacity = 0;
+        char *line = file->text;
+        while (*line != '\0')
+        {
+            file->lines = reserve(file->lines, &lines_capacity, file->num_lines + 1, sizeof(char *));
+            file->lines[file->num_lines++] = line;
 
-            if (mem->text.main_addr == 0)
-            {
-                if ( strstr(line_buf, " main") != NULL )
-                    mem->text.main_addr = strtoul(line_buf, NULL, 16);
-            }
+            char *newline = strchr(line, '\n');
+            if (newline == NULL)
+                break;
+
+            *newline = '\0';
+            line = newline + 1;
         }
+    }
 
-        if (mem->memory_start_addr != 0 && mem->memory_end_addr != 0 &&
-            mem->text.main_addr    != 0 && mem->bss.addr        != 0)
-            break;
+    return num_source_files++;
+}
+
+static void free_source_files(void)
+{
+    for (size_t i = 0; i < num_source_files; i++)
+    {
+        free(source_files[i].path);
+        free(source_files[i].text);
+        free(source_files[i].lines);
     }
+
+    free(source_files);
+    source_files = NULL;
+    num_source_files = source_files_capacity = 0;
 }
 
-static void process_section_content(FILE *fp, const char *read_until_str, struct MemorySegment *segment)
+/**
+ * @brief Reads an entry format of a version 5 line program header,
+ *        and then the directory or file name entries described by it.
+ *
+ * @param paths The paths of the entries, set to point into the mapped file.
+ * @param dir_indices The directory indices of the entries, or NULL when reading the directory table.
+ *
+ * @return The number of entries read.
+ */
+static uint64_t read_entry_table(const uint8_t **p, const uint8_t *end, int offset_size,
+                                 const struct ElfFile *elf, const char ***paths, uint64_t **dir_indices)
 {
-    char line_buf[256];
-    char data_buf[1024];
+    uint8_t format_count = read_uint(p, end, 1);
+    uint64_t formats[2 * 256];
+
+    for (int i = 0; i < format_count; i++)
+    {
+        formats[2 * i]     = read_uleb128(p, end);
+        formats[2 * i + 1] = read_uleb128(p, end);
+    }
+
+    uint64_t count = read_uleb128(p, end);
+    *paths = calloc(count + 1, sizeof(char *));
+    if (dir_indices != NULL)
+        *dir_indices = calloc(count + 1, sizeof(uint64_t));
 
-    // We are processing a line like this:
-    // " 401020 f30f1efa 31ed4989 d15e4889 e24883e4  ....1.I..^H..H.."
-    while ( fgets(line_buf, sizeof(line_buf), fp) != NULL && strstr(line_buf, read_until_str) == NULL )
+    for (uint64_t entry = 0; entry < count; entry++)
     {
-        // valid lines all start with a space character
-        if (line_buf[0] == ' ')
+        for (int i = 0; i < format_count; i++)
         {
-            // only extract the segment's address on first encounter
-            if (segment->addr == 0)
-                segment->addr = strtoull(line_buf, NULL, 16);
+            uint64_t content_type = formats[2 * i];
+            uint64_t form = formats[2 * i + 1];
+            const char *str = NULL;
+            uint64_t value = 0;
 
-            // start at 8, because we want to skip the address part of the line
-            // increment i by 2 because we process two hex characters (1 byte) at a time
-            for (size_t i = 8; i < strlen(line_buf); i += 2)
+            switch (form)
             {
-                if (line_buf[i] == ' ')
+                case DW_FORM_string:    str = read_string(p, end); break;
+                case DW_FORM_line_strp:
+                case DW_FORM_strp:
                 {
-                    // if we encounter 2 space characters, we ran out of useful characters to process
-                    if (line_buf[i + 1] == ' ')
-                        break;
+                    const Elf64_Shdr *strings = find_section(elf, (form == DW_FORM_line_strp) ? ".debug_line_str" : ".debug_str");
+                    uint64_t offset = read_uint(p, end, offset_size);
+                    if (strings == NULL || offset >= strings->sh_size)
+                        invalid_elf_file("a line table string is out of bounds");
 
-                    // jump over the space character
-                    i++;
+                    str = (const char *)section_contents(elf, strings) + offset;
+                    break;
                 }
-
-                // convert the next two hex characters to a byte
-                char hex[] = { line_buf[i], line_buf[i + 1], '\0' };
-                data_buf[segment->size++] = hex_to_byte(hex);
+                case DW_FORM_udata:     value = read_uleb128(p, end); break;
+                case DW_FORM_data1:     value = read_uint(p, end, 1); break;
+                case DW_FORM_data2:     value = read_uint(p, end, 2); break;
+                case DW_FORM_data4:     value = read_uint(p, end, 4); break;
+                case DW_FORM_data8:     value = read_uint(p, end, 8); break;
+                case DW_FORM_data16:    *p += 16; break;
+                case DW_FORM_block:     *p += read_uleb128(p, end); break;
+                case DW_FORM_block1:    *p += read_uint(p, end, 1); break;
+                default:
+                    invalid_elf_file("the line table uses an unsupported form");
             }
+
+            if (content_type == DW_LNCT_path)
+                (*paths)[entry] = str;
+            else if (content_type == DW_LNCT_directory_index && dir_indices != NULL)
+                (*dir_indices)[entry] = value;
         }
     }
 
-    segment->bytes = malloc(segment->size);
-    memcpy(segment->bytes, data_buf, segment->size);
+    return count;
 }
 
-static void read_assembly_instructions(FILE *fp, struct AssemblyText *assembly)
+/**
+ * @brief Runs the line number program of a unit of `.debug_line`, appending the rows it emits.
+ *
+ * @return A pointer to the next unit.
+ */
+static const uint8_t *read_line_program(const struct ElfFile *elf, const uint8_t *p, const uint8_t *section_end,
+                                        struct LineRow **rows, size_t *num_rows, size_t *rows_capacity)
 {
-    char as_lines[256][256];
-    char as_line_buf[256];
-    char line_buf[256];
-    uint64_t as_addrs[256];
-    int line_idx = 0;
+    int offset_size = 4;
+    uint64_t unit_length = read_uint(&p, section_end, 4);
+    if (unit_length == 0xffffffff)
+    {
+        offset_size = 8;
+        unit_length = read_uint(&p, section_end, 8);
+    }
+
+    if (unit_length > (uint64_t)(section_end - p))
+        invalid_elf_file("the line table is truncated");
 
-    while ( fgets(line_buf, sizeof(line_buf), fp) != NULL )
+    const uint8_t *end = p + unit_length;
+
+    uint16_t version = read_uint(&p, end, 2);
+    if (version < 2 || version > 5)
+        invalid_elf_file("the line table has an unsupported version");
+
+    if (version >= 5)
+        p += 2; // address size and segment selector size
+
+    uint64_t header_length = read_uint(&p, end, offset_size);
+    const uint8_t *program = p + header_length;
+
+    uint8_t min_insn_length = read_uint(&p, end, 1);
+    if (version >= 4)
+        p += 1; // maximum operations per instruction, always 1 on x86
+    p += 1; // the default of is_stmt, every row is used regardless of it
+    int8_t line_base = (int8_t)read_uint(&p, end, 1);
+    uint8_t line_range = read_uint(&p, end, 1);
+    uint8_t opcode_base = read_uint(&p, end, 1);
+    const uint8_t *opcode_lengths = p;
+    p += opcode_base - 1;
+
+    if (line_range == 0 || p > end)
+        invalid_elf_file("the line table header is invalid");
+
+    // resolve the file names of the unit to indices into the source files
+    const char **dirs = NULL, **names = NULL;
+    uint64_t *dir_indices = NULL;
+    uint64_t num_files;
+
+    if (version >= 5)
     {
-        if ( strstr(line_buf, "Disassembly of section .rodata:") != NULL )
-            break;
+        uint64_t num_dirs = read_entry_table(&p, end, offset_size, elf, &dirs, NULL);
+        num_files = read_entry_table(&p, end, offset_size, elf, &names, &dir_indices);
 
-        // When the two buffers contain lines like these:
-        // "#         pop        rbp"
-        // "  401176:	5d                   	pop    rbp"
-        if (as_line_buf[0] == '#' && line_buf[0] == ' ')
+        for (uint64_t i = 0; i < num_files; i++)
         {
-            // We are parsing a line like this:
-            // "40110c:	push   rbp"
-            sscanf(line_buf, "  %6lx", &as_addrs[line_idx]);
-
-            // read until '#' or a newline
-            // this means we won't save comments from the source code
-            sscanf(as_line_buf, "#%[^#\n]", as_lines[line_idx]);
-            line_idx++;
+            if (dir_indices[i] >= num_dirs)
+                dir_indices[i] = 0;
         }
+    }
+    else
+    {
+        // before version 5 the tables are lists of strings, where the 0th directory
+        // (the compilation directory) is implicit and the file names are indexed from 1
+        size_t dirs_capacity = 0, names_capacity = 0, dir_indices_capacity = 0;
+        uint64_t num_dirs = 0;
+        num_files = 0;
+
+        dirs = reserve(dirs, &dirs_capacity, 1, sizeof(char *));
+        dirs[num_dirs++] = NULL;
+        while (p < end && *p != '\0')
+        {
+            dirs = reserve(dirs, &dirs_capacity, num_dirs + 1, sizeof(char *));
+            dirs[num_dirs++] = read_string(&p, end);
+        }
+        p++;
+
+        do
+        {
+            names = reserve(names, &names_capacity, num_files + 1, sizeof(char *));
+            dir_indices = reserve(dir_indices, &dir_indices_capacity, num_files + 1, sizeof(uint64_t));
+
+            if (num_files == 0)
+            {
+                names[0] = NULL;
+                dir_indices[0] = 0;
+            }
+            else
+            {
+                names[num_files] = read_string(&p, end);
+                dir_indices[num_files] = read_uleb128(&p, end);
+                read_uleb128(&p, end); // modification time
+                read_uleb128(&p, end); // file length
+
+                if (dir_indices[num_files] >= num_dirs)
+                    dir_indices[num_files] = 0;
+            }
 
-        memcpy(as_line_buf, line_buf, strlen(line_buf));
+            num_files++;
+        } while (p < end && *p != '\0');
     }
 
-    assembly->num_lines = line_idx;
-    assembly->addresses = malloc(sizeof(uint64_t) * assembly->num_lines);
-    assembly->lines     = malloc(sizeof(char *) * assembly->num_lines);
+    uint32_t *file_indices = malloc(sizeof(uint32_t) * (num_files + 1));
+    for (uint64_t i = 0; i < num_files; i++)
+        file_indices[i] = (names[i] != NULL) ? source_file_index(dirs[dir_indices[i]], names[i]) : UINT32_MAX;
+
+    free(dirs);
+    free(names);
+    free(dir_indices);
+
+
+    // the state machine of the line number program
+    uint64_t addr = 0;
+    uint64_t file = 1;
+    int64_t line = 1;
+    p = program;
+
+    #define EMIT_ROW()                                                                                  \
+        do {                                                                                            \
+            *rows = reserve(*rows, rows_capacity, *num_rows + 1, sizeof(struct LineRow));               \
+            (*rows)[*num_rows] = (struct LineRow){                                                      \
+                .addr = addr,                                                                           \
+                .file = (file < num_files) ? file_indices[file] : UINT32_MAX,                           \
+                .line = (line > 0) ? (uint32_t)line : 0,                                                \
+                .order = *num_rows,                                                                     \
+            };                                                                                          \
+            (*num_rows)++;                                                                              \
+        } while (0)
+
+    while (p < end)
+    {
+        uint8_t opcode = *p++;
 
-    for (int i = 0; i < assembly->num_lines; i++)
+        if (opcode >= opcode_base)
+        {
+            // special opcode: advance both the address and the line, then emit a row
+            uint8_t adjusted = opcode - opcode_base;
+            addr += (adjusted / line_range) * min_insn_length;
+            line += line_base + (adjusted % line_range);
+            EMIT_ROW();
+            continue;
+        }
+
+        switch (opcode)
+        {
+            case 0: // extended opcode
+            {
+                uint64_t length = read_uleb128(&p, end);
+                const uint8_t *next = p + length;
+                if (length == 0 || next > end)
+                    invalid_elf_file("the line program is truncated");
+
+                uint8_t extended = *p++;
+                if (extended == DW_LNE_end_sequence)
+                {
+                    // the address of an end of sequence is past the last instruction, it gets no row
+                    addr = 0;
+                    file = 1;
+                    line = 1;
+                }
+                else if (extended == DW_LNE_set_address)
+                {
+                    addr = read_uint(&p, next, length - 1);
+                }
+
+                p = next;
+                break;
+            }
+            case DW_LNS_copy:
+                EMIT_ROW();
+                break;
+            case DW_LNS_advance_pc:
+                addr += read_uleb128(&p, end) * min_insn_length;
+                break;
+            case DW_LNS_advance_line:
+                line += read_sleb128(&p, end);
+                break;
+            case DW_LNS_set_file:
+                file = read_uleb128(&p, end);
+                break;
+            case DW_LNS_const_add_pc:
+                addr += ((255 - opcode_base) / line_range) * min_insn_length;
+                break;
+            case DW_LNS_fixed_advance_pc:
+                addr += read_uint(&p, end, 2);
+                break;
+            default:
+                // skip the operands of the opcodes that do not affect the address or the line
+                for (int i = 0; i < opcode_lengths[opcode - 1]; i++)
+                    read_uleb128(&p, end);
+        }
+    }
+
+    #undef EMIT_ROW
+
+    free(file_indices);
+    return end;
+}
+
+static int compare_line_rows(const void *a, const void *b)
+{
+    const struct LineRow *ra = a, *rb = b;
+
+    if (ra->addr != rb->addr)
+        return (ra->addr < rb->addr) ? -1 : 1;
+
+    return (ra->order < rb->order) ? -1 : (ra->order > rb->order);
+}
+
+static void read_assembly_instructions(const struct ElfFile *elf, const struct TextSegment *text, struct AssemblyText *assembly)
+{
+    const Elf64_Shdr *debug_line = find_section(elf, ".debug_line");
+    if (debug_line == NULL)
+        invalid_elf_file("it has no line table, it was not compiled with -g");
+
+    struct LineRow *rows = NULL;
+    size_t num_rows = 0;
+    size_t rows_capacity = 0;
+
+    const uint8_t *p = section_contents(elf, debug_line);
+    const uint8_t *end = p + debug_line->sh_size;
+    while (p < end)
+        p = read_line_program(elf, p, end, &rows, &num_rows, &rows_capacity);
+
+    qsort(rows, num_rows, sizeof(struct LineRow), compare_line_rows);
+
+
+    char **lines = NULL;
+    size_t lines_capacity = 0;
+    uint64_t *addrs = NULL;
+    size_t addrs_capacity = 0;
+    int line_idx = 0;
+
+    const struct LineRow *prev = NULL;
+
+    for (size_t i = 0; i < num_rows; i++)
     {
-        assembly->addresses[i] = as_addrs[i];
+        const struct LineRow *row = &rows[i];
+
+        // only the last of the rows at the same address counts, it is the line the instruction was assembled from
+        if (i + 1 < num_rows && rows[i + 1].addr == row->addr)
+            continue;
+
+        if (row->addr < text->seg.addr || row->addr >= text->seg.addr + text->seg.size)
+            continue;
+
+        // consecutive instructions assembled from the same source line (e.g. from a macro) are listed once
+        if (prev != NULL && prev->file == row->file && prev->line == row->line)
+            continue;
+        prev = row;
+
+        if (row->file == UINT32_MAX || row->line == 0 || row->line > source_files[row->file].num_lines)
+            continue;
+
+        lines = reserve(lines, &lines_capacity, line_idx + 1, sizeof(char *));
+        addrs = reserve(addrs, &addrs_capacity, line_idx + 1, sizeof(uint64_t));
+
+        addrs[line_idx] = row->addr;
+
+        // read until '#', this means we won't save comments from the source code
+        // the line is indented by a space, the way it is listed in a disassembly interleaved with the source
+        const char *source_line = source_files[row->file].lines[row->line - 1];
+        size_t line_len = strcspn(source_line, "#\r");
+        lines[line_idx] = malloc(line_len + 2);
+        lines[line_idx][0] = ' ';
+        memcpy(lines[line_idx] + 1, source_line, line_len);
+        lines[line_idx][line_len + 1] = '\0';
 
-        assembly->lines[i] = malloc(sizeof(char) * 128);
-        memcpy(assembly->lines[i], as_lines[i], 128);
+        line_idx++;
     }
 
+    free(rows);
+    free_source_files();
+
+    assembly->num_lines = line_idx;
+    assembly->addresses = addrs;
+    assembly->lines     = lines;
+
+
+    if (!IS_VERBOSE(VERBOSITY_SUMMARY))
+        return;
 
     for (int i = 0; i < assembly->num_lines; i++)
     {
@@ -140,75 +736,144 @@ static void read_assembly_instructions(FILE *fp, struct AssemblyText *assembly)
     }
 }
 
-static void get_symbol_data(FILE *fp, const char *read_until_str, struct MemorySegment *segment)
+
+
+/**
+ * @brief Ranks the symbols defined at the same address, the lowest ranked one is shown.
+ *        Objects and functions come before plain labels, and global symbols before weak and local ones.
+ */
+static int symbol_rank(const Elf64_Sym *sym)
 {
-    char line_buf[256];
-    int sym_arr_size = 8;
-    int sym_idx = 0; // variable keeping track of the number of symbols in the segment
+    int type = ELF64_ST_TYPE(sym->st_info);
+    int bind = ELF64_ST_BIND(sym->st_info);
+
+    int rank = (type == STT_OBJECT || type == STT_FUNC) ? 0 : 3;
+    rank += (bind == STB_GLOBAL) ? 0 : (bind == STB_WEAK) ? 1 : 2;
+
+    return rank;
+}
+
+/**
+ * @brief Checks whether the symbol is one the linker defines at the boundaries of the segments,
+ *        which are not variables of the program.
+ */
+static int is_linker_symbol(const char *name)
+{
+    static const char *linker_symbols[] = { "__bss_start", "_edata", "_end" };
 
-    struct Symbol **syms = calloc(sym_arr_size, sizeof(struct Symbol *));
-    for (int i = 0; i < sym_arr_size; i++)
+    for (size_t i = 0; i < sizeof(linker_symbols) / sizeof(linker_symbols[0]); i++)
     {
-        syms[i] = calloc(1, sizeof(struct Symbol));
-        syms[i]->name = malloc(64 + 1);
+        if (strcmp(name, linker_symbols[i]) == 0)
+            return 1;
     }
 
-    while ( fgets(line_buf, sizeof(line_buf), fp) != NULL && strstr(line_buf, read_until_str) == NULL)
+    return 0;
+}
+
+static const char *sorted_symbol_names = NULL;
+
+static int compare_symbols(const void *a, const void *b)
+{
+    const Elf64_Sym *sa = *(const Elf64_Sym **)a, *sb = *(const Elf64_Sym **)b;
+
+    if (sa->st_value != sb->st_value)
+        return (sa->st_value < sb->st_value) ? -1 : 1;
+
+    if (symbol_rank(sa) != symbol_rank(sb))
+        return symbol_rank(sa) - symbol_rank(sb);
+
+    return strcmp(sorted_symbol_names + sa->st_name, sorted_symbol_names + sb->st_name);
+}
+
+static void get_symbol_data(const struct ElfFile *elf, const char *section_name, struct MemorySegment *segment)
+{
+    const Elf64_Shdr *section = find_section(elf, section_name);
+    const Elf64_Shdr *symtab = find_section(elf, ".symtab");
+
+    segment->num_symbols = 0;
+    segment->symbols = NULL;
+
+    if (section == NULL || symtab == NULL)
+        return;
+
+    uint16_t section_idx = section - elf->sections;
+    const Elf64_Sym *syms = (const Elf64_Sym *)section_contents(elf, symtab);
+    const char *names = (const char *)section_contents(elf, &elf->sections[symtab->sh_link]);
+    size_t num_syms = symtab->sh_size / sizeof(Elf64_Sym);
+
+    // collect the named symbols that lie within both the section and the segment,
+    // the BSS segment starts at __bss_start, which can be below the start of the section
+    uint64_t start_addr = (section->sh_addr > segment->addr) ? section->sh_addr : segment->addr;
+    uint64_t end_addr = section->sh_addr + section->sh_size;
+    if (end_addr > segment->addr + segment->size)
+        end_addr = segment->addr + segment->size;
+
+    const Elf64_Sym **candidates = NULL;
+    size_t candidates_capacity = 0;
+    size_t num_candidates = 0;
+
+    for (size_t i = 0; i < num_syms; i++)
     {
-        // only lines starting with '0' can contain a symbol's info
-        if (line_buf[0] != '0')
+        int type = ELF64_ST_TYPE(syms[i].st_info);
+
+        if (syms[i].st_shndx != section_idx || type == STT_SECTION || type == STT_FILE || names[syms[i].st_name] == '\0')
+            continue;
+        if (syms[i].st_value < start_addr || syms[i].st_value >= end_addr)
+            continue;
+        if (type == STT_NOTYPE && is_linker_symbol(names + syms[i].st_name))
             continue;
 
-        // we are trying to extract a symbol's info from a line like this:
-        // "0000000000402004 <txt1>:"
-        int items_processed = sscanf(line_buf, "%16lx <%[^>]", &syms[sym_idx]->addr, syms[sym_idx]->name);
+        candidates = reserve(candidates, &candidates_capacity, num_candidates + 1, sizeof(Elf64_Sym *));
+        candidates[num_candidates++] = &syms[i];
+    }
 
-        // only store a symbol if both its address and name could be read from a line
-        if (items_processed == 2)
-        {
-            // calculate the size of the (n-1)th symbol in the segment by subtracting
-            // its starting address from the starting address of the nth symbol
-            if (sym_idx > 0)
-            {
-                struct Symbol *prev = syms[sym_idx - 1];
-                struct Symbol *curr = syms[sym_idx];
+    sorted_symbol_names = names;
+    qsort(candidates, num_candidates, sizeof(Elf64_Sym *), compare_symbols);
 
-                prev->size = curr->addr - prev->addr;
-                prev->bytes = malloc(prev->size);
 
-                // copy the bytes of the (n-1)th symbol from the segment's bytes
-                memcpy(prev->bytes, segment->bytes + (prev->addr - segment->addr), prev->size);
-            }
+    struct Symbol **symbols = NULL;
+    size_t symbols_capacity = 0;
+    int sym_idx = 0; // variable keeping track of the number of symbols in the segment
 
-            sym_idx++;
-        }
+    for (size_t i = 0; i < num_candidates; i++)
+    {
+        // only keep the best ranked symbol of every address
+        if (sym_idx > 0 && symbols[sym_idx - 1]->addr == candidates[i]->st_value)
+            continue;
 
-        if (sym_idx >= sym_arr_size)
+        if (sym_idx == UINT16_MAX)
         {
-            sym_arr_size *= 2;
-            syms = realloc(syms, sym_arr_size * sizeof(struct Symbol *));
-
-            for (int i = sym_idx; i < sym_arr_size; i++)
-            {
-                syms[i] = calloc(1, sizeof(struct Symbol));
-                syms[i]->name = malloc(64 + 1);
-            }
+            fprintf(stderr, "The %#lx segment has more than %d symbols\n", segment->addr, UINT16_MAX);
+            exit(1);
         }
+
+        symbols = reserve(symbols, &symbols_capacity, sym_idx + 1, sizeof(struct Symbol *));
+        symbols[sym_idx] = calloc(1, sizeof(struct Symbol));
+        symbols[sym_idx]->addr = candidates[i]->st_value;
+        symbols[sym_idx]->name = strdup(names + candidates[i]->st_name);
+        sym_idx++;
     }
 
-    syms = realloc(syms, sym_idx * sizeof(struct Symbol *));
+    free(candidates);
 
     segment->num_symbols = sym_idx;
-    segment->symbols = syms;
+    segment->symbols = symbols;
 
-    // calculate the size of the last symbol in the segment by subtracting
-    // its starting address from the end address of the segment
-    struct Symbol *last_symbol = segment->symbols[segment->num_symbols - 1];
-    last_symbol->size = (segment->addr + segment->size) - last_symbol->addr;
+    // a symbol spans until the next symbol, the last one until the end of the segment
+    for (int i = 0; i < segment->num_symbols; i++)
+    {
+        struct Symbol *sym = segment->symbols[i];
+        uint64_t next_addr = (i + 1 < segment->num_symbols) ? segment->symbols[i + 1]->addr : segment->addr + segment->size;
+
+        sym->size = next_addr - sym->addr;
+        sym->bytes = malloc((sym->size > 0) ? sym->size : 1);
+
+        // copy the bytes of the symbol from the segment's bytes
+        memcpy(sym->bytes, segment->bytes + (sym->addr - segment->addr), sym->size);
+    }
 
-    // copy the bytes of the last symbol from the segment's bytes
-    last_symbol->bytes = malloc(last_symbol->size);
-    memcpy(last_symbol->bytes, segment->bytes + (last_symbol->addr - segment->addr), last_symbol->size);
+    if (!IS_VERBOSE(VERBOSITY_SUMMARY))
+        return;
 
     for (int i = 0; i < segment->num_symbols; i++)
     {
@@ -216,66 +881,49 @@ static void get_symbol_data(FILE *fp, const char *read_until_str, struct MemoryS
                "Its address: %#lx\n"\
                "Its size: %ld\n", segment->symbols[i]->name, segment->symbols[i]->addr, segment->symbols[i]->size);
 
-        for (int j = 0; j < segment->symbols[i]->size; j++)
+        for (uint64_t j = 0; j < segment->symbols[i]->size; j++)
             printf("%02x ", segment->symbols[i]->bytes[j]);
 
         puts("");
     }
 }
 
-void process_objdump_output(struct MemoryLayout *mem, struct AssemblyText *assembly)
+void process_compiled_file(struct MemoryLayout *mem, struct AssemblyText *assembly)
 {
-    // objdump -sStw --source-comment --no-show-raw-insn -M"x86-64,intel" -j .text -j .bss -j .data -j .rodata sout
-    FILE *obj_fp = popen(
-        "/usr/bin/objdump "
-        "-s "                           // display the full contents of sections
-        "-S "                           // interleave source code lines with disassembly (implies -d [--disassemble])
-        "-t "                           // print the symbol table entries of the file
-//      "-w "                           // dont't line-wrap machine-code bytes
-        "--source-comment "             // all source code lines are prefixed with `# `
-        "--no-show-raw-insn "           // when disassembling instructions, do not print their bytecode
-        "-M \"x86-64,intel\" "          // specify target architecture and syntax style
-        "--section=.text "              // disassemble .text section
-        "--section=.rodata "            // disassemble .rodata section
-        "--section=.data "              // disassemble .data section
-        "--section=.bss "               // disassemble .bss section
-        COMPILED_FILE_PATH,             // the compiled file
-        "r");
-
-    if (obj_fp == NULL)
-    {
-        perror("Call to popen failed");
-        exit(1);
-    }
+    // the compiled file is mapped read-only, the section headers, the symbol table
+    // and the line table are all read in place
+    struct ElfFile elf;
+    map_elf_file(options.binary_path, &elf);
 
 
     // get the addresses of start, end, __bss_start and main symbols from the symbol table
-    process_symbol_table(obj_fp, mem);
+    process_symbol_table(&elf, mem);
 
     // read contents of the TEXT segment
-    process_section_content(obj_fp, "Contents of section .rodata",   &mem->text.seg);
+    process_section_content(&elf, ".text",   &mem->text.seg);
     // read contents of the RODATA segment
-    process_section_content(obj_fp, "Contents of section .data",     &mem->rodata);
+    process_section_content(&elf, ".rodata", &mem->rodata);
     // read contents of the DATA segment
-    process_section_content(obj_fp, "Disassembly of section .text:", &mem->data);
+    process_section_content(&elf, ".data",   &mem->data);
 
     // set the rest of the BSS segment
     mem->bss.size = mem->memory_end_addr - mem->bss.addr;
     mem->bss.bytes = calloc(mem->bss.size, 1);
 
-    // read assembly instructions and their addresses
-    read_assembly_instructions(obj_fp, assembly);
+    // read the source lines of the assembly instructions and their addresses from the DWARF line table
+    read_assembly_instructions(&elf, &mem->text, assembly);
+    build_address_index(assembly);
 
 
     // extract the symbols from RODATA
-    get_symbol_data(obj_fp, "Disassembly of section .data:", &mem->rodata);
+    get_symbol_data(&elf, ".rodata", &mem->rodata);
 
     // extract the symbols from DATA
-    get_symbol_data(obj_fp, "Disassembly of section .bss:", &mem->data);
+    get_symbol_data(&elf, ".data", &mem->data);
 
     // extract the symbols from BSS
-    get_symbol_data(obj_fp, "random bullshit go", &mem->bss);
+    get_symbol_data(&elf, ".bss", &mem->bss);
 
 
-    pclose(obj_fp);
+    munmap((void *)elf.base, elf.size);
 }
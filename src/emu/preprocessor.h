@@ -5,7 +5,7 @@
 
 
 
-void process_objdump_output(struct MemoryLayout *mem_layout, struct AssemblyText *assembly);
+void process_compiled_file(struct MemoryLayout *mem_layout, struct AssemblyText *assembly);
 
 
 
@@ -1,19 +1,118 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
 #include <errno.h>
+#include <time.h>
 
 #include "serializer.h"
 #include "utils.h"
 
 
+#define OUTPUT_BUFFER_SIZE   ( 1 << 20 )     // size of the stdio buffer of the output file: 1MB
+#define STREAM_BUFFER_SIZE   ( 1 << 16 )     // size of the stdio buffer when streaming to stdout: 64kB, so the reader gets data early
+#define RECORD_HEADER_SIZE   ( 8 )           // u16 type | u16 reserved | u32 payload length
+
+
 extern struct AssemblyText assembly;
 FILE *emu_out_fp;
+static enum OutputFormat output_format;
+static uint32_t contexts_written;
+static int is_streaming;
+
+// buffer that holds the binary record that is currently being built,
+// so that every record gets written to the output file with a single `fwrite`
+static uint8_t *rec_buf;
+static size_t rec_len;
+static size_t rec_cap;
+
+// the time spent building and writing binary records, only measured when progress reports were requested
+static struct timespec rec_start_time;
+static uint64_t serializing_ns;
 
 
 #define PRINT_TO_FILE(format_str, ...)     \
     fprintf(emu_out_fp, format_str, ##__VA_ARGS__);
 
+// the emulator only runs on x86-64 hosts, which are little-endian,
+// so copying the values byte by byte already yields the little-endian encoding
+#define REC_PUT_VALUE(type, value)          \
+{                                           \
+    type _val = (value);                    \
+    rec_put(&_val, sizeof(_val));           \
+}
+
+
+
+static void rec_put(const void *data, size_t size)
+{
+    if (rec_len + size > rec_cap)
+    {
+        while (rec_len + size > rec_cap)
+            rec_cap *= 2;
+
+        rec_buf = realloc(rec_buf, rec_cap);
+        if (rec_buf == NULL)
+        {
+            perror("Failed to grow the record buffer");
+            exit(1);
+        }
+    }
 
+    memcpy(rec_buf + rec_len, data, size);
+    rec_len += size;
+}
+
+static void rec_begin(enum TraceRecordType type)
+{
+    if (options.progress)
+        clock_gettime(CLOCK_MONOTONIC, &rec_start_time);
+
+    rec_len = 0;
+
+    REC_PUT_VALUE(uint16_t, type)
+    REC_PUT_VALUE(uint16_t, 0)
+    REC_PUT_VALUE(uint32_t, 0)      // placeholder for the payload length, filled in by `rec_end`
+}
+
+static void rec_end()
+{
+    uint32_t payload_len = rec_len - RECORD_HEADER_SIZE;
+    memcpy(rec_buf + 4, &payload_len, sizeof(payload_len));
+
+    fwrite(rec_buf, 1, rec_len, emu_out_fp);
+
+    if (options.progress)
+    {
+        struct timespec end;
+        clock_gettime(CLOCK_MONOTONIC, &end);
+        serializing_ns += (uint64_t)(end.tv_sec - rec_start_time.tv_sec) * 1000000000ull + end.tv_nsec - rec_start_time.tv_nsec;
+    }
+}
+
+static void rec_put_segment(struct MemorySegment *seg)
+{
+    REC_PUT_VALUE(uint64_t, seg->addr)
+    REC_PUT_VALUE(uint64_t, seg->size)
+    REC_PUT_VALUE(uint16_t, seg->num_symbols)
+    rec_put(seg->bytes, seg->size);
+
+    for (int i = 0; i < seg->num_symbols; i++)
+    {
+        uint16_t name_len = strlen(seg->symbols[i]->name);
+
+        REC_PUT_VALUE(uint64_t, seg->symbols[i]->addr)
+        REC_PUT_VALUE(uint64_t, seg->symbols[i]->size)
+        REC_PUT_VALUE(uint16_t, name_len)
+        rec_put(seg->symbols[i]->name, name_len);
+    }
+}
+
+
+static void print_separator()
+{
+    PRINT_TO_FILE("><\n")
+}
 
 static void print_segment(struct MemorySegment *seg)
 {
@@ -27,25 +126,126 @@ static void print_segment(struct MemorySegment *seg)
     PRINT_TO_FILE("\n")
 }
 
-void initialize_serializer()
+static void print_symbol(struct Symbol *symbol, uint8_t *bytes)
+{
+    PRINT_TO_FILE("%ld %s ", symbol->addr, symbol->name);
+    for (uint64_t i = 0; i < symbol->size; i++)
+    {
+        PRINT_TO_FILE("%u%s", bytes[i], (i == symbol->size-1) ? "" : " ")
+    }
+
+    PRINT_TO_FILE("\n")
+}
+
+static void print_segment_symbols(struct MemorySegment *seg)
+{
+    // the symbols' bytes are sliced out of the segment's bytes, which are kept up to date by the emulator
+    for (int i = 0; i < seg->num_symbols; i++)
+    {
+        print_symbol(seg->symbols[i], seg->bytes + (seg->symbols[i]->addr - seg->addr));
+    }
+}
+
+static void print_instruction_info(int index, uint32_t size, __uint128_t bytecode)
+{
+    PRINT_TO_FILE("%d %u ", index, size);
+
+    for (uint32_t i = 0; i < size; i++)
+    {
+        PRINT_TO_FILE("%d%s", (uint32_t)((bytecode >> (i * 8)) & 0xff), (i == size-1) ? "" : " ");
+    }
+
+    PRINT_TO_FILE("\n")
+}
+
+static void print_registers(int size, uint64_t *registers)
 {
-    if ( remove(SERIALIZED_OUTPUT_PATH) == -1 && errno != ENOENT )
+    for (int i = 0; i < size; i++)
     {
-        perror("Error removing serialized output file");
+        PRINT_TO_FILE("%ld%s", registers[i], (i == size-1) ? "" : " ")
+    }
+
+    PRINT_TO_FILE("\n");
+}
+
+static void print_stack_content(int size, uint8_t *bytes)
+{
+    for (int i = 0; i < size; i++)
+    {
+        PRINT_TO_FILE("%d%s", bytes[i], (i == size-1) ? "" : " ")
+    }
+
+    PRINT_TO_FILE("\n");
+}
+
+
+
+static FILE *open_stdout_channel()
+{
+    // keep the original stdout for the trace and send everything else printed to stdout
+    // (the emulator's diagnostics) to stderr, so it can't get mixed into the trace
+    int trace_fd = dup(STDOUT_FILENO);
+    if (trace_fd == -1 || dup2(STDERR_FILENO, STDOUT_FILENO) == -1)
+    {
+        perror("Error redirecting stdout");
         exit(1);
     }
 
-    emu_out_fp = fopen(SERIALIZED_OUTPUT_PATH, "w");
+    return fdopen(trace_fd, "wb");
 }
 
-void write_separator()
+void initialize_serializer(enum OutputFormat format, const char *output_path)
 {
-    PRINT_TO_FILE("><\n")
+    output_format = format;
+    contexts_written = 0;
+    is_streaming = strcmp(output_path, SERIALIZER_STDOUT) == 0;
+
+    if (is_streaming)
+    {
+        emu_out_fp = open_stdout_channel();
+    }
+    else if (strcmp(output_path, SERIALIZER_DISCARD) == 0)
+    {
+        // not removed first, unlike the files the trace gets written to
+        emu_out_fp = fopen(output_path, "wb");
+    }
+    else
+    {
+        if ( remove(output_path) == -1 && errno != ENOENT )
+        {
+            perror("Error removing serialized output file");
+            exit(1);
+        }
+
+        emu_out_fp = fopen(output_path, (format == OUTPUT_FORMAT_TEXT) ? "w" : "wb");
+    }
+
+    if (emu_out_fp == NULL)
+    {
+        perror("Error opening serialized output file");
+        exit(1);
+    }
+
+    setvbuf(emu_out_fp, NULL, _IOFBF, is_streaming ? STREAM_BUFFER_SIZE : OUTPUT_BUFFER_SIZE);
+
+    if (format == OUTPUT_FORMAT_BINARY)
+    {
+        rec_cap = 4096;
+        rec_buf = malloc(rec_cap);
+
+        uint8_t header[TRACE_MAGIC_SIZE + 2 * sizeof(uint32_t)] = {0};
+        uint32_t version = TRACE_FORMAT_VERSION;
+
+        memcpy(header, TRACE_MAGIC, TRACE_MAGIC_SIZE);
+        memcpy(header + TRACE_MAGIC_SIZE, &version, sizeof(version));
+
+        fwrite(header, 1, sizeof(header), emu_out_fp);
+    }
 }
 
-void write_memory_layout(struct MemoryLayout *mem, uint64_t stack_start_addr, uint64_t stack_end_addr, int write_static_content)
+void write_memory_layout(struct MemoryLayout *mem, uint64_t stack_start_addr, uint64_t stack_end_addr, uint16_t stack_bytes)
 {
-    if (write_static_content)
+    if (output_format == OUTPUT_FORMAT_TEXT)
     {
         PRINT_TO_FILE("%ld\n%ld\n%ld\n%ld\n%ld\n",
             mem->memory_start_addr, mem->memory_end_addr, stack_start_addr, stack_end_addr, mem->text.main_addr);
@@ -53,74 +253,206 @@ void write_memory_layout(struct MemoryLayout *mem, uint64_t stack_start_addr, ui
         print_segment(&mem->text.seg);
 
         print_segment(&mem->rodata);
-        for (int i = 0; i < mem->rodata.num_symbols; i++)
-        {
-            write_symbol_info(mem->rodata.symbols[i]);
-        }
+        print_segment_symbols(&mem->rodata);
 
-        write_separator();
-    }
-    else
-    {
-        print_segment(&mem->data);
-        print_segment(&mem->bss);
+        print_separator();
+        return;
     }
+
+    rec_begin(TRACE_REC_LAYOUT);
+
+    REC_PUT_VALUE(uint64_t, mem->memory_start_addr)
+    REC_PUT_VALUE(uint64_t, mem->memory_end_addr)
+    REC_PUT_VALUE(uint64_t, stack_start_addr)
+    REC_PUT_VALUE(uint64_t, stack_end_addr)
+    REC_PUT_VALUE(uint64_t, mem->text.main_addr)
+    REC_PUT_VALUE(uint16_t, stack_bytes)
+
+    rec_put_segment(&mem->text.seg);
+    rec_put_segment(&mem->rodata);
+    rec_put_segment(&mem->data);
+    rec_put_segment(&mem->bss);
+
+    rec_end();
 }
 
 void write_assembly_instructions_and_addresses(struct AssemblyText *assembly)
 {
+    if (output_format == OUTPUT_FORMAT_TEXT)
+    {
+        for (int i = 0; i < assembly->num_lines; i++)
+        {
+            PRINT_TO_FILE("%ld%s\n", assembly->addresses[i], assembly->lines[i])
+        }
+
+        print_separator();
+        return;
+    }
+
+    rec_begin(TRACE_REC_ASSEMBLY);
+
+    REC_PUT_VALUE(uint32_t, assembly->num_lines)
     for (int i = 0; i < assembly->num_lines; i++)
     {
-        PRINT_TO_FILE("%ld%s\n", assembly->addresses[i], assembly->lines[i])
+        uint16_t line_len = strlen(assembly->lines[i]);
+
+        REC_PUT_VALUE(uint64_t, assembly->addresses[i])
+        REC_PUT_VALUE(uint16_t, line_len)
+        rec_put(assembly->lines[i], line_len);
     }
 
-    write_separator();
+    rec_end();
 }
 
-void write_instruction_info(int index, uint32_t size, __uint128_t bytecode)
+void write_register_names(int num_regs, const char **names)
 {
-    PRINT_TO_FILE("%d %u ", index, size);
+    // the text format relies on the register order being fixed
+    if (output_format == OUTPUT_FORMAT_TEXT)
+        return;
 
-    for (uint32_t i = 0; i < size; i++)
+    rec_begin(TRACE_REC_REGISTER_NAMES);
+
+    REC_PUT_VALUE(uint16_t, num_regs)
+    for (int i = 0; i < num_regs; i++)
     {
-        PRINT_TO_FILE("%d%s", (uint32_t)((bytecode >> (i * 8)) & 0xff), (i == size-1) ? "" : " ");
+        uint8_t name_len = strlen(names[i]);
+
+        REC_PUT_VALUE(uint8_t, name_len)
+        rec_put(names[i], name_len);
     }
 
-    PRINT_TO_FILE("\n")
+    rec_end();
 }
 
-void write_symbol_info(struct Symbol *symbol)
+void write_execution_context(int index, uint64_t address, uint32_t size, __uint128_t bytecode,
+                             int num_regs, uint64_t *registers, int stack_size, uint8_t *stack,
+                             struct MemoryLayout *mem)
 {
-    PRINT_TO_FILE("%ld %s ", symbol->addr, symbol->name);
-    for (int i = 0; i < symbol->size; i++)
+    if (output_format == OUTPUT_FORMAT_TEXT)
     {
-        PRINT_TO_FILE("%u%s", symbol->bytes[i], (i == symbol->size-1) ? "" : " ")
+        if (contexts_written++ > 0)
+            print_separator();
+
+        print_registers(num_regs, registers);
+        print_stack_content(stack_size, stack);
+        print_segment(&mem->data);
+        print_segment(&mem->bss);
+        print_instruction_info(index, size, bytecode);
+        print_segment_symbols(&mem->data);
+        print_segment_symbols(&mem->bss);
+        return;
     }
 
-    PRINT_TO_FILE("\n")
+    rec_begin(TRACE_REC_CONTEXT);
+
+    REC_PUT_VALUE(int32_t, index)
+    REC_PUT_VALUE(uint32_t, size)
+    REC_PUT_VALUE(uint64_t, address)
+    rec_put(&bytecode, TRACE_BYTECODE_SIZE);
+
+    rec_put(registers, num_regs * sizeof(uint64_t));
+    rec_put(stack, stack_size);
+    rec_put(mem->data.bytes, mem->data.size);
+    rec_put(mem->bss.bytes, mem->bss.size);
+
+    rec_end();
+
+    // the reader can show the program as soon as the first context arrives
+    if (is_streaming && contexts_written == 0)
+        fflush(emu_out_fp);
+
+    contexts_written++;
 }
 
-void write_registers(int size, uint64_t *registers)
+void write_execution_context_delta(int index, uint64_t address, uint32_t size, __uint128_t bytecode,
+                                   int num_changed_regs, uint8_t *changed_reg_slots, uint64_t *registers,
+                                   int num_writes, struct MemoryWrite *writes)
 {
-    for (int i = 0; i < size; i++)
+    rec_begin(TRACE_REC_DELTA);
+
+    REC_PUT_VALUE(int32_t, index)
+    REC_PUT_VALUE(uint32_t, size)
+    REC_PUT_VALUE(uint64_t, address)
+    rec_put(&bytecode, TRACE_BYTECODE_SIZE);
+
+    REC_PUT_VALUE(uint16_t, num_changed_regs)
+    REC_PUT_VALUE(uint16_t, num_writes)
+
+    for (int i = 0; i < num_changed_regs; i++)
     {
-        PRINT_TO_FILE("%ld%s", registers[i], (i == size-1) ? "" : " ")
+        REC_PUT_VALUE(uint8_t, changed_reg_slots[i])
+        REC_PUT_VALUE(uint64_t, registers[changed_reg_slots[i]])
     }
 
-    PRINT_TO_FILE("\n");
+    for (int i = 0; i < num_writes; i++)
+    {
+        REC_PUT_VALUE(uint64_t, writes[i].addr)
+        REC_PUT_VALUE(uint32_t, writes[i].size)
+        rec_put(writes[i].bytes, writes[i].size);
+    }
+
+    rec_end();
+    contexts_written++;
 }
 
-void write_stack_content(int size, uint8_t *bytes)
+void write_trace_truncated(enum TruncationReason reason, uint32_t insn_count)
 {
-    for (int i = 0; i < size; i++)
+    if (output_format == OUTPUT_FORMAT_TEXT)
     {
-        PRINT_TO_FILE("%d%s", bytes[i], (i == size-1) ? "" : " ")
+        if (contexts_written > 0)
+            print_separator();
+
+        PRINT_TO_FILE("!%d %u\n", reason, insn_count)
+        return;
     }
 
-    PRINT_TO_FILE("\n");
+    rec_begin(TRACE_REC_TRUNCATED);
+    REC_PUT_VALUE(uint32_t, reason)
+    REC_PUT_VALUE(uint32_t, insn_count)
+    rec_end();
+}
+
+void write_end_of_trace(uint32_t insn_count)
+{
+    if (output_format == OUTPUT_FORMAT_TEXT)
+        return;
+
+    rec_begin(TRACE_REC_END);
+    REC_PUT_VALUE(uint32_t, insn_count)
+    rec_end();
+}
+
+void write_live_position(uint32_t index, int has_program_ended)
+{
+    rec_begin(TRACE_REC_POSITION);
+    REC_PUT_VALUE(uint32_t, index)
+    REC_PUT_VALUE(uint8_t, has_program_ended != 0)
+    rec_end();
+}
+
+void write_memory_dump(uint64_t addr, uint32_t size, uint8_t *bytes)
+{
+    rec_begin(TRACE_REC_MEMORY);
+    REC_PUT_VALUE(uint64_t, addr)
+    REC_PUT_VALUE(uint32_t, size)
+    rec_put(bytes, size);
+    rec_end();
+}
+
+void flush_serializer()
+{
+    fflush(emu_out_fp);
 }
 
 void destroy_serializer()
 {
     fclose(emu_out_fp);
+
+    free(rec_buf);
+    rec_buf = NULL;
+}
+
+double get_serializing_time_ms()
+{
+    return serializing_ns / 1e6;
 }
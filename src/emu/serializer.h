@@ -4,22 +4,60 @@
 #include "utils.h"
 
 
+// Binary trace format
+//
+// The file starts with a fixed 16 byte header (magic + version + reserved), followed by
+// length-prefixed records. Every record starts with an 8 byte header:
+//     u16 type | u16 reserved | u32 payload length
+// All integers are little-endian.
+#define TRACE_MAGIC              "HOHOTRC"      // 7 characters + the terminating '\0' = 8 bytes
+#define TRACE_MAGIC_SIZE         ( 8 )
+#define TRACE_FORMAT_VERSION     ( 3 )
+#define TRACE_BYTECODE_SIZE      ( 16 )         // an x86-64 instruction can be up to 15 bytes in length
+#define SERIALIZER_STDOUT        "-"            // passing this as the output path writes the trace to stdout
+#define SERIALIZER_DISCARD       "/dev/null"    // passing this as the output path discards the trace
+
+
+enum TraceRecordType
+{
+    TRACE_REC_ASSEMBLY       = 1,    // the assembly lines and their addresses
+    TRACE_REC_REGISTER_NAMES = 2,    // the names of the registers stored in every execution context
+    TRACE_REC_LAYOUT         = 3,    // the memory layout and the static segments
+    TRACE_REC_CONTEXT        = 4,    // the full state of the processor before an instruction gets executed
+    TRACE_REC_END            = 5,    // the end of the trace, holds the number of executed instructions
+    TRACE_REC_DELTA          = 6,    // the registers and memory ranges that changed since the previous context
+    TRACE_REC_POSITION       = 7,    // live mode: the index of the current context and whether the program ended
+    TRACE_REC_MEMORY         = 8,    // live mode: the content of a requested memory range
+    TRACE_REC_TRUNCATED      = 9,    // the emulation hit a limit before the program ended
+};
+
+
+
+void initialize_serializer(enum OutputFormat format, const char *output_path);
 
-void initialize_serializer();
+void write_assembly_instructions_and_addresses(struct AssemblyText *assembly);
 
-void write_separator();
+void write_register_names(int num_regs, const char **names);
 
-void write_memory_layout(struct MemoryLayout *mem, uint64_t stack_start_addr, uint64_t stack_end_addr, int write_static_content);
+void write_memory_layout(struct MemoryLayout *mem, uint64_t stack_start_addr, uint64_t stack_end_addr, uint16_t stack_bytes);
 
-void write_assembly_instructions_and_addresses(struct AssemblyText *assembly);
+void write_execution_context(int index, uint64_t address, uint32_t size, __uint128_t bytecode,
+                             int num_regs, uint64_t *registers, int stack_size, uint8_t *stack,
+                             struct MemoryLayout *mem);
+
+void write_execution_context_delta(int index, uint64_t address, uint32_t size, __uint128_t bytecode,
+                                   int num_changed_regs, uint8_t *changed_reg_slots, uint64_t *registers,
+                                   int num_writes, struct MemoryWrite *writes);
 
-void write_instruction_info(int index, uint32_t size, __uint128_t bytecode);
+void write_trace_truncated(enum TruncationReason reason, uint32_t insn_count);
 
-void write_symbol_info(struct Symbol *symbol);
+void write_end_of_trace(uint32_t insn_count);
 
-void write_registers(int size, uint64_t *registers);
+void write_live_position(uint32_t index, int has_program_ended);
 
-void write_stack_content(int size, uint8_t *bytes);
+void write_memory_dump(uint64_t addr, uint32_t size, uint8_t *bytes);
+
+void flush_serializer();
 
 void write_stack_overflow_info(uint64_t addr);
 
@@ -27,6 +65,9 @@ void write_invalid_stack_pointer_value_indicator();
 
 void destroy_serializer();
 
+// the time spent building and writing the binary records so far, measured only with --progress
+double get_serializing_time_ms();
+
 
 
 
@@ -3,10 +3,14 @@
 #include <unistd.h>
 #include <string.h>
 #include <ctype.h>
+#include <time.h>
 
 #include "utils.h"
 
 
+static struct timespec start_time;
+
+
 
 int is_valid_filename(const char *filename)
 {
@@ -32,13 +36,71 @@ uint8_t hex_to_byte(const char *hex)
     return (uint8_t)strtoul(hex, NULL, 16);
 }
 
-int index_of_memory_address(uint64_t *addresses, int size, uint64_t address)
+void build_address_index(struct AssemblyText *assembly)
 {
-    for (int i = 0; i < size; i++)
+    assembly->line_of_offset = NULL;
+    assembly->base_addr = 0;
+    assembly->index_span = 0;
+
+    if (assembly->num_lines == 0)
+        return;
+
+    uint64_t first_addr = assembly->addresses[0];
+    uint64_t last_addr  = assembly->addresses[0];
+    for (int i = 1; i < assembly->num_lines; i++)
     {
-        if (addresses[i] == address)
-            return i;
+        if (assembly->addresses[i] < first_addr)
+            first_addr = assembly->addresses[i];
+        if (assembly->addresses[i] > last_addr)
+            last_addr = assembly->addresses[i];
     }
 
-    return -1;
-}
\ No newline at end of file
+    assembly->base_addr = first_addr;
+    assembly->index_span = last_addr - first_addr + 1;
+    assembly->line_of_offset = malloc(sizeof(int32_t) * assembly->index_span);
+
+    // every byte of 0xff makes an entry -1
+    memset(assembly->line_of_offset, 0xff, sizeof(int32_t) * assembly->index_span);
+
+    // walk backwards, so that an address appearing more than once maps to its first line
+    for (int i = assembly->num_lines - 1; i >= 0; i--)
+        assembly->line_of_offset[assembly->addresses[i] - first_addr] = i;
+}
+
+int index_of_memory_address(struct AssemblyText *assembly, uint64_t address)
+{
+    // addresses below the base wrap around to a huge offset, so a single comparison covers both ends
+    uint64_t offset = address - assembly->base_addr;
+
+    if (offset >= assembly->index_span)
+        return -1;
+
+    return assembly->line_of_offset[offset];
+}
+
+void report_progress(const char *phase, uint32_t insn_count)
+{
+    if (!options.progress)
+        return;
+
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    double elapsed_ms = (now.tv_sec - start_time.tv_sec) * 1e3 + (now.tv_nsec - start_time.tv_nsec) / 1e6;
+
+    fprintf(stderr, "progress %s %u %.3f\n", phase, insn_count, elapsed_ms);
+    fflush(stderr);
+}
+
+void report_timing(const char *activity, double ms)
+{
+    if (!options.progress)
+        return;
+
+    fprintf(stderr, "timing %s %.3f\n", activity, ms);
+    fflush(stderr);
+}
+
+void start_clock(void)
+{
+    clock_gettime(CLOCK_MONOTONIC, &start_time);
+}
@@ -6,7 +6,10 @@
 
 #define COMPILED_FILE_PATH   "/tmp/compiled_assembly_file"
 #define SERIALIZED_OUTPUT_PATH  "/tmp/emu_output_240830.txt"
+#define COMPILED_FILE_NAME   "compiled_assembly_file"   // the name of the compiled file inside a work directory
+#define SERIALIZED_OUTPUT_NAME  "emu_output"            // the name of the trace file inside a work directory
 #define MAX_FILENAME_LEN 255
+#define PROGRESS_INTERVAL  ( 1 << 16 )  // the number of instructions between two progress reports
 
 
 struct Symbol
@@ -47,8 +50,60 @@ struct AssemblyText
     char **lines;
     uint64_t *addresses;
     int num_lines;
+
+    // direct-mapped address -> line index, covering every byte from the first to the last instruction
+    int32_t *line_of_offset;    // the line of the instruction starting at `base_addr + offset`, or -1
+    uint64_t base_addr;
+    uint64_t index_span;
+};
+
+struct MemoryWrite
+{
+    uint64_t addr;
+    uint32_t size;
+    uint8_t *bytes;
 };
 
+enum OutputFormat
+{
+    OUTPUT_FORMAT_BINARY,       // versioned, length-prefixed binary records (default)
+    OUTPUT_FORMAT_TEXT,         // human readable decimal text, used for debugging
+};
+
+enum Verbosity
+{
+    VERBOSITY_QUIET,            // nothing but errors, used by the GUI
+    VERBOSITY_SUMMARY,          // the memory layout and the result of the emulation
+    VERBOSITY_TRACE,            // the registers, stack and memory accesses of every instruction (default)
+};
+
+enum TruncationReason
+{
+    TRUNCATION_NONE,            // the program returned from `main`
+    TRUNCATION_INSN_LIMIT,      // the instruction budget ran out
+    TRUNCATION_TIMEOUT,         // the wall-clock time limit ran out
+};
+
+struct EmuOptions
+{
+    const char *source_path;
+    enum OutputFormat output_format;
+    const char *output_path;    // the file the trace is written to, or "-" to stream it to stdout
+    int live;                   // keep the program resident and emulate it on demand
+    int bench;                  // only measure the throughput of the register capture paths
+    uint32_t max_insns;         // the maximum number of instructions to emulate, 0 means unlimited
+    uint32_t timeout_ms;        // the maximum wall-clock time of the emulation in milliseconds, 0 means unlimited
+    enum Verbosity verbosity;   // how much diagnostic output gets printed to stdout
+    const char *binary_path;    // the compiled file that gets emulated
+    const char *workdir;        // the directory holding the default compiled and trace files, instead of /tmp
+    int progress;               // report the phases of the run and the number of emulated instructions on stderr
+};
+
+extern struct EmuOptions options;
+
+// whether the diagnostic messages of the given verbosity level have to be printed
+#define IS_VERBOSE(level)    ( options.verbosity >= (level) )
+
 
 /**
  * @brief Checks if a given filename is valid.
@@ -86,16 +141,55 @@ int is_valid_filename(const char* filename);
 uint8_t hex_to_byte(const char *hex);
 
 /**
- * @brief Finds the index of a specified memory address in an array.
+ * @brief Builds the address -> line index of the assembly text.
+ *
+ * The instructions of the .text segment are contiguous, so the index is a table
+ * with an entry for every byte between the first and the last instruction.
+ * It has to be called once the addresses have been read, and before
+ * `index_of_memory_address` is used.
+ *
+ * @param assembly The assembly text whose addresses get indexed.
+ */
+void build_address_index(struct AssemblyText *assembly);
+
+/**
+ * @brief Finds the line of the instruction starting at a specified memory address in constant time.
+ *
+ * @param assembly The assembly text with a built address index.
+ * @param address The memory address to find.
  *
- * @param addresses A pointer to an array of addresses to search.
- * @param size The number of elements in the `addresses` array.
- * @param address The memory address to find in the array.
+ * @return The index of the line of the instruction at the address,
+ *         or -1 if no instruction starts there.
+ */
+int index_of_memory_address(struct AssemblyText *assembly, uint64_t address);
+
+/**
+ * @brief Reports the phase the emulator is in on stderr, if progress reports were requested.
  *
- * @return The index of the first occurrence of the specified address
- *         in the array, or -1 if the address is not found.
+ * Every report is a single line like "progress emulating 65536 12.345", the last field being
+ * the milliseconds elapsed since the emulator started, so a front end can time the phases
+ * and tell the reports apart from the error messages written to stderr.
+ *
+ * @param phase The name of the phase, e.g. "compiling", "loading" or "emulating".
+ * @param insn_count The number of instructions emulated so far.
+ */
+void report_progress(const char *phase, uint32_t insn_count);
+
+/**
+ * @brief Reports the time spent on an activity spread over several phases on stderr,
+ * if progress reports were requested.
+ *
+ * Every report is a single line like "timing serializing 12.345".
+ *
+ * @param activity The name of the activity, e.g. "serializing".
+ * @param ms The milliseconds spent on it.
+ */
+void report_timing(const char *activity, double ms);
+
+/**
+ * @brief Starts the clock the progress reports are timed with, called when the emulator starts.
  */
-int index_of_memory_address(uint64_t *addresses, int size, uint64_t address);
+void start_clock(void);
 
 
 
@@ -1,4 +1,12 @@
-from dataclasses import dataclass
+import functools
+import operator
+from array import array
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Sequence
+
+if TYPE_CHECKING:
+    import numpy as np
+    from trace_columns import TraceColumns
 
 
 
@@ -12,6 +20,17 @@ class AssemblyCode:
     '''The addresses of the instructions.'''
     num_lines: int
     '''The number of lines in the assembly code.'''
+    line_of_address: dict[int, int] = field(init=False, repr=False)
+    '''The index of the line of every instruction address, built once when the code is loaded.'''
+
+    def __post_init__(self):
+        # iterate backwards, so that an address appearing more than once maps to its first line
+        self.line_of_address = {addr: i for i, addr in reversed(list(enumerate(self.addresses)))}
+
+    def index_of_address(self, addr: int) -> int:
+        '''Returns the index of the line of the instruction at `addr`, or -1 if there is none.'''
+
+        return self.line_of_address.get(addr, -1)
 
 @dataclass
 class MemoryLayout:
@@ -36,7 +55,7 @@ class Symbol:
     '''The starting address of the symbol.'''
     size: int
     '''The size of the symbol in bytes.'''
-    bytes: list[int]
+    bytes: bytes
     '''The content of the symbol.'''
 
 @dataclass
@@ -49,7 +68,7 @@ class MemorySegment:
     '''The starting address of the memory segment.'''
     size: int
     '''The size of the memory segment in bytes.'''
-    bytes: list[int]
+    bytes: bytes
     '''The content of the memory segment.'''
     num_symbols: int
     '''The number of symbols in the memory segment.'''
@@ -92,119 +111,93 @@ class Instruction:
     '''The starting address of the instruction in the .text segment.'''
     size: int
     '''The size of the instruction in bytes.'''
-    bytecode: list[int]
+    bytecode: bytes
     '''The bytecode of the instruction.'''
 
-@dataclass
+REGISTER_NAMES = (
+    'RAX', 'RBX', 'RCX', 'RDX', 'RSI', 'RDI', 'RBP', 'RSP',
+    'R8', 'R9', 'R10', 'R11', 'R12', 'R13', 'R14', 'R15',
+    'RIP', 'RFLAGS',
+    'CS', 'DS', 'SS', 'ES', 'FS', 'GS',
+)
+'''The registers stored in every `Registers`, in the order of their slots.
+   The emulator reads the same registers in the same order.'''
+REGISTER_SLOTS = {name: slot for slot, name in enumerate(REGISTER_NAMES)}
+'''A mapping of the register names to their slots, shared by every `Registers`.'''
+
+SUB_REGISTERS = {
+    'EAX': ('RAX', 0, 0xffffffff), 'AX': ('RAX', 0, 0xffff), 'AH': ('RAX', 8, 0xff), 'AL': ('RAX', 0, 0xff),
+    'EBX': ('RBX', 0, 0xffffffff), 'BX': ('RBX', 0, 0xffff), 'BH': ('RBX', 8, 0xff), 'BL': ('RBX', 0, 0xff),
+    'ECX': ('RCX', 0, 0xffffffff), 'CX': ('RCX', 0, 0xffff), 'CH': ('RCX', 8, 0xff), 'CL': ('RCX', 0, 0xff),
+    'EDX': ('RDX', 0, 0xffffffff), 'DX': ('RDX', 0, 0xffff), 'DH': ('RDX', 8, 0xff), 'DL': ('RDX', 0, 0xff),
+    'ESI': ('RSI', 0, 0xffffffff), 'SI': ('RSI', 0, 0xffff), 'SIL': ('RSI', 0, 0xff),
+    'EDI': ('RDI', 0, 0xffffffff), 'DI': ('RDI', 0, 0xffff), 'DIL': ('RDI', 0, 0xff),
+    'EBP': ('RBP', 0, 0xffffffff), 'BP': ('RBP', 0, 0xffff), 'BPL': ('RBP', 0, 0xff),
+    'ESP': ('RSP', 0, 0xffffffff), 'SP': ('RSP', 0, 0xffff), 'SPL': ('RSP', 0, 0xff),
+    **{f'R{ i }{ suffix }': (f'R{ i }', 0, mask) for i in range(8, 16)
+                                                 for suffix, mask in (('D', 0xffffffff), ('W', 0xffff), ('B', 0xff))},
+    'EIP': ('RIP', 0, 0xffffffff), 'IP': ('RIP', 0, 0xffff),
+    'EFLAGS': ('RFLAGS', 0, 0xffffffff), 'FLAGS': ('RFLAGS', 0, 0xffff),
+}
+'''A mapping of the sub-register names to the register they are part of, their shift and their mask.'''
+
+FLAG_BITS = {
+    'CF': 0,    # Carry Flag
+    'PF': 2,    # Parity Flag
+    'ZF': 6,    # Zero Flag
+    'SF': 7,    # Sign Flag
+    'OF': 11,   # Overflow Flag
+}
+'''A mapping of the flag names to their bits in the RFLAGS register.'''
+
+_derived_registers = {
+    **{sub: (REGISTER_SLOTS[reg], shift, mask) for sub, (reg, shift, mask) in SUB_REGISTERS.items()},
+    **{flag: (REGISTER_SLOTS['RFLAGS'], bit, 1) for flag, bit in FLAG_BITS.items()},
+}
+
+@functools.cache
+def _register_selector(names: tuple[str, ...]) -> Callable[[Sequence[int]], tuple[int, ...]]:
+    '''Returns a function selecting the values of `REGISTER_NAMES` from values stored in the order of `names`.'''
+
+    return operator.itemgetter(*(names.index(name) for name in REGISTER_NAMES))
+
+@dataclass(slots=True)
 class Registers:
-    '''A representation of the registers.'''
-
-    RAX: int
-    EAX: int
-    AX: int
-    AH: int
-    AL: int
-
-    RBX: int
-    EBX: int
-    BX: int
-    BH: int
-    BL: int
-
-    RCX: int
-    ECX: int
-    CX: int
-    CH: int
-    CL: int
-
-    RDX: int
-    EDX: int
-    DX: int
-    DH: int
-    DL: int
-
-    RSI: int
-    ESI: int
-    SI: int
-    SIL: int
-
-    RDI: int
-    EDI: int
-    DI: int
-    DIL: int
-
-    RBP: int
-    EBP: int
-    BP: int
-    BPL: int
-
-    RSP: int
-    ESP: int
-    SP: int
-    SPL: int
-
-    R8: int
-    R8D: int
-    R8W: int
-    R8B: int
-
-    R9: int
-    R9D: int
-    R9W: int
-    R9B: int
-
-    R10: int
-    R10D: int
-    R10W: int
-    R10B: int
-
-    R11: int
-    R11D: int
-    R11W: int
-    R11B: int
-
-    R12: int
-    R12D: int
-    R12W: int
-    R12B: int
-
-    R13: int
-    R13D: int
-    R13W: int
-    R13B: int
-
-    R14: int
-    R14D: int
-    R14W: int
-    R14B: int
-
-    R15: int
-    R15D: int
-    R15W: int
-    R15B: int
-
-    RIP: int
-    EIP: int
-    IP: int
-
-    RFLAGS: int
-    EFLAGS: int
-    FLAGS: int
-
-    CS: int
-    DS: int
-    SS: int
-    ES: int
-    FS: int
-    GS: int
-
-    rdict: dict[str, int]
+    '''A representation of the registers.
+
+       Only the general purpose registers, RIP, RFLAGS and the segment registers are stored,
+       sub-registers (e.g. EAX, AH, R8D) and flags are derived from them when accessed,
+       either by name (`regs['EAX']`) or as attributes (`regs.EAX`).'''
+
+    values: array
+    '''The values of the registers, in the order of `REGISTER_NAMES`.'''
+
+
+    @staticmethod
+    def from_values(names: Sequence[str], values: Sequence[int]) -> 'Registers':
+        '''Creates a `Registers` from values stored in the order of `names`, which may include sub-registers.'''
+
+        return Registers(array('Q', _register_selector(tuple(names))(values)))
+
+    def __getitem__(self, name: str) -> int:
+        slot = REGISTER_SLOTS.get(name)
+        if slot is not None:
+            return self.values[slot]
+
+        slot, shift, mask = _derived_registers[name]
+        return (self.values[slot] >> shift) & mask
+
+    def __getattr__(self, name: str) -> int:
+        if name not in REGISTER_SLOTS and name not in _derived_registers:
+            raise AttributeError(name)
+
+        return self[name]
 
 @dataclass
 class Stack:
     '''A representation of the stack.'''
 
-    content: list[int]
+    content: bytes
     '''The content of the stack.'''
 
 @dataclass
@@ -222,6 +215,60 @@ class ExecutionContext:
     has_program_ended: bool
     '''Whether the program has ended.'''
 
+@dataclass(slots=True)
+class ContextDelta:
+    '''The changes between two consecutive execution contexts.'''
+
+    insn: tuple[int, int, int, bytes]
+    '''The index, size, address and bytecode of the instruction about to be executed.'''
+    regs: list[tuple[int, int]]
+    '''The (slot, value) pairs of the registers that changed.'''
+    writes: list[tuple[int, bytes]]
+    '''The (address, bytes) pairs of the memory ranges that were written.'''
+
+@dataclass
+class ExecutionState:
+    '''The complete, mutable state of the emulated machine that the execution contexts are rebuilt from.'''
+
+    insn: tuple[int, int, int, bytes]
+    '''The index, size, address and bytecode of the instruction about to be executed.'''
+    regs: list[int]
+    '''The values of the registers, in the order the emulator stores them.'''
+    stack: bytearray
+    '''The content of the stack.'''
+    data: bytearray
+    '''The content of the .data segment.'''
+    bss: bytearray
+    '''The content of the .bss segment.'''
+
+
+    def copy(self) -> 'ExecutionState':
+        '''Returns an independent copy of the state.'''
+
+        return ExecutionState(self.insn, self.regs.copy(), self.stack.copy(), self.data.copy(), self.bss.copy())
+
+@dataclass
+class ExecutionInfo:
+    '''Information about how the emulation of a program went.'''
+
+    has_stack_overflowed: int
+    '''Whether the program overflowed its stack.'''
+    addr: int
+    '''The address of the instruction that overflowed the stack.'''
+    is_rsp_invalid: int
+    '''Whether the stack pointer pointed outside of the stack.'''
+    truncation_reason: int
+    '''Why the emulation stopped before the program ended, see the `TRUNCATION_*` constants.'''
+    insn_count: int
+    '''The number of instructions executed before the emulation stopped.'''
+
+TRUNCATION_NONE = 0
+'''The program ended normally.'''
+TRUNCATION_INSN_LIMIT = 1
+'''The emulator's instruction budget ran out.'''
+TRUNCATION_TIMEOUT = 2
+'''The emulator's wall-clock time limit ran out.'''
+
 @dataclass
 class ExecutedProgram:
     '''A representation of a program that has been executed.'''
@@ -234,10 +281,30 @@ class ExecutedProgram:
     '''The memory layout of the program.'''
     static_mem: StaticMemory
     '''The static memory of the program.'''
-    contexts: list[ExecutionContext]
-    '''The execution contexts of the program.'''
+    contexts: Sequence[ExecutionContext]
+    '''The execution contexts of the program. Traces with deltas store them in a `TraceStore`,
+       which materializes the contexts on demand.'''
+    register_names: list[str]
+    '''The names of the registers, in the order the emulator stores them.'''
+    dynamic_mem: DynamicMemory
+    '''The initial state of the dynamic memory, which also describes the layout of its symbols.'''
+    initial_state: ExecutionState
+    '''The state of the machine before the first instruction gets executed.'''
+    deltas: Sequence[ContextDelta]
+    '''The changes leading from each execution context to the next one. Binary traces keep them
+       serialized in a `DeltaIndex`, which decodes them when accessed.'''
+    ex_info: ExecutionInfo
+    '''Information about how the emulation went.'''
+    columns: 'TraceColumns | None' = None
+    '''The contexts stored column-wise in NumPy matrices for queries over the whole trace,
+       or `None` unless the store is turned on with `HOHOEMU_COLUMNAR_STORE` and NumPy is available.'''
 
 
+    def is_truncated(self) -> bool:
+        '''Whether the emulation stopped at a limit before the program ended.'''
+
+        return self.ex_info.truncation_reason != TRUNCATION_NONE
+
     def step(self, direction: int) -> int:
         ''' Moves the instruction counter by `direction` steps.
 
@@ -262,21 +329,95 @@ class ExecutedProgram:
 
         return self.contexts[self.index]
 
+    def get_line_index(self, index: int) -> int:
+        '''Returns the index of the code line the context at `index` is about to execute,
+           without materializing the context when the trace keeps it serialized.'''
+
+        if isinstance(self.contexts, list):
+            return self.contexts[index].insn.index
+
+        return self.contexts.line_index(index)
+
+    def apply_delta(self, state: ExecutionState, delta: ContextDelta) -> None:
+        '''Applies the changes in `delta` to `state` in place.'''
+
+        state.insn = delta.insn
+
+        for slot, value in delta.regs:
+            state.regs[slot] = value
+
+        regions = (
+            (self.mem_layout.stack_start_addr - len(state.stack), state.stack),
+            (self.dynamic_mem.data.addr, state.data),
+            (self.dynamic_mem.bss.addr, state.bss),
+        )
+
+        for addr, written in delta.writes:
+            for base, buffer in regions:
+                start = max(addr, base)
+                end = min(addr + len(written), base + len(buffer))
+
+                if start < end:
+                    buffer[start - base:end - base] = written[start - addr:end - addr]
+
+    def materialize(self, state: ExecutionState) -> ExecutionContext:
+        '''Builds an immutable `ExecutionContext` from `state`.'''
+
+        index, size, addr, bytecode = state.insn
+
+
+        return ExecutionContext(
+            insn=Instruction(index, self.code.lines[index], addr, size, bytecode),
+            dynamic_mem=DynamicMemory(
+                data=self._materialize_segment(self.dynamic_mem.data, bytes(state.data)),
+                bss=self._materialize_segment(self.dynamic_mem.bss, bytes(state.bss))),
+            regs=Registers.from_values(self.register_names, state.regs),
+            stack=Stack(bytes(state.stack)),
+            has_program_ended=False)
+
+    def _materialize_segment(self, template: MemorySegment, seg_bytes: bytes) -> MemorySegment:
+        '''Builds a memory segment whose symbols are sliced out of `seg_bytes`.'''
+
+        return MemorySegment(
+            name=template.name,
+            addr=template.addr,
+            size=template.size,
+            bytes=seg_bytes,
+            num_symbols=template.num_symbols,
+            symbols=[Symbol(sym.name, sym.addr, sym.size, seg_bytes[sym.addr - template.addr:sym.addr - template.addr + sym.size])
+                     for sym in template.symbols])
+
     def get_flag(self, flag) -> int:
         '''Extracts the specified flag from the RFLAGS register.'''
 
-        rflags = self.get_current_context().regs.RFLAGS
-        match flag:
-            case 'CF':
-                return (rflags >> 0) & 1    # Carry Flag
-            case 'PF':
-                return (rflags >> 2) & 1    # Parity Flag
-            case 'ZF':
-                return (rflags >> 6) & 1    # Zero Flag
-            case 'SF':
-                return (rflags >> 7) & 1    # Sign Flag
-            case 'OF':
-                return (rflags >> 11) & 1   # Overflow Flag
+        return self.get_current_context().regs[flag]
+
+    def register_history(self, name: str) -> 'np.ndarray':
+        '''Returns the values of a register, a sub-register or a flag in every context.'''
+
+        return self._require_columns().register(name)
+
+    def first_change(self, name: str, start: int = 0) -> int | None:
+        '''Returns the index of the first context after `start` in which the value of a register,
+           a sub-register or a flag differs from the previous context, or None if it never changes.'''
+
+        history = self.register_history(name)[start:]
+        changes = (history[1:] != history[:-1]).nonzero()[0]
+
+        return start + 1 + int(changes[0]) if len(changes) else None
+
+    def register_range(self, name: str) -> tuple[int, int]:
+        '''Returns the minimum and the maximum value of a register, a sub-register or a flag over the trace.'''
+
+        history = self.register_history(name)
+
+        return int(history.min()), int(history.max())
+
+    def _require_columns(self) -> 'TraceColumns':
+        if self.columns is None:
+            raise RuntimeError('queries over the whole trace need the columnar trace store, which needs NumPy and HOHOEMU_COLUMNAR_STORE=1')
+
+        return self.columns
 
 
 def create_empty_executed_program() -> ExecutedProgram:
@@ -287,18 +428,25 @@ def create_empty_executed_program() -> ExecutedProgram:
         AssemblyCode([], [], 0),
         MemoryLayout(0, 0, 0, 0),
         StaticMemory(
-            TextSegment(0, 'text', 0, 0, [], 0, []),
-            MemorySegment('rodata', 0, 0, [], 0, [])),
-        [])
+            TextSegment('text', 0, 0, b'', 0, [], 0),
+            MemorySegment('rodata', 0, 0, b'', 0, [])),
+        [],
+        [],
+        DynamicMemory(
+            MemorySegment('data', 0, 0, b'', 0, []),
+            MemorySegment('bss', 0, 0, b'', 0, [])),
+        None,
+        [],
+        ExecutionInfo(0, 0, 0, TRUNCATION_NONE, 0))
 
 def create_empty_execution_context() -> ExecutionContext:
     '''Creates an empty `ExecutionContext`.'''
 
     return ExecutionContext(
-        Instruction(0, '', 0, 0, []),
+        Instruction(0, '', 0, 0, b''),
         DynamicMemory(
-            MemorySegment('data', 0, 0, [], 0, []),
-            MemorySegment('bss', 0, 0, [], 0, [])),
-        [],
-        Stack([]),
+            MemorySegment('data', 0, 0, b'', 0, []),
+            MemorySegment('bss', 0, 0, b'', 0, [])),
+        Registers(array('Q', bytes(8 * len(REGISTER_NAMES)))),
+        Stack(b''),
         False)
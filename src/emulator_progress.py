@@ -0,0 +1,99 @@
+import time
+import threading
+from typing import BinaryIO
+
+
+PROGRESS_PREFIX = 'progress '
+'''The start of the lines `asemu --progress` reports its progress with on stderr.'''
+TIMING_PREFIX = 'timing '
+'''The start of the lines `asemu --progress` reports the time spent on an activity spread over several phases with.'''
+PHASE_DESCRIPTIONS = {
+    'starting':  'Starting the emulator',
+    'compiling': 'Compiling',
+    'loading':   'Reading the compiled program',
+    'emulating': 'Emulating',
+    'done':      'Done',
+}
+'''The descriptions of the phases an emulator run goes through, shown to the user.'''
+
+
+
+class EmulatorProgress():
+    '''Follows the progress an `asemu --progress` process reports on its stderr.
+
+       The stream is read in a background thread until it ends, which also keeps the emulator from
+       blocking on a full pipe. The lines that are not progress reports are kept as error messages.
+
+       The phases are timed with the clock of the emulator, which reports the milliseconds elapsed since it started,
+       so the times do not depend on how quickly the reports are read.'''
+
+    phase: str = 'starting'
+    '''The phase the emulator reported last, one of the keys of `PHASE_DESCRIPTIONS`.'''
+    insn_count: int = 0
+    '''The number of instructions the emulator reported to have emulated.'''
+
+
+    def __init__(self,
+                 stream: BinaryIO):
+
+        self.messages: list[str] = []
+        '''The lines of stderr that were not progress reports, e.g. the errors of the compiler.'''
+        self.phase_started: dict[str, float] = { self.phase: time.monotonic() }
+        '''The `time.monotonic` time each phase the emulator went through started at.'''
+        self.timings: dict[str, float] = {}
+        '''The milliseconds the emulator spent on activities spread over several phases, e.g. serializing the trace.'''
+
+        self._reader = threading.Thread(target=self._read, args=(stream,), daemon=True)
+        self._reader.start()
+
+
+    def describe(self) -> str:
+        '''Returns the current phase in a human readable form.'''
+
+        description = PHASE_DESCRIPTIONS.get(self.phase, self.phase)
+        if self.phase == 'emulating' and self.insn_count > 0:
+            description += f': { self.insn_count :,} instructions'
+
+        return description
+
+    def phase_durations(self, end: float = None) -> dict[str, float]:
+        '''Returns how many seconds each phase took, the last one lasting until `end` (now by default).'''
+
+        end = time.monotonic() if end is None else end
+        starts = sorted(self.phase_started.items(), key=lambda item: item[1])
+
+        return { phase: (starts[i + 1][1] if i + 1 < len(starts) else end) - start
+                 for i, (phase, start) in enumerate(starts) }
+
+    def join(self) -> None:
+        '''Waits until the stream has been read to its end.'''
+
+        self._reader.join()
+
+
+    def _read(self, stream: BinaryIO) -> None:
+        for line in iter(stream.readline, b''):
+            line = line.decode(errors='replace').rstrip('\n')
+
+            if line.startswith(TIMING_PREFIX):
+                activity, _, ms = line[len(TIMING_PREFIX):].partition(' ')
+                self.timings[activity] = float(ms)
+                continue
+
+            if not line.startswith(PROGRESS_PREFIX):
+                self.messages.append(line)
+                continue
+
+            phase, count, elapsed, *_ = line[len(PROGRESS_PREFIX):].split(' ') + ['', '']
+
+            # the emulator is started right before its progress gets followed, so the two clocks start together
+            try:
+                started = self.phase_started['starting'] + float(elapsed) / 1000
+            except ValueError:
+                started = time.monotonic()
+
+            self.phase_started.setdefault(phase, started)
+            self.phase = phase
+            self.insn_count = int(count) if count.isdigit() else 0
+
+        stream.close()
@@ -1,13 +1,8 @@
-from typing import TYPE_CHECKING
-import subprocess
-from emu_dataclasses import *
-from deserializer import *
+from trace_cache import TraceCache
+from program_tab import ProgramTab
+from load_metrics import set_memory_tracing, TRACE_MEMORY
 from utils import *
 from menubar import MainMenuBar
-from code_section import CodeWindow
-from registers_section import RegisterWindow
-from stack_section import StackWindow
-from symbols_section import SymbolsWindow
 import dearpygui.dearpygui as dpg
 
 
@@ -20,20 +15,20 @@ MIN_HEIGHT = 720
 class GUI:
     '''A class that represents the GUI of the emulator.'''
 
-    file_path: str = ""
-    '''The path of the opened assembly file.'''
-    insn_counter: int = 0
-    '''The number of instructions executed so far.'''
-    program: ExecutedProgram = None
-    '''The executed program.'''
-    mem_addr_tags = []
-    '''Tags of the widgets containing memory addresses.'''
     _main_color_theme: tuple[int, int, int] = (22, 160, 133)
     '''The main color theme of the GUI.'''
     _addr_color_theme: tuple[int, int, int] = (255, 87, 51)
     '''The color theme for memory addresses.'''
-    program_ended: bool = False
-    '''Indicates whether the program has ended.'''
+    _changed_color_theme: tuple[int, int, int, int] = (255, 215, 0, 255)
+    '''The color of the values that have changed with the last step.'''
+    live_mode: bool = False
+    '''Indicates whether programs are emulated on demand by a resident emulator process.'''
+    trace_cache: TraceCache = None
+    '''Keeps the compiled programs and the traces of the loaded files, so unchanged files are not emulated again.'''
+    show_load_metrics: bool = False
+    '''Whether the tabs show how long the phases of their last load took in a status bar.'''
+    active_tab: ProgramTab = None
+    '''The tab shown in the main window, which the menu items and the keyboard shortcuts act on.'''
 
 
     def __init__(self,
@@ -42,6 +37,16 @@ class GUI:
 
         self.program_dir = get_program_dir()
         '''The path of the directory containing the program's executable.'''
+        self.tabs: list[ProgramTab] = []
+        '''The open tabs, each with a program of its own.'''
+
+        try:
+            self.trace_cache = TraceCache(f'{ self.program_dir }/asemu')
+        except OSError as ex:
+            # the files are still loaded, just without reusing earlier results
+            print(ex)
+
+        set_memory_tracing(TRACE_MEMORY)
 
         dpg.create_context()
         dpg.create_viewport(title='Hohoemu', width=width, min_width=MIN_WIDTH, height=height, min_height=MIN_HEIGHT)
@@ -62,7 +67,7 @@ class GUI:
         with dpg.handler_registry():
             dpg.add_key_press_handler(dpg.mvKey_Down, callback=self.step, user_data=1)
             dpg.add_key_press_handler(dpg.mvKey_Up, callback=self.step, user_data=-1)
-            dpg.add_key_press_handler(dpg.mvKey_Right, callback=self.continue_until_breakpoint)
+            dpg.add_key_press_handler(dpg.mvKey_Right, callback=self.continue_until_breakpoint, user_data=1)
             dpg.add_key_press_handler(dpg.mvKey_Left, callback=self.reset)
 
 
@@ -72,12 +77,11 @@ class GUI:
             # set up the main menu bar
             self.main_menubar = MainMenuBar(self)
 
-            with dpg.group(horizontal=True):
+            # every tab holds the section windows of its own program
+            with dpg.tab_bar(reorderable=True, callback=self.select_tab) as self.tab_bar:
+                pass
 
-                self.code_section = CodeWindow(self)
-                self.register_section = RegisterWindow(self)
-                self.stack_section = StackWindow(self)
-                self.symbols_section = SymbolsWindow(self)
+        self.new_tab()
 
         self.bind_themes()
 
@@ -90,7 +94,13 @@ class GUI:
         dpg.set_frame_callback(1, self.viewport_resize_callback)
 
 
-        dpg.start_dearpygui()
+        # the frames are rendered one by one, so the progress of the files being loaded can be checked between them
+        while dpg.is_dearpygui_running():
+            self.poll_tabs()
+            dpg.render_dearpygui_frame()
+
+        for tab in self.tabs:
+            tab.close()
         dpg.destroy_context()
 
     def viewport_resize_callback(self, sender, app_data):
@@ -98,111 +108,94 @@ class GUI:
         dpg.set_item_height(self.main_window, height=dpg.get_viewport_height())
 
 
-    def get_assembly_file(self, sender, app_data):
-        '''Acts as the callback function of the file modal dialog.'''
+    def new_tab(self) -> ProgramTab:
+        '''Opens an empty tab and shows it.'''
 
-        # delete the file dialog's container window, which was used to center the file dialog
-        dpg.delete_item(self.main_menubar.modal_container_window)
+        tab = ProgramTab(self, parent=self.tab_bar)
+        self.tabs.append(tab)
 
-        self.file_path = app_data['file_path_name']
-        self.load_assembly_file()
+        self.active_tab = tab
+        dpg.set_value(self.tab_bar, tab.tab_item)
 
-    def load_assembly_file(self):
-        '''Loads and emulates the chosen assembly source file.'''
+        return tab
 
-        # we clicked on 'Reload file' while no file was loaded into our program
-        if self.file_path == "":
-            return
+    def close_tab(self):
+        '''Closes the shown tab, stopping its emulator. There is always at least one tab open.'''
 
-        return_code = subprocess.call(f'{ self.program_dir }/asemu { self.file_path }',
-            shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        tab = self.active_tab
+        self.tabs.remove(tab)
+        tab.close()
 
-        if return_code != 0:
-            self.code_section.show_error_message()
-            self.file_path = ""
-            return
+        if not self.tabs:
+            self.new_tab()
+        else:
+            self.active_tab = self.tabs[-1]
+            dpg.set_value(self.tab_bar, self.active_tab.tab_item)
 
-        try:
-            self.program = Deserializer().get_executed_program()
-        except Exception as ex:
-            print(ex)
+    def select_tab(self, sender, app_data):
+        '''Acts as the callback function of the tab bar, `app_data` being the tab that got selected.'''
 
-        self.program_ended = False
-        self.initialize_section_windows()
+        for tab in self.tabs:
+            if tab.tab_item == app_data:
+                self.active_tab = tab
 
-        dpg.configure_item(item=self.code_section.window, auto_resize_x=False, resizable_x=True)
+    def get_assembly_file(self, sender, app_data, user_data: bool):
+        '''Acts as the callback function of the file modal dialog.
+           The file is opened in a new tab if `user_data` is true, or in the shown one otherwise.'''
 
-    def initialize_section_windows(self):
-        '''Initializes all the section windows of the GUI.'''
+        # delete the file dialog's container window, which was used to center the file dialog
+        dpg.delete_item(self.main_menubar.modal_container_window)
 
-        # initialize the code, register, and stack sections
-        self.code_section.initialize_code_window()
-        self.register_section.update_register_values()
-        self.stack_section.update_stack_window()
+        tab = self.new_tab() if user_data else self.active_tab
+        tab.load(app_data['file_path_name'])
 
-        # initialize the symbols section
-        self.symbols_section.build_symbol_widgets(self.program.static_mem.rodata)
-        self.symbols_section.build_symbol_widgets(self.program.get_current_context().dynamic_mem.data)
-        self.symbols_section.build_symbol_widgets(self.program.get_current_context().dynamic_mem.bss)
+    def set_load_metrics_shown(self, shown: bool):
+        '''Shows or hides the status bar with the measurements of the last load in every tab.'''
 
-    def step(self, sender, app_data, user_data: int):
-        '''Steps through the program forward or backwad by one instruction at a time.'''
+        self.show_load_metrics = shown
 
-        self.code_section.indicate_program_end()
+        for tab in self.tabs:
+            dpg.configure_item(tab.status_text, show=shown)
 
-        ret = 0
-        if self.program is None or (ret := self.program.step(user_data)) > 0:
-            self.program_ended = ret == 2
-            self.code_section.indicate_program_end()
-            return
+    def reload_file(self):
+        '''Loads the file of the shown tab again.'''
 
-        self.program_ended = False
+        self.active_tab.load()
 
-        self.code_section.update_code_window()
-        self.register_section.update_register_values()
+    def cancel_loading(self):
+        '''Cancels loading the file of the shown tab.'''
 
-        # update the stack window if the stack pointer has changed
-        #if self.stack_section.rsp != self.program.get_current_context().regs.RSP:
-        self.stack_section.update_stack_window()
+        self.active_tab.cancel_loading()
 
-        self.symbols_section.update_symbols_window()
+    def poll_tabs(self):
+        '''Lets every tab swap in the program it has finished loading, and shows the progress of the shown one.
+           Called before rendering every frame.'''
 
-    def continue_until_breakpoint(self):
-        '''Continues the program execution until a breakpoint is reached.'''
+        for tab in self.tabs:
+            progress = tab.poll_loading()
 
-        breakpoints = self.code_section.breakpoints
-        if not breakpoints or self.program_ended:
-            return
+            if tab is not self.active_tab:
+                continue
 
-        highlighted_row_idx = self.code_section.highlighted_row_idx
-        addrasses = [bp[1] for bp in breakpoints]
-        tmp_addrasses = addrasses.copy() #important
-        highlighted_row_addr = self.program.code.addresses[highlighted_row_idx]
+            if progress is not None:
+                self.main_menubar.show_progress(progress)
+            else:
+                self.main_menubar.hide_progress()
 
-        if highlighted_row_addr in addrasses:
-            tmp_addrasses.remove(highlighted_row_addr) #important
+    def step(self, sender, app_data, user_data: int):
+        '''Steps through the program of the shown tab.'''
 
-        reached = False
-        while not reached and not self.program_ended:
-            if self.program.code.addresses[self.code_section.highlighted_row_idx] not in tmp_addrasses:
-                self.step(None, None, 1)
-                tmp_addrasses = [bp[1] for bp in breakpoints] #important
-            else:
-                reached = True
+        self.active_tab.step(sender, app_data, user_data)
 
-    def reset(self):
-        '''Resets the program to its initial state.'''
+    def continue_until_breakpoint(self, sender=None, app_data=None, user_data: int = 1):
+        '''Continues the program of the shown tab until a breakpoint is reached.'''
 
-        if self.program is None or self.program.index == 0:
-            return
+        self.active_tab.continue_until_breakpoint(sender, app_data, user_data)
 
-        self.program_ended = False
-        self.program.index = 0
+    def reset(self):
+        '''Resets the program of the shown tab to its initial state.'''
 
-        self.code_section.update_code_window()
-        self.register_section.update_register_values()
-        self.stack_section.update_stack_window()
-        self.symbols_section.update_symbols_window()
+        self.active_tab.reset()
 
 
     def create_themes(self):
@@ -267,6 +260,13 @@ class GUI:
             with dpg.theme_component(dpg.mvText):
                 dpg.add_theme_color(dpg.mvThemeCol_Text, (255, 255, 255, 255), category=dpg.mvThemeCat_Core)
 
+        # Create a theme for the values that have changed with the last step
+        with dpg.theme() as self.changed_value_theme:
+            with dpg.theme_component(dpg.mvText):
+                dpg.add_theme_color(dpg.mvThemeCol_Text, self._changed_color_theme, category=dpg.mvThemeCat_Core)
+            with dpg.theme_component(dpg.mvSelectable):
+                dpg.add_theme_color(dpg.mvThemeCol_Text, self._changed_color_theme, category=dpg.mvThemeCat_Core)
+
     def bind_themes(self):
         '''Binds the created themes to the GUI components.'''
 
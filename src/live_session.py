@@ -0,0 +1,194 @@
+import time
+import subprocess
+from dataclasses import dataclass
+from deserializer import *
+from emulator_progress import EmulatorProgress
+
+
+_position_record = struct.Struct('<IB')
+'''context index | has the program ended'''
+_memory_record_header = struct.Struct('<QI')
+'''address | size'''
+
+
+
+class LiveSession():
+    '''A resident `asemu --live` process that emulates the program on demand.
+
+       The GUI sends commands over the emulator's stdin and reads binary records from its stdout,
+       so loading a program takes the same time regardless of how many instructions it executes.
+
+       Creating a session only starts the emulator, `wait_until_ready` waits until the program has been loaded.'''
+
+    _process: subprocess.Popen
+    '''The running emulator process.'''
+    _deserializer: Deserializer
+    '''The deserializer that fills in the static parts of the program.'''
+
+
+    def __init__(self,
+                 emulator_path: str,
+                 file_path: str,
+                 binary_path: str = None):
+
+        self.work_dir = create_work_dir()
+        '''The private directory the emulator keeps its files in.'''
+
+        # a compiled program at `binary_path` is reused instead of compiling the source again
+        binary_args = ['--binary', binary_path] if binary_path is not None else []
+
+        self._process = subprocess.Popen([emulator_path, '--quiet', '--progress', '--live', '--workdir', self.work_dir,
+                                          *binary_args, file_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        self.progress = EmulatorProgress(self._process.stderr)
+        '''The phase the emulator is in while it loads the program.'''
+
+        self.program = LiveExecutedProgram(**vars(create_empty_executed_program()), session=self)
+        '''The program being emulated.'''
+        self._deserializer = Deserializer(program=self.program)
+
+        self.index = 0
+        '''The index of the context the emulator currently stands at.'''
+        self.has_program_ended = False
+        '''Indicates whether the emulator has reached the end of the program.'''
+        self.context: ExecutionContext = None
+        '''The execution context the emulator currently stands at.'''
+        self.deserialize_seconds: float = 0
+        '''The CPU time spent reading the program, excluding the time waited for the emulator.'''
+
+
+    def wait_until_ready(self) -> None:
+        '''Reads the static parts of the program and its first context, which the emulator sends once it has loaded the program.'''
+
+        try:
+            read_binary_header(self._process.stdout)
+        except Exception:
+            self.close()
+            raise
+
+        started = time.thread_time()
+
+        # the static records are followed by the response to the implicit `goto 0`
+        rec_type, payload = self._read_record()
+        while rec_type != REC_POSITION:
+            self._deserializer.deserialize_binary_record(rec_type, payload)
+            rec_type, payload = self._read_record()
+
+        self._read_response(payload)
+
+        self.deserialize_seconds = time.thread_time() - started
+
+
+    def goto(self, index: int) -> ExecutionContext:
+        '''Moves the emulator to the context at `index` and returns it.'''
+
+        if index != self.index:
+            self._send(f'goto { index }')
+            self._read_response()
+
+        return self.context
+
+    def run_until(self, addresses: list[int]) -> ExecutionContext:
+        '''Runs the emulator until an instruction at one of `addresses` is about to execute,
+           or until the program ends.'''
+
+        self._send('run ' + ' '.join(str(addr) for addr in addresses))
+        self._read_response()
+
+        return self.context
+
+    def read_memory(self, addr: int, size: int) -> bytes:
+        '''Reads `size` bytes of memory starting at `addr` in the current context.'''
+
+        self._send(f'mem { addr } { size }')
+
+        _, payload = self._read_record()
+        _, mem_size = _memory_record_header.unpack_from(payload, 0)
+
+        return bytes(payload[_memory_record_header.size:_memory_record_header.size + mem_size])
+
+    def kill(self) -> None:
+        '''Stops the emulator right away, e.g. to cancel loading. Can be called from any thread.'''
+
+        if self._process.poll() is None:
+            self._process.kill()
+
+    def close(self) -> None:
+        '''Ends the session and waits for the emulator to exit.'''
+
+        if self._process.poll() is None:
+            try:
+                self._send('quit')
+            except (BrokenPipeError, OSError):
+                pass
+
+        self._process.wait()
+        remove_work_dir(self.work_dir)
+
+
+    def _send(self, command: str) -> None:
+        self._process.stdin.write(f'{ command }\n'.encode())
+        self._process.stdin.flush()
+
+    def _read_record(self) -> tuple[int, memoryview]:
+        record = read_binary_record(self._process.stdout)
+
+        if record is None:
+            raise EOFError('the emulator closed the live session')
+
+        return record
+
+    def _read_response(self, position_payload: memoryview = None) -> None:
+        '''Reads a position record (unless it has already been read) and the context following it.'''
+
+        if position_payload is None:
+            _, position_payload = self._read_record()
+
+        self.index, ended = _position_record.unpack(position_payload)
+        self.has_program_ended = bool(ended)
+
+        _, payload = self._read_record()
+        self.context = self.program.materialize(self._deserializer.deserialize_binary_state(payload))
+        self.context.has_program_ended = self.has_program_ended
+
+
+
+@dataclass
+class LiveExecutedProgram(ExecutedProgram):
+    '''An `ExecutedProgram` whose contexts are requested from a `LiveSession` when they are needed.'''
+
+    session: LiveSession = None
+    '''The session emulating the program.'''
+
+
+    def step(self, direction: int) -> int:
+        if direction > 0 and self.session.has_program_ended and self.index >= self.session.index:
+            return 2
+
+        self.index += direction
+
+        if self.index < 0:
+            self.index = 0
+            return 1
+
+        self.session.goto(self.index)
+
+        # the end of the program is only discovered when the emulator gets there
+        if self.index > self.session.index:
+            self.index = self.session.index
+            return 2
+
+        return 0
+
+    def get_current_context(self) -> ExecutionContext:
+        # `reset` moves the index directly, so the session might have to catch up
+        return self.session.goto(self.index)
+
+    def run_until(self, addresses: list[int]) -> ExecutionContext:
+        '''Runs the program until one of `addresses` is reached and moves the index there.'''
+
+        context = self.session.run_until(addresses)
+        self.index = self.session.index
+
+        return context
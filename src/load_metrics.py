@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field, asdict
+
+
+METRICS_LOG_PATH = os.environ.get('HOHOEMU_METRICS_LOG',
+                                  os.path.join(os.environ.get('XDG_STATE_HOME', os.path.expanduser('~/.local/state')),
+                                               'hohoemu', 'loads.jsonl'))
+'''The file a JSON record is appended to for every load, can be set with the `HOHOEMU_METRICS_LOG` environment variable.'''
+TRACE_MEMORY = os.environ.get('HOHOEMU_TRACE_MEMORY', '0') == '1'
+'''Whether the memory allocated by the loads is traced from the start, can be set with the `HOHOEMU_TRACE_MEMORY` environment variable.'''
+
+
+
+def set_memory_tracing(enabled: bool) -> None:
+    '''Starts or stops tracing the memory allocations with `tracemalloc`, which slows loading down considerably.'''
+
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+
+@dataclass
+class LoadMetrics:
+    '''How long the phases of loading a file took and how much memory it needed.
+
+       The emulator's phases are timed by the emulator itself, the deserialization is the CPU time of the threads
+       reading the trace, so neither includes the time spent waiting for the other. The memory is only sampled
+       while `tracemalloc` is tracing, and its peak covers every tab loading at the same time.'''
+
+    file: str
+    '''The path of the loaded file.'''
+    live_mode: bool
+    '''Whether the program is emulated on demand by a resident emulator.'''
+    timestamp: str = field(default_factory=lambda: time.strftime('%Y-%m-%dT%H:%M:%S'))
+    '''When loading started.'''
+    cache_hit: bool = False
+    '''Whether the trace was loaded from the cache without running the emulator.'''
+    emulator_phases_ms: dict[str, float] = field(default_factory=dict)
+    '''The milliseconds each phase of the emulator took, e.g. compiling and emulating.'''
+    emulator_timings_ms: dict[str, float] = field(default_factory=dict)
+    '''The milliseconds the emulator spent on activities spread over several phases, e.g. serializing the trace.'''
+    insn_count: int = 0
+    '''The number of emulated instructions, 0 in live mode, where the program is only emulated on demand.'''
+    deserialize_ms: float = 0
+    '''The milliseconds spent deserializing the trace.'''
+    build_windows_ms: float = 0
+    '''The milliseconds spent filling in the section windows.'''
+    total_ms: float = 0
+    '''The milliseconds between starting the load and reading the last context.'''
+    memory_current_bytes: int | None = None
+    '''The memory allocated by Python once loading finished, if it was traced.'''
+    memory_peak_bytes: int | None = None
+    '''The most memory allocated by Python while loading, if it was traced.'''
+
+
+    def __post_init__(self):
+        self._started = time.perf_counter()
+
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def finish(self, source, program) -> None:
+        '''Collects the measurements of the emulator session `source`, which has loaded `program`.'''
+
+        self.total_ms = (time.perf_counter() - self._started) * 1000
+        self.deserialize_ms = source.deserialize_seconds * 1000
+        self.insn_count = program.ex_info.insn_count
+
+        progress = source.progress
+        self.cache_hit = progress is None
+        if progress is not None:
+            self.emulator_phases_ms = { phase: duration * 1000 for phase, duration in progress.phase_durations().items() }
+            self.emulator_timings_ms = dict(progress.timings)
+
+        if tracemalloc.is_tracing():
+            self.memory_current_bytes, self.memory_peak_bytes = tracemalloc.get_traced_memory()
+
+    def describe(self) -> str:
+        '''Returns the measurements in a single line, shown in the status bar.'''
+
+        if self.cache_hit:
+            parts = ['Loaded from the cache']
+        else:
+            parts = [f'{ phase.capitalize() } { ms :.0f} ms' for phase, ms in self.emulator_phases_ms.items()
+                     if phase not in ('starting', 'done')]
+            parts += [f'({ activity } { ms :.0f} ms)' for activity, ms in self.emulator_timings_ms.items()]
+
+        parts += [f'Deserializing { self.deserialize_ms :.0f} ms',
+                  f'Building windows { self.build_windows_ms :.0f} ms',
+                  f'Total { self.total_ms :.0f} ms',
+                  f'{ self.insn_count :,} instructions']
+
+        if self.memory_peak_bytes is not None:
+            parts.append(f'Peak memory { self.memory_peak_bytes / (1 << 20) :.1f} MiB')
+
+        return ' | '.join(parts)
+
+    def write(self, path: str = METRICS_LOG_PATH) -> None:
+        '''Appends the measurements to the log at `path` as a single line of JSON.'''
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a') as file:
+                file.write(json.dumps(asdict(self)) + '\n')
+        except OSError as ex:
+            # the measurements are only for tracking regressions, loading goes on without them
+            print(ex)
@@ -1,5 +1,6 @@
 from typing import TYPE_CHECKING
 from utils import *
+from load_metrics import set_memory_tracing, TRACE_MEMORY, METRICS_LOG_PATH
 import dearpygui.dearpygui as dpg
 
 if TYPE_CHECKING:
@@ -35,22 +36,76 @@ class MainMenuBar():
 
             with dpg.menu(label='File'):
 
-                dpg.add_menu_item(label='Load assembly file', callback=self.show_file_dialog)
-                dpg.add_menu_item(label='Reload file', callback=self.gui.load_assembly_file)
+                dpg.add_menu_item(label='Load assembly file', callback=self.show_file_dialog, user_data=False)
+                dpg.add_menu_item(label='Open in new tab', callback=self.show_file_dialog, user_data=True)
+                dpg.add_menu_item(label='Reload file', callback=self.gui.reload_file)
+                dpg.add_menu_item(label='Close tab', callback=self.gui.close_tab)
+                dpg.add_menu_item(label='Live emulation', check=True, default_value=self.gui.live_mode,
+                                  callback=self.toggle_live_mode)
+                dpg.add_menu_item(label='Clear cache', callback=self.clear_cache)
+
+            with dpg.menu(label='Performance'):
+                dpg.add_menu_item(label='Show load timings', check=True, default_value=self.gui.show_load_metrics,
+                                  callback=self.toggle_load_metrics)
+                dpg.add_menu_item(label='Trace memory', check=True, default_value=TRACE_MEMORY,
+                                  callback=self.toggle_memory_tracing)
+                dpg.add_text(f'Every load is logged to { METRICS_LOG_PATH }', wrap=400)
 
             with dpg.menu(label='About'):
                 dpg.add_menu_item(label='Help', callback=self.show_help_dialog)
 
+            # shows what the emulator is doing while a file is being loaded
+            with dpg.group(horizontal=True, show=False) as self.progress_group:
+                dpg.add_spacer(width=30)
+                self.progress_text = dpg.add_text('')
+                dpg.add_menu_item(label='Cancel', callback=self.gui.cancel_loading)
 
-    def show_file_dialog(self):
-        '''Shows a file dialog for loading an assembly file.'''
+
+    def show_progress(self, text: str):
+        '''Shows the progress of loading the file of the shown tab in the menu bar.'''
+
+        if dpg.get_value(self.progress_text) != text:
+            dpg.set_value(self.progress_text, text)
+
+        if not dpg.is_item_shown(self.progress_group):
+            dpg.show_item(self.progress_group)
+
+    def hide_progress(self):
+        if dpg.is_item_shown(self.progress_group):
+            dpg.hide_item(self.progress_group)
+
+    def toggle_live_mode(self, sender, app_data):
+        '''Switches between emulating the whole program up front and emulating it on demand.
+           Takes effect the next time a file gets loaded.'''
+
+        self.gui.live_mode = app_data
+
+    def toggle_load_metrics(self, sender, app_data):
+        '''Shows or hides the timings of the last load in the status bar of the tabs.'''
+
+        self.gui.set_load_metrics_shown(app_data)
+
+    def toggle_memory_tracing(self, sender, app_data):
+        '''Starts or stops measuring the memory the loads allocate, which slows loading down.
+           Takes effect the next time a file gets loaded.'''
+
+        set_memory_tracing(app_data)
+
+    def clear_cache(self):
+        '''Removes the compiled programs and the traces kept from earlier loads.'''
+
+        if self.gui.trace_cache is not None:
+            self.gui.trace_cache.clear()
+
+    def show_file_dialog(self, sender, app_data, user_data: bool):
+        '''Shows a file dialog for loading an assembly file, into a new tab if `user_data` is true.'''
 
         center_pos = calculate_dialog_position(self._file_dialog_modal_width, self._file_dialog_modal_height)
         with dpg.child_window(show=False, parent=self.gui.main_window, pos=center_pos) as self.modal_container_window:
 
             with dpg.file_dialog(modal=True, directory_selector=False,
                                  min_size=[self._file_dialog_modal_width, self._file_dialog_modal_height],
-                                 callback=self.gui.get_assembly_file):
+                                 callback=self.gui.get_assembly_file, user_data=user_data):
 
                 dpg.add_file_extension(".s", color=self._assembly_file_color, custom_text="[Assembly]")
                 dpg.add_file_extension("", color=self._normal_file_color)
@@ -0,0 +1,84 @@
+import threading
+from live_session import LiveSession
+from trace_stream import TraceStream
+from trace_cache import TraceCache
+
+
+
+class ProgramLoader():
+    '''Loads an assembly file in a background thread, so the GUI keeps repainting while it is compiled and emulated.
+
+       The GUI polls `is_done` every frame and swaps the loaded program in on its own thread once it is,
+       until then the previously loaded program stays untouched. Loading can be cancelled at any time,
+       which kills the emulator.'''
+
+    source: LiveSession | TraceStream = None
+    '''The emulator session the program is loaded by, once it has been started.'''
+    error: Exception = None
+    '''The error that made loading fail, if any.'''
+    cancelled: bool = False
+    '''Whether loading has been cancelled.'''
+
+
+    def __init__(self,
+                 emulator_path: str,
+                 file_path: str,
+                 live_mode: bool,
+                 cache: TraceCache = None):
+
+        self.file_path = file_path
+        '''The path of the assembly file being loaded.'''
+        self.live_mode = live_mode
+        '''Whether the program is emulated on demand by a resident emulator.'''
+
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._load, args=(emulator_path, cache), daemon=True)
+        self._thread.start()
+
+
+    def is_done(self) -> bool:
+        '''Whether loading has finished, failed or been cancelled.'''
+
+        return not self._thread.is_alive()
+
+    def describe_progress(self) -> str:
+        '''Returns what the loader is doing in a human readable form.'''
+
+        source = self.source
+        if source is None or source.progress is None:
+            return 'Starting the emulator'
+
+        return source.progress.describe()
+
+    def cancel(self) -> None:
+        '''Cancels loading by killing the emulator, then waits for the background thread to finish.'''
+
+        with self._lock:
+            self.cancelled = True
+            if self.source is not None:
+                self.source.kill()
+
+        self._thread.join()
+
+        if self.source is not None:
+            self.source.close()
+
+
+    def _load(self, emulator_path: str, cache: TraceCache) -> None:
+        try:
+            if self.live_mode:
+                binary_path = cache.binary_path(self.file_path) if cache is not None else None
+                source = LiveSession(emulator_path, self.file_path, binary_path)
+            else:
+                source = TraceStream(emulator_path, self.file_path, cache)
+
+            # a cancel arriving while the emulator was being started has to kill it too
+            with self._lock:
+                self.source = source
+                if self.cancelled:
+                    source.kill()
+                    return
+
+            source.wait_until_ready()
+        except Exception as ex:
+            self.error = ex
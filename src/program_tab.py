@@ -0,0 +1,311 @@
+import os
+import time
+from typing import TYPE_CHECKING
+from emu_dataclasses import *
+from live_session import LiveSession
+from trace_stream import TraceStream
+from program_loader import ProgramLoader
+from breakpoints import BreakpointEngine
+from load_metrics import LoadMetrics
+from code_section import CodeWindow
+from registers_section import RegisterWindow
+from timeline_section import TimelineWindow
+from stack_section import StackWindow
+from symbols_section import SymbolsWindow
+import dearpygui.dearpygui as dpg
+
+if TYPE_CHECKING:
+    from gui import GUI
+
+
+EMPTY_TAB_LABEL = 'No file'
+'''The label of a tab that has no program loaded yet.'''
+
+
+
+class ProgramTab():
+    '''A tab of the main window with a program of its own.
+
+       Every tab has its own section windows, loader and emulator, so several files can be loaded,
+       emulated and stepped through side by side without affecting each other.'''
+
+    file_path: str = ""
+    '''The path of the assembly file opened in the tab.'''
+    program: ExecutedProgram = None
+    '''The executed program.'''
+    program_ended: bool = False
+    '''Indicates whether the program has ended.'''
+    live_session: LiveSession = None
+    '''The session of the resident emulator process when the program was loaded in live mode.'''
+    trace_stream: TraceStream = None
+    '''The emulator process streaming the trace of the loaded file when not in live mode.'''
+    breakpoint_engine: BreakpointEngine = None
+    '''Finds the contexts of the loaded program's trace that hit a breakpoint or a watchpoint.'''
+    loader: ProgramLoader = None
+    '''Loads the chosen file in the background, `None` when no file is being loaded.'''
+    load_metrics: LoadMetrics = None
+    '''The measurements of the load in progress, until the whole trace of the loaded file has been read.'''
+
+
+    def __init__(self,
+                 gui: 'GUI',
+                 parent: int):
+
+        self.gui = gui
+        '''A reference to the main GUI object, which holds the themes and the settings shared by the tabs.'''
+
+
+        with dpg.tab(label=EMPTY_TAB_LABEL, parent=parent) as self.tab_item:
+
+            self.status_text = dpg.add_text('', show=self.gui.show_load_metrics)
+            '''The status bar showing how long the phases of the last load took.'''
+
+            with dpg.group(horizontal=True):
+
+                self.code_section = CodeWindow(self)
+                self.register_section = RegisterWindow(self)
+                self.timeline_section = TimelineWindow(self)
+                self.stack_section = StackWindow(self)
+                self.symbols_section = SymbolsWindow(self)
+
+
+    def load(self, file_path: str = None):
+        '''Starts loading and emulating an assembly source file in the background, the one loaded last by default.
+           The program is swapped in by `poll_loading` once it has been loaded.'''
+
+        if file_path is not None:
+            self.file_path = file_path
+
+        # we clicked on 'Reload file' while no file was loaded into the tab
+        if self.file_path == "":
+            return
+
+        # a file that is still being loaded gets replaced by the new one
+        if self.loader is not None:
+            self.loader.cancel()
+
+        self.load_metrics = LoadMetrics(self.file_path, self.gui.live_mode)
+        self.loader = ProgramLoader(f'{ self.gui.program_dir }/asemu', self.file_path, self.gui.live_mode, self.gui.trace_cache)
+
+    def poll_loading(self) -> str | None:
+        '''Swaps the program of the file being loaded in once it is ready. Called before rendering every frame.
+
+           Returns: the progress of loading the file, or `None` if nothing is being loaded.'''
+
+        if self.loader is not None:
+            if not self.loader.is_done():
+                return self.loader.describe_progress()
+
+            self.finish_loading()
+
+        if self.load_metrics is not None and self.loader is None and self.program is not None and not self.is_loading():
+            self.record_load_metrics()
+
+        # the first instructions can be shown while the rest of the program is still being emulated
+        if self.is_loading() and self.trace_stream.progress is not None:
+            return f'{ self.trace_stream.progress.describe() }, { len(self.program.contexts) :,} steps received'
+
+        return None
+
+    def finish_loading(self):
+        '''Replaces the previously loaded program with the one the loader has just loaded.'''
+
+        loader, self.loader = self.loader, None
+
+        if loader.cancelled:
+            self.load_metrics = None
+            return
+
+        if loader.error is not None:
+            print(loader.error)
+            self.load_metrics = None
+
+            # e.g. the errors of the compiler, which are only complete once the emulator has exited
+            messages = []
+            if loader.source is not None:
+                loader.source.close()
+
+                if loader.source.progress is not None:
+                    loader.source.progress.join()
+                    messages = loader.source.progress.messages
+
+            self.code_section.show_error_message('\n'.join(messages))
+            self.file_path = ""
+            return
+
+        self.close_emulator()
+
+        if loader.live_mode:
+            self.live_session = loader.source
+        else:
+            self.trace_stream = loader.source
+            self.breakpoint_engine = BreakpointEngine(loader.source.program)
+
+        self.program = loader.source.program
+        self.program_ended = False
+
+        started = time.perf_counter()
+        self.initialize_section_windows()
+        self.load_metrics.build_windows_ms = (time.perf_counter() - started) * 1000
+
+        dpg.configure_item(item=self.tab_item, label=os.path.basename(loader.file_path))
+        dpg.configure_item(item=self.code_section.window, auto_resize_x=False, resizable_x=True)
+
+    def record_load_metrics(self):
+        '''Shows the measurements of the finished load in the status bar and appends them to the log.'''
+
+        metrics, self.load_metrics = self.load_metrics, None
+
+        metrics.finish(self.live_session or self.trace_stream, self.program)
+        metrics.write()
+
+        dpg.set_value(self.status_text, metrics.describe())
+
+    def cancel_loading(self):
+        '''Cancels loading the file being loaded, or stops emulating the rest of the loaded program's trace.'''
+
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+            self.load_metrics = None
+        elif self.trace_stream is not None:
+            # the steps received so far stay available
+            self.trace_stream.kill()
+
+    def close_emulator(self):
+        '''Stops the emulator process of the previously loaded file, if there is one.'''
+
+        self.breakpoint_engine = None
+
+        if self.live_session is not None:
+            self.live_session.close()
+            self.live_session = None
+
+        if self.trace_stream is not None:
+            self.trace_stream.close()
+            self.trace_stream = None
+
+    def close(self):
+        '''Stops loading and emulating the tab's program, then deletes the tab.'''
+
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+
+        self.close_emulator()
+
+        self.timeline_section.remove_mouse_handlers()
+        dpg.delete_item(self.tab_item)
+
+    def is_loading(self) -> bool:
+        '''Whether the trace of the loaded file is still being streamed in.'''
+
+        return self.trace_stream is not None and self.trace_stream.is_loading()
+
+    def initialize_section_windows(self):
+        '''Initializes all the section windows of the tab.'''
+
+        # the values shown for the previously loaded program are not changes to highlight
+        for section in (self.register_section, self.stack_section, self.symbols_section):
+            section.display.clear()
+
+        # initialize the code, register, and stack sections
+        self.code_section.initialize_code_window()
+        self.register_section.update_register_values()
+        self.stack_section.update_stack_window()
+        self.timeline_section.initialize_timeline()
+        self.timeline_section.update_timeline_position()
+
+        # initialize the symbols section
+        self.symbols_section.build_symbol_widgets(self.program.static_mem.rodata)
+        self.symbols_section.build_symbol_widgets(self.program.get_current_context().dynamic_mem.data)
+        self.symbols_section.build_symbol_widgets(self.program.get_current_context().dynamic_mem.bss)
+
+    def step(self, sender, app_data, user_data: int):
+        '''Steps through the program forward or backwad by one instruction at a time.'''
+
+        self.code_section.indicate_program_end()
+
+        ret = 0
+        if self.program is None or (ret := self.program.step(user_data)) > 0:
+            # the last context received so far is only the end while nothing more is coming
+            self.program_ended = ret == 2 and not self.is_loading()
+            self.code_section.indicate_program_end()
+            return
+
+        self.program_ended = False
+        self.update_section_windows()
+
+    def update_section_windows(self):
+        '''Updates all the section windows to show the current execution context.'''
+
+        self.code_section.update_code_window()
+
+        # only the widgets whose value has changed get updated
+        self.register_section.update_register_values()
+        self.stack_section.update_stack_window()
+
+        self.symbols_section.update_symbols_window()
+        self.timeline_section.update_timeline_position()
+
+    def continue_until_breakpoint(self, sender=None, app_data=None, user_data: int = 1):
+        '''Continues the program execution forward (`user_data` > 0) or backward until a breakpoint is reached.'''
+
+        breakpoints = self.code_section.breakpoints
+        watchpoints = self.code_section.watchpoints
+        if not (breakpoints or watchpoints) or self.program is None or (user_data > 0 and self.program_ended):
+            return
+
+        # the resident emulator finds the next breakpoint by itself, but it cannot run backward
+        # and there is no recorded trace to evaluate conditions over
+        if self.live_session is not None:
+            if user_data < 0 or not breakpoints:
+                return
+
+            context = self.program.run_until(sorted(breakpoints))
+            self.program_ended = context.has_program_ended
+            self.update_section_windows()
+            return
+
+        # the current context is skipped, even if it stands at a breakpoint itself
+        try:
+            if user_data > 0:
+                hit = self.breakpoint_engine.next_hit(breakpoints, watchpoints, self.program.index)
+            else:
+                hit = self.breakpoint_engine.previous_hit(breakpoints, watchpoints, self.program.index)
+        except ValueError as ex:
+            self.code_section.show_condition_error(str(ex))
+            return
+
+        if hit is None and user_data > 0:
+            # no breakpoint is hit anymore, so run to the end of the trace received so far
+            self.program.index = len(self.program.contexts) - 1
+            self.step(None, None, 1)
+            self.update_section_windows()
+            return
+
+        self.program.index = hit if hit is not None else 0
+        self.program_ended = False
+        self.update_section_windows()
+
+    def seek(self, index: int):
+        '''Moves the program directly to the context at `index`.'''
+
+        if self.program is None or index == self.program.index:
+            return
+
+        self.program_ended = False
+        self.program.index = index
+
+        self.update_section_windows()
+
+    def reset(self):
+        '''Resets the program to its initial state.'''
+
+        if self.program is None or self.program.index == 0:
+            return
+
+        self.program_ended = False
+        self.program.index = 0
+
+        self.update_section_windows()
@@ -1,9 +1,10 @@
 from typing import TYPE_CHECKING
 from utils import *
+from display_cache import DisplayCache
 import dearpygui.dearpygui as dpg
 
 if TYPE_CHECKING:
-    from gui import GUI
+    from program_tab import ProgramTab
 
 
 
@@ -12,10 +13,16 @@ class RegisterWindow():
 
 
     def __init__(self,
-                 gui: 'GUI'):
+                 tab: 'ProgramTab'):
 
-        self.gui = gui
-        '''A reference to the main GUI object.'''
+        self.tab = tab
+        '''The tab whose program the window shows.'''
+        self.value_tags: dict[str, tuple[int, int]] = {}
+        '''The tags of the widgets showing the hexadecimal and the decimal value of each register and subregister.'''
+        self.subreg_row_tags: dict[str, int] = {}
+        '''The tags of the table rows of the subregisters, which are hidden until their register is opened.'''
+        self.display = DisplayCache(self.tab.gui.changed_value_theme)
+        '''The values shown by the register widgets, which get highlighted when they change.'''
 
 
         with dpg.child_window(auto_resize_x=True) as self.window:
@@ -28,7 +35,7 @@ class RegisterWindow():
 
             dpg.add_separator()
 
-            with dpg.table(tag='#regs', header_row=False, row_background=False,
+            with dpg.table(header_row=False, row_background=False,
                             policy=dpg.mvTable_SizingFixedFit, scrollX=True):
 
                 dpg.add_table_column()
@@ -39,17 +46,17 @@ class RegisterWindow():
                     with dpg.table_row():
 
                         dpg.add_selectable(label=reg, indent=5, span_columns=True, callback=self.show_register_parts, user_data=reg)
-                        dpg.add_selectable(label='0x00', tag=f'#{ reg }_val_hex', indent=50)
-                        dpg.add_selectable(label='0', tag=f'#{ reg }_val_dec', indent=70)
+                        self.value_tags[reg] = (dpg.add_selectable(label='0x00', indent=50),
+                                                dpg.add_selectable(label='0', indent=70))
 
                     for j, subreg in enumerate(reg_subparts[reg]):
-                        with dpg.table_row(tag=f'#{ subreg }_hidden', show=False):
+                        with dpg.table_row(show=False) as self.subreg_row_tags[subreg]:
 
                             reg_part = reg_subparts[reg][j]
 
                             dpg.add_text(reg_part, indent=15)
-                            dpg.add_text('0x00', tag=f'#{ reg_part }_val_hex', indent=50)
-                            dpg.add_text('0', tag=f'#{ reg_part }_val_dec', indent=70)
+                            self.value_tags[reg_part] = (dpg.add_text('0x00', indent=50),
+                                                         dpg.add_text('0', indent=70))
 
                     with dpg.table_row(height=5):
                         pass
@@ -64,7 +71,7 @@ class RegisterWindow():
         '''Shows the subparts of a register.'''
 
         for reg_part in reg_subparts[user_data]:
-            table_row = f'#{ reg_part }_hidden'
+            table_row = self.subreg_row_tags[reg_part]
 
             if not dpg.is_item_shown(table_row):
                 dpg.show_item(table_row)
@@ -76,31 +83,41 @@ class RegisterWindow():
 
         for reg in main_regs:
             for reg_part in reg_subparts[reg]:
-                dpg.show_item(f'#{ reg_part }_hidden')
+                dpg.show_item(self.subreg_row_tags[reg_part])
 
     def hide_all_subregs(self):
         '''Hides all the subregisters.'''
 
         for reg in main_regs[:-1]:
             for reg_part in reg_subparts[reg]:
-                dpg.hide_item(f'#{ reg_part }_hidden')
+                dpg.hide_item(self.subreg_row_tags[reg_part])
 
     def update_register_values(self):
-        '''Updates the values of the registers.'''
+        '''Updates the values of the registers that have changed since they were last shown.'''
 
-        for reg in main_regs:
-            val = self.gui.program.get_current_context().regs.rdict[reg]
+        regs = self.tab.program.get_current_context().regs
+        display = self.display
+
+        with display.refresh():
+            for reg in main_regs:
+                val = regs[reg]
+
+                value_tags = self.value_tags[reg]
 
-            dpg.set_item_label(f'#{ reg }_val_hex', f'{val:#x}')
-            dpg.set_item_label(f'#{ reg }_val_dec', val)
+                # the sub-registers cannot change while their register stays the same
+                if not display.changed(value_tags, val):
+                    continue
 
-            for j in range(len(reg_subparts[reg])):
-                reg_part = reg_subparts[reg][j]
+                hex_tag, dec_tag = value_tags
+                dpg.set_item_label(hex_tag, f'{val:#x}')
+                dpg.set_item_label(dec_tag, val)
 
-                if reg_part in flags:
-                    val = self.gui.program.get_flag(reg_part)
-                else:
-                    val = self.gui.program.get_current_context().regs.rdict[reg_part]
+                for reg_part in reg_subparts[reg]:
+                    # flags are derived from RFLAGS the same way as the sub-registers
+                    val = regs[reg_part]
 
-                dpg.set_value(f'#{ reg_part }_val_hex', f'{val:#x}')
-                dpg.set_value(f'#{ reg_part }_val_dec', f'{val}  ')
+                    value_tags = self.value_tags[reg_part]
+                    if display.changed(value_tags, val):
+                        hex_tag, dec_tag = value_tags
+                        dpg.set_value(hex_tag, f'{val:#x}')
+                        dpg.set_value(dec_tag, f'{val}  ')
@@ -1,9 +1,10 @@
 from typing import TYPE_CHECKING
 from utils import *
+from display_cache import DisplayCache
 import dearpygui.dearpygui as dpg
 
 if TYPE_CHECKING:
-    from gui import GUI
+    from program_tab import ProgramTab
 
 
 
@@ -15,16 +16,20 @@ class StackWindow():
 
 
     def __init__(self,
-                 gui: 'GUI'):
+                 tab: 'ProgramTab'):
 
-        self.gui = gui
-        '''A reference to the main GUI object.'''
+        self.tab = tab
+        '''The tab whose program the window shows.'''
         self.rsp: int = 0
         '''The value of the RSP register.'''
         self.rsp_row_highlight_color: tuple[int, int, int, int] = (160, 22, 49, 200)
         '''The color of the highlighted row in the stack table.'''
-        self.rsp_row_idx = self._num_stack_rows - 8
-        '''The index of the highlighted row in the stack table.'''
+        self.rsp_row_idx: int | None = None
+        '''The index of the highlighted row in the stack table, `None` until a row gets highlighted.'''
+        self.row_tags: list[tuple[int, int, int]] = []
+        '''The tags of the texts showing the address, the hexadecimal and the decimal value of each row.'''
+        self.display = DisplayCache(self.tab.gui.changed_value_theme)
+        '''The addresses and the values shown by the rows, which get highlighted when they change.'''
 
 
         with dpg.child_window(auto_resize_x=True):
@@ -42,33 +47,50 @@ class StackWindow():
 
                             with dpg.group(horizontal=True, indent=5):
 
-                                addr = dpg.add_text('0x000000:', tag=f'#stack_row_addr{i:03}')
-                                dpg.bind_item_theme(addr, self.gui.addr_text_theme)
+                                addr = dpg.add_text('0x000000:')
+                                dpg.bind_item_theme(addr, self.tab.gui.addr_text_theme)
 
                                 dpg.add_spacer(width=30)
-                                dpg.add_text('0xff', tag=f'#stack_row_val_hex{i:03}')
+                                val_hex = dpg.add_text('0xff')
 
                                 dpg.add_spacer(width=15)
-                                dpg.add_text('255  ', tag=f'#stack_row_val_dec{i:03}')
+                                val_dec = dpg.add_text('255  ')
+
+                                self.row_tags.append((addr, val_hex, val_dec))
 
                     dpg.set_y_scroll(self.stack_table, 999999)
 
     def update_stack_window(self):
-        ctx = self.gui.program.get_current_context()
+        '''Updates the rows whose value has changed since they were last shown, and moves the highlight to the row RSP points to.'''
+
+        ctx = self.tab.program.get_current_context()
+        stack_start_addr = self.tab.program.mem_layout.stack_start_addr
+        display = self.display
+
+        with display.refresh():
+            for i, ((addr, val_hex, val_dec), byte) in enumerate(zip(self.row_tags, ctx.stack.content)):
+                # the addresses only change with the loaded program
+                if display.changed((addr,), stack_start_addr - 128 + i, highlight=False):
+                    dpg.set_value(addr, f'{stack_start_addr - 128 + i:#06x}:')
+
+                if display.changed((val_hex, val_dec), byte):
+                    dpg.set_value(val_hex, f'{byte:#04x}')
+                    dpg.set_value(val_dec, f'{byte:3}  ')
+
+        self.rsp = ctx.regs.RSP
+        rsp_row_idx = self._num_stack_rows - abs(self.rsp - stack_start_addr)
 
-        for i, row_idx in enumerate(range(self._num_stack_rows)):
-            dpg.set_value(f'#stack_row_addr{row_idx:03}', f'{self.gui.program.mem_layout.stack_start_addr - 128 + i:#06x}:')
-            dpg.set_value(f'#stack_row_val_hex{row_idx:03}', f'{ctx.stack.content[i]:#04x}')
-            dpg.set_value(f'#stack_row_val_dec{row_idx:03}', f'{ctx.stack.content[i]:3}  ')
+        if rsp_row_idx == self.rsp_row_idx:
+            return
 
+        if self.rsp_row_idx is not None:
             # reset the previously highlighted row and bind the default theme to its address
             dpg.unhighlight_table_row(self.stack_table, self.rsp_row_idx)
-            dpg.bind_item_theme(f'#stack_row_addr{self.rsp_row_idx:03}', theme=self.gui.addr_text_theme)
+            dpg.bind_item_theme(self.row_tags[self.rsp_row_idx][0], theme=self.tab.gui.addr_text_theme)
 
-            self.rsp = ctx.regs.RSP
-            self.rsp_row_idx = self._num_stack_rows - abs(self.rsp - self.gui.program.mem_layout.stack_start_addr)
+        self.rsp_row_idx = rsp_row_idx
 
-            # highlight the new row and bind the white theme to its address
-            dpg.highlight_table_row(self.stack_table, self.rsp_row_idx, self.rsp_row_highlight_color)
-            dpg.bind_item_theme(f'#stack_row_addr{self.rsp_row_idx:03}', theme=self.gui.white_text)
-            dpg.focus_item(f'#stack_row_addr{self.rsp_row_idx:03}')
+        # highlight the new row and bind the white theme to its address
+        dpg.highlight_table_row(self.stack_table, self.rsp_row_idx, self.rsp_row_highlight_color)
+        dpg.bind_item_theme(self.row_tags[self.rsp_row_idx][0], theme=self.tab.gui.white_text)
+        dpg.focus_item(self.row_tags[self.rsp_row_idx][0])
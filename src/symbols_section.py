@@ -1,29 +1,38 @@
 from typing import TYPE_CHECKING
 from emu_dataclasses import MemorySegment, Symbol
 from utils import *
+from display_cache import DisplayCache
 import dearpygui.dearpygui as dpg
 
 if TYPE_CHECKING:
-    from gui import GUI
+    from program_tab import ProgramTab
 
 
 
 class SymbolsWindow():
     '''The window that displays the registers.'''
 
-    _symbol_selectable_tags: dict[str, list[int]] = { 'rodata': [], 'data': [], 'bss': [] }
-    '''The tags of the selectable widgets for each segment.'''
-    _sym_byte_group_tags: dict[str, dict[str, list[int]]] = { 'rodata': {}, 'data': {}, 'bss': {} }
-    '''The tags of the group widgets containing the bytes for each symbol.'''
     width: int = 385
     '''Width of the symbols window.'''
 
 
     def __init__(self,
-                 gui: 'GUI'):
-
-        self.gui = gui
-        '''A reference to the main GUI object.'''
+                 tab: 'ProgramTab'):
+
+        self.tab = tab
+        '''The tab whose program the window shows.'''
+        self.segment_header_tags: dict[str, int] = {}
+        '''The tags of the collapsing headers the symbols of each segment are listed under.'''
+        self._symbol_selectable_tags: dict[str, list[int]] = { 'rodata': [], 'data': [], 'bss': [] }
+        '''The tags of the selectable widgets for each segment.'''
+        self._sym_byte_group_tags: dict[str, dict[str, list[int]]] = { 'rodata': {}, 'data': {}, 'bss': {} }
+        '''The tags of the group widgets containing the bytes for each symbol.'''
+        self._sym_byte_value_tags: dict[str, dict[str, list[tuple[int, int]]]] = { 'rodata': {}, 'data': {}, 'bss': {} }
+        '''The tags of the texts showing the hexadecimal and the decimal value of each byte of each symbol.'''
+        self._sym_shown_bytes: dict[str, dict[str, bytes]] = { 'rodata': {}, 'data': {}, 'bss': {} }
+        '''The content of each symbol as it was last shown, so unchanged symbols are skipped without comparing their bytes one by one.'''
+        self.display = DisplayCache(self.tab.gui.changed_value_theme)
+        '''The values shown by the bytes of the symbols, which get highlighted when they change.'''
 
 
         with dpg.child_window(width=self.width) as self.window:
@@ -34,17 +43,9 @@ class SymbolsWindow():
 
                 dpg.add_table_column()
 
-                with dpg.table_row():
-                    with dpg.collapsing_header(label=".rodata", tag='rodata', default_open=True):
-                        pass
-
-                with dpg.table_row():
-                    with dpg.collapsing_header(label=".data", tag='data', default_open=True):
-                        pass
-
-                with dpg.table_row():
-                    with dpg.collapsing_header(label=".bss", tag='bss', default_open=True):
-                        pass
+                for seg_name in ('rodata', 'data', 'bss'):
+                    with dpg.table_row():
+                        self.segment_header_tags[seg_name] = dpg.add_collapsing_header(label=f'.{ seg_name }', default_open=True)
 
 
     def build_symbol_widgets(self, segment: MemorySegment):
@@ -60,22 +61,33 @@ class SymbolsWindow():
             if dpg.does_item_exist(sel_tag):
                 dpg.delete_item(sel_tag)
 
+        for value_tags in self._sym_byte_value_tags[segment.name].values():
+            for byte_tags in value_tags:
+                self.display.forget(byte_tags)
+
+        self._sym_byte_value_tags[segment.name].clear()
+        self._sym_shown_bytes[segment.name].clear()
+        header = self.segment_header_tags[segment.name]
+
         for sym in segment.symbols:
-            sel = dpg.add_selectable(label=sym.name, parent=segment.name, indent=5, span_columns=True, callback=self.show_symbol_parts, user_data=(segment.name, sym.name))
+            sel = dpg.add_selectable(label=sym.name, parent=header, indent=5, span_columns=True, callback=self.show_symbol_parts, user_data=(segment.name, sym.name))
             self._symbol_selectable_tags[segment.name].append(sel)
 
             self._sym_byte_group_tags[segment.name][sym.name] = []
+            self._sym_byte_value_tags[segment.name][sym.name] = []
+            self._sym_shown_bytes[segment.name][sym.name] = sym.bytes
 
             for i, byte in enumerate(sym.bytes):
-                with dpg.group(parent=segment.name, horizontal=True, show=False, horizontal_spacing=80) as sym_byte_group:
+                with dpg.group(parent=header, horizontal=True, show=False, horizontal_spacing=80) as sym_byte_group:
 
                     self._sym_byte_group_tags[segment.name][sym.name].append(sym_byte_group)
 
                     addr = dpg.add_text(f'{sym.addr + i:#08x}:', indent=20)
-                    dpg.bind_item_theme(addr, self.gui.addr_text_theme)
+                    dpg.bind_item_theme(addr, self.tab.gui.addr_text_theme)
 
-                    dpg.add_text(f'{byte:#04x}', tag=f'{ segment.name }_{ sym.name }_byte_{ i }_hex')
-                    dpg.add_text(byte, tag=f'{ segment.name }_{ sym.name }_byte_{ i }_dec')
+                    byte_tags = (dpg.add_text(f'{byte:#04x}'), dpg.add_text(byte))
+                    self._sym_byte_value_tags[segment.name][sym.name].append(byte_tags)
+                    self.display.remember(byte_tags, byte)
 
     def show_symbol_parts(self, sender, app_data, user_data: tuple[str, str]):
         seg_name, sym_name = user_data[0], user_data[1]
@@ -87,11 +99,24 @@ class SymbolsWindow():
                 dpg.show_item(group_tag)
 
     def update_symbols_window(self):
-        ctx = self.gui.program.get_current_context()
-        segments = [ctx.dynamic_mem.data, ctx.dynamic_mem.bss]
+        '''Updates the bytes of the symbols that have changed since they were last shown.'''
 
-        for seg in segments:
-            for sym in seg.symbols:
-                for i, byte in enumerate(sym.bytes):
-                    dpg.set_value(f'{ seg.name }_{ sym.name }_byte_{ i }_hex', f'{byte:#04x}')
-                    dpg.set_value(f'{ seg.name }_{ sym.name }_byte_{ i }_dec', byte)
+        ctx = self.tab.program.get_current_context()
+        segments = [ctx.dynamic_mem.data, ctx.dynamic_mem.bss]
+        display = self.display
+
+        with display.refresh():
+            for seg in segments:
+                for sym in seg.symbols:
+                    shown_bytes = self._sym_shown_bytes[seg.name]
+                    if shown_bytes.get(sym.name) == sym.bytes:
+                        continue
+
+                    shown_bytes[sym.name] = sym.bytes
+                    value_tags = self._sym_byte_value_tags[seg.name][sym.name]
+
+                    for byte_tags, byte in zip(value_tags, sym.bytes):
+                        if display.changed(byte_tags, byte):
+                            hex_tag, dec_tag = byte_tags
+                            dpg.set_value(hex_tag, f'{byte:#04x}')
+                            dpg.set_value(dec_tag, byte)
@@ -0,0 +1,223 @@
+from array import array
+from typing import TYPE_CHECKING
+from utils import *
+from breakpoints import Signal
+import dearpygui.dearpygui as dpg
+
+if TYPE_CHECKING:
+    from program_tab import ProgramTab
+
+
+MAX_PLOT_BUCKETS = 1500
+'''The maximum number of buckets plotted at once, each one drawn with its minimum and its maximum.'''
+CLICK_TOLERANCE = 4
+'''The number of pixels the mouse can move between pressing and releasing a button for it to count as a click.'''
+
+
+
+class MinMaxPyramid():
+    '''The values of a register over the whole trace at every level of detail.
+
+       Level `k` holds the minimum and the maximum of every bucket of 2^k consecutive contexts,
+       so any zoom level can be drawn with at most `MAX_PLOT_BUCKETS` buckets, without losing the spikes
+       a plain subsampling would skip. The levels are computed once, in time linear in the length of the trace.'''
+
+    levels: list[tuple[array, array]]
+    '''The minimums and the maximums of the buckets at every level.'''
+
+
+    def __init__(self,
+                 signal: Signal,
+                 num_contexts: int):
+
+        self.num_contexts = num_contexts
+        '''The number of contexts the pyramid was built from.'''
+
+        # expand the changes of the signal into a value for every context
+        values = array('d')
+        for k, value in enumerate(signal.values):
+            end = signal.indices[k + 1] if k + 1 < len(signal.indices) else num_contexts
+            values += array('d', [float(value)]) * (end - signal.indices[k])
+
+        self.levels = [(values, values)]
+
+        mins = maxs = values
+        while len(mins) > MAX_PLOT_BUCKETS:
+            mins = array('d', map(min, mins[0::2], self._odd_half(mins)))
+            maxs = array('d', map(max, maxs[0::2], self._odd_half(maxs)))
+            self.levels.append((mins, maxs))
+
+
+    def downsample(self, start: float, end: float) -> tuple[list[float], list[float]]:
+        '''Returns the points of the line showing the contexts between `start` and `end`,
+           from the coarsest level that still has enough detail for them.'''
+
+        span = max(1.0, end - start)
+
+        level = 0
+        while level + 1 < len(self.levels) and span / (1 << level) > MAX_PLOT_BUCKETS:
+            level += 1
+
+        bucket = 1 << level
+        mins, maxs = self.levels[level]
+        first = max(0, int(start) // bucket - 1)
+        last = min(len(mins), int(end) // bucket + 2)
+
+        xs, ys = [], []
+        for i in range(first, last):
+            x = float(i * bucket)
+            if level == 0:
+                xs.append(x)
+                ys.append(mins[i])
+            else:
+                # draw every bucket as a vertical stroke from its minimum to its maximum
+                xs += (x, x + bucket / 2)
+                ys += (mins[i], maxs[i])
+
+        return xs, ys
+
+
+    @staticmethod
+    def _odd_half(values: array) -> array:
+        '''Returns every second value starting with the 2nd one, pairing an odd last value with itself.'''
+
+        odd = values[1::2]
+        if len(values) % 2:
+            odd.append(values[-1])
+
+        return odd
+
+
+
+class TimelineWindow():
+    '''The window that plots the value of a register or a flag over the whole execution.'''
+
+    _plotted: tuple = ()
+    '''The register, the x axis limits and the number of contexts of the pyramid the line was last drawn from.'''
+
+
+    def __init__(self,
+                 tab: 'ProgramTab'):
+
+        self.tab = tab
+        '''The tab whose program the window shows.'''
+        self._pyramids: dict[str, MinMaxPyramid] = {}
+        '''The levels of detail of the registers plotted so far.'''
+        self._mouse_down_pos: list[float] = [0, 0]
+        '''Where the left mouse button was last pressed.'''
+        self.register = 'RAX'
+        '''The register or flag being plotted.'''
+
+
+        with dpg.child_window(width=420) as self.window:
+
+            with dpg.group(horizontal=True):
+                dpg.add_text(default_value='Timeline')
+                dpg.add_spacer(width=15)
+                dpg.add_combo(items=(*main_regs, *flags), default_value=self.register, width=100, callback=self.select_register)
+
+            dpg.add_separator()
+
+            self.message_text = dpg.add_text('', wrap=400)
+            '''Tells why there is nothing to plot.'''
+
+            with dpg.plot(width=-1, height=-1, no_title=True, no_menus=True) as self.plot:
+                self.x_axis = dpg.add_plot_axis(dpg.mvXAxis, label='step')
+
+                with dpg.plot_axis(dpg.mvYAxis, label='value') as self.y_axis:
+                    self.series = dpg.add_line_series([], [])
+                    self.position_line = dpg.add_inf_line_series([0])
+
+        # the plot is redrawn when it gets zoomed or panned, which is only visible from its axis limits
+        with dpg.item_handler_registry() as self.plot_handlers:
+            dpg.add_item_visible_handler(callback=self.redraw_if_needed)
+        dpg.bind_item_handler_registry(self.plot, self.plot_handlers)
+
+        # a click seeks to the step under the mouse, but dragging to pan the plot should not
+        with dpg.handler_registry() as self.mouse_handlers:
+            dpg.add_mouse_click_handler(button=dpg.mvMouseButton_Left, callback=self.remember_mouse_down)
+            dpg.add_mouse_release_handler(button=dpg.mvMouseButton_Left, callback=self.seek_to_clicked_step)
+
+
+    def initialize_timeline(self):
+        '''Forgets the registers of the previous program and plots the current register of the loaded one.'''
+
+        self._pyramids.clear()
+        self._plotted = ()
+
+        if self.tab.breakpoint_engine is None:
+            dpg.set_value(self.message_text, 'The timeline needs a recorded trace, it is not available in live mode.')
+            dpg.configure_item(self.series, x=[], y=[])
+            return
+
+        dpg.set_value(self.message_text, '')
+        dpg.set_axis_limits_auto(self.x_axis)
+        self.redraw_if_needed()
+        dpg.fit_axis_data(self.x_axis)
+        dpg.fit_axis_data(self.y_axis)
+
+    def update_timeline_position(self):
+        '''Moves the marker of the current step.'''
+
+        dpg.set_value(self.position_line, [[float(self.tab.program.index)]])
+
+    def select_register(self, sender, app_data):
+        self.register = app_data
+        self.redraw_if_needed()
+        dpg.fit_axis_data(self.y_axis)
+
+    def redraw_if_needed(self):
+        '''Redraws the line if the register, the visible range or the trace has changed since it was last drawn.'''
+
+        if self.tab.breakpoint_engine is None:
+            return
+
+        pyramid = self.get_pyramid(len(self.tab.program.contexts))
+        limits = tuple(dpg.get_axis_limits(self.x_axis))
+
+        if (self.register, limits, pyramid.num_contexts) == self._plotted:
+            return
+
+        start, end = limits
+        if not self._plotted or end <= start:
+            start, end = 0, pyramid.num_contexts
+
+        xs, ys = pyramid.downsample(start, end)
+        dpg.configure_item(self.series, x=xs, y=ys)
+
+        self._plotted = (self.register, limits, pyramid.num_contexts)
+
+    def get_pyramid(self, num_contexts: int) -> MinMaxPyramid:
+        '''Returns the levels of detail of the current register, building them if needed.'''
+
+        pyramid = self._pyramids.get(self.register)
+
+        # while the trace is being streamed in, only rebuild once it has grown considerably
+        if pyramid is None or (pyramid.num_contexts != num_contexts
+                               and (not self.tab.is_loading() or num_contexts >= 2 * pyramid.num_contexts)):
+            signals = self.tab.breakpoint_engine.signals
+            pyramid = MinMaxPyramid(signals.signal(self.register), len(signals))
+            self._pyramids[self.register] = pyramid
+
+        return pyramid
+
+    def remove_mouse_handlers(self):
+        '''Removes the mouse handlers, which are global, before the window gets deleted along with its tab.'''
+
+        dpg.delete_item(self.mouse_handlers)
+
+    def remember_mouse_down(self):
+        self._mouse_down_pos = dpg.get_mouse_pos(local=False)
+
+    def seek_to_clicked_step(self):
+        '''Moves the program to the step under the mouse if the plot was clicked without dragging.'''
+
+        if self.tab.breakpoint_engine is None or not dpg.is_item_hovered(self.plot):
+            return
+
+        x, y = dpg.get_mouse_pos(local=False)
+        if abs(x - self._mouse_down_pos[0]) > CLICK_TOLERANCE or abs(y - self._mouse_down_pos[1]) > CLICK_TOLERANCE:
+            return
+
+        step, _ = dpg.get_plot_mouse_pos()
+        self.tab.seek(min(max(0, round(step)), len(self.tab.program.contexts) - 1))
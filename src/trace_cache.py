@@ -0,0 +1,128 @@
+import os
+import hashlib
+import subprocess
+import tempfile
+
+
+CACHE_DIR = os.environ.get('HOHOEMU_CACHE_DIR',
+                           os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'hohoemu'))
+'''The directory the compiled programs and their traces are cached in, can be set with the `HOHOEMU_CACHE_DIR` environment variable.'''
+CACHE_SIZE_LIMIT = int(os.environ.get('HOHOEMU_CACHE_SIZE_MB', 512)) * 1024 * 1024
+'''The size in bytes the cache is trimmed to, can be set in MiB with the `HOHOEMU_CACHE_SIZE_MB` environment variable.'''
+BINARY_SUFFIX = '.elf'
+'''The extension of the cached compiled programs.'''
+TRACE_SUFFIX = '.trace'
+'''The extension of the cached binary traces.'''
+
+
+
+class TraceCache():
+    '''A content-addressed cache of compiled programs and their binary traces.
+
+       The entries are keyed by a hash of the source file's bytes and path, the version of the emulator and,
+       for traces, the options the emulator was run with, so an entry never has to be invalidated: a changed
+       source or a new emulator simply maps to a new key. Entries are touched whenever they are used, and
+       the least recently used ones are removed once the cache grows larger than its size limit.'''
+
+    _emulator_version: bytes = None
+    '''The output of `asemu --version`, read the first time a key is computed.'''
+
+
+    def __init__(self,
+                 emulator_path: str,
+                 cache_dir: str = CACHE_DIR,
+                 size_limit: int = CACHE_SIZE_LIMIT):
+
+        self.emulator_path = emulator_path
+        '''The path of the emulator whose outputs are cached.'''
+        self.cache_dir = cache_dir
+        '''The directory holding the entries.'''
+        self.size_limit = size_limit
+        '''The maximum total size of the entries in bytes.'''
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    def binary_path(self, file_path: str) -> str:
+        '''Returns the path the compiled program of an assembly file is cached at.'''
+
+        return os.path.join(self.cache_dir, self._key(file_path) + BINARY_SUFFIX)
+
+    def trace_path(self, file_path: str, settings: list[str]) -> str:
+        '''Returns the path the trace of an assembly file emulated with the options `settings` is cached at.'''
+
+        return os.path.join(self.cache_dir, self._key(file_path, settings) + TRACE_SUFFIX)
+
+    def lookup(self, path: str) -> bool:
+        '''Returns whether there is an entry at `path`, marking it as the most recently used one if there is.'''
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def store(self, path: str, temp_path: str) -> None:
+        '''Moves a finished temporary file created by `create_temp_file` to the entry at `path`,
+           then trims the cache to its size limit.'''
+
+        os.replace(temp_path, path)
+        self.evict()
+
+    def create_temp_file(self):
+        '''Returns a new file in the cache directory, which can be moved into an entry atomically once it has been written.'''
+
+        return tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix='.tmp-', delete=False)
+
+    def evict(self) -> None:
+        '''Removes the least recently used entries until the cache fits into its size limit.'''
+
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith((BINARY_SUFFIX, TRACE_SUFFIX)):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total_size -= size
+
+    def clear(self) -> None:
+        '''Removes every entry of the cache.'''
+
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+    def _key(self, file_path: str, settings: list[str] = None) -> str:
+        if self._emulator_version is None:
+            self._emulator_version = subprocess.run([self.emulator_path, '--version'], capture_output=True,
+                                                    check=True).stdout
+
+        digest = hashlib.sha256()
+
+        # the compiled program refers to the source file by its path for the text of its lines
+        digest.update(os.path.abspath(file_path).encode() + b'\0')
+        with open(file_path, 'rb') as file:
+            digest.update(file.read())
+
+        digest.update(b'\0' + self._emulator_version)
+
+        if settings is not None:
+            digest.update(b'\0'.join(arg.encode() for arg in settings))
+
+        return digest.hexdigest()
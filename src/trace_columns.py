@@ -0,0 +1,216 @@
+import os
+from emu_dataclasses import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+COLUMNAR_STORE_ENABLED = np is not None and os.environ.get('HOHOEMU_COLUMNAR_STORE', '0') == '1'
+'''Whether the deserializer attaches a `TraceColumns` to the programs it builds. Off by default, as neither
+   the GUI nor the breakpoints query it yet, and can be turned on by setting the `HOHOEMU_COLUMNAR_STORE`
+   environment variable to 1. Needs NumPy.'''
+INITIAL_CAPACITY = 1024
+'''The number of rows the matrices are allocated with, they double in size whenever they fill up.'''
+
+
+
+class TraceColumns():
+    '''The execution contexts of a program stored column-wise in NumPy matrices, one row per context:
+       an N×R `uint64` matrix of the registers (in the order of `REGISTER_NAMES`), and N×size `uint8`
+       matrices of the stack, the .data and the .bss segments.
+
+       Every matrix is filled on its own by replaying the trace the first time it is accessed, so a query
+       over the registers neither allocates nor fills the memory matrices. The matrices are extended when
+       the trace grows while it is being streamed. The contexts themselves are still materialized by the
+       program's context list, this store only serves queries over the whole trace.'''
+
+    _matrices: dict[str, 'np.ndarray']
+    '''The matrix of each column, including the rows that have not been filled yet.'''
+    _num_rows: dict[str, int]
+    '''The number of rows of each matrix that have been filled.'''
+    _states: dict[str, list[int] | bytearray]
+    '''The registers or the segment bytes of the last filled context of each column, which the next delta gets applied to.'''
+
+
+    def __init__(self,
+                 program: ExecutedProgram):
+
+        if np is None:
+            raise RuntimeError('the columnar trace store needs NumPy')
+
+        self.program = program
+        '''The program whose contexts are stored.'''
+
+        self._matrices = {}
+        self._num_rows = {}
+        self._states = {}
+
+
+    def __len__(self) -> int:
+        return self._num_rows.get('registers', 0)
+
+    @property
+    def registers(self) -> 'np.ndarray':
+        '''The N×R matrix of the registers, in the order of `REGISTER_NAMES`.'''
+
+        return self._column('registers')
+
+    @property
+    def stack(self) -> 'np.ndarray':
+        '''The N×size matrix of the stack contents.'''
+
+        return self._column('stack')
+
+    @property
+    def data(self) -> 'np.ndarray':
+        '''The N×size matrix of the .data segment.'''
+
+        return self._column('data')
+
+    @property
+    def bss(self) -> 'np.ndarray':
+        '''The N×size matrix of the .bss segment.'''
+
+        return self._column('bss')
+
+    def register(self, name: str) -> 'np.ndarray':
+        '''Returns the values of a register, a sub-register or a flag in every context.'''
+
+        registers = self.registers
+
+        slot = REGISTER_SLOTS.get(name)
+        if slot is not None:
+            return registers[:, slot]
+
+        if name in FLAG_BITS:
+            reg, shift, mask = 'RFLAGS', FLAG_BITS[name], 1
+        elif name in SUB_REGISTERS:
+            reg, shift, mask = SUB_REGISTERS[name]
+        else:
+            raise KeyError(name)
+
+        return (registers[:, REGISTER_SLOTS[reg]] >> np.uint64(shift)) & np.uint64(mask)
+
+    def update(self) -> None:
+        '''Fills the rows of the contexts that have been added to the program since the last update,
+           in the matrices that have been accessed so far.'''
+
+        for column in self._matrices:
+            self._update_column(column)
+
+
+    def _column(self, column: str) -> 'np.ndarray':
+        self._update_column(column)
+        return self._matrices[column][:self._num_rows[column]]
+
+    def _update_column(self, column: str) -> None:
+        '''Fills the rows of a single matrix up to the number of contexts of the program.'''
+
+        num_contexts = len(self.program.contexts)
+        start = self._num_rows.get(column, 0)
+        if start == num_contexts:
+            return
+
+        self._reserve(column, num_contexts)
+        matrix = self._matrices[column]
+
+        if isinstance(self.program.contexts, list):
+            for index in range(start, num_contexts):
+                matrix[index] = self._context_row(column, self.program.contexts[index])
+
+            self._num_rows[column] = num_contexts
+            return
+
+        if start == 0:
+            self._states[column] = self._initial_state(column)
+            matrix[0] = self._state_row(column)
+            start = 1
+
+        state = self._states[column]
+        deltas = self.program.deltas
+
+        if column == 'registers':
+            # the states store the registers in the order the emulator reads them
+            order = [self.program.register_names.index(name) for name in REGISTER_NAMES]
+
+            for index in range(start, num_contexts):
+                for slot, value in deltas[index - 1].regs:
+                    state[slot] = value
+                matrix[index] = [state[i] for i in order]
+        else:
+            base = self._segment_addr(column, len(state))
+
+            for index in range(start, num_contexts):
+                for addr, written in deltas[index - 1].writes:
+                    begin = max(addr, base)
+                    end = min(addr + len(written), base + len(state))
+
+                    if begin < end:
+                        state[begin - base:end - base] = written[begin - addr:end - addr]
+
+                matrix[index] = np.frombuffer(state, dtype=np.uint8)
+
+        self._num_rows[column] = num_contexts
+
+    def _initial_state(self, column: str) -> list[int] | bytearray:
+        state = self.program.initial_state
+
+        if column == 'registers':
+            return list(state.regs)
+
+        return bytearray(getattr(state, column))
+
+    def _state_row(self, column: str):
+        state = self._states[column]
+
+        if column == 'registers':
+            return [state[self.program.register_names.index(name)] for name in REGISTER_NAMES]
+
+        return np.frombuffer(state, dtype=np.uint8)
+
+    def _segment_addr(self, column: str, size: int) -> int:
+        '''The address of the first byte of a memory column.'''
+
+        if column == 'stack':
+            return self.program.mem_layout.stack_start_addr - size
+
+        return getattr(self.program.dynamic_mem, column).addr
+
+    @staticmethod
+    def _context_row(column: str, context: ExecutionContext):
+        if column == 'registers':
+            return context.regs.values
+        if column == 'stack':
+            return np.frombuffer(context.stack.content, dtype=np.uint8)
+
+        return np.frombuffer(getattr(context.dynamic_mem, column).bytes, dtype=np.uint8)
+
+    def _reserve(self, column: str, num_rows: int) -> None:
+        '''Makes room for `num_rows` rows in a single matrix, keeping the rows filled so far.'''
+
+        matrix = self._matrices.get(column)
+
+        if matrix is None:
+            if column == 'registers':
+                width, dtype = len(REGISTER_NAMES), np.uint64
+            elif isinstance(self.program.contexts, list):
+                width, dtype = len(self._context_row(column, self.program.contexts[0])), np.uint8
+            else:
+                width, dtype = len(getattr(self.program.initial_state, column)), np.uint8
+
+            self._matrices[column] = np.empty((max(INITIAL_CAPACITY, num_rows), width), dtype=dtype)
+            self._num_rows[column] = 0
+            return
+
+        capacity = len(matrix)
+        if num_rows <= capacity:
+            return
+
+        while capacity < num_rows:
+            capacity *= 2
+
+        new = np.empty((capacity, matrix.shape[1]), dtype=matrix.dtype)
+        new[:self._num_rows[column]] = matrix[:self._num_rows[column]]
+        self._matrices[column] = new
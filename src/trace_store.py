@@ -0,0 +1,187 @@
+import os
+from array import array
+from collections import OrderedDict
+from typing import Callable
+from emu_dataclasses import *
+
+
+DEFAULT_KEYFRAME_INTERVAL = int(os.environ.get('HOHOEMU_KEYFRAME_INTERVAL', 256))
+'''The default number of contexts between two keyframes.
+   Can be overridden with the `HOHOEMU_KEYFRAME_INTERVAL` environment variable.'''
+DEFAULT_CACHE_SIZE = 64
+'''The default number of recently materialized contexts kept in memory.'''
+
+
+
+class DeltaIndex():
+    '''The deltas of a trace kept in their serialized form, either in a memory-mapped trace file
+       or in a buffer the streamed records get appended to, and decoded when accessed.
+
+       Only a single offset is stored for every instruction. Behaves like a read-only list of `ContextDelta`s.'''
+
+    offsets: array
+    '''The offset of every delta record's payload in `buffer`.'''
+
+
+    def __init__(self,
+                 buffer: bytes | bytearray,
+                 decode: Callable[[bytes | bytearray, int], ContextDelta],
+                 decode_line_index: Callable[[bytes | bytearray, int], int]):
+
+        self.buffer = buffer
+        '''The buffer holding the serialized deltas, e.g. an `mmap` of the trace file.'''
+        self.decode = decode
+        '''Decodes the delta whose payload starts at the given offset of the buffer.'''
+        self.decode_line_index = decode_line_index
+        '''Decodes only the code line index of the delta whose payload starts at the given offset of the buffer.'''
+        self.offsets = array('Q')
+
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int | slice) -> ContextDelta | list[ContextDelta]:
+        if isinstance(index, slice):
+            return [self.decode(self.buffer, offset) for offset in self.offsets[index]]
+
+        return self.decode(self.buffer, self.offsets[index])
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield self.decode(self.buffer, offset)
+
+    def line_index(self, index: int) -> int:
+        '''Returns the index of the code line the delta at `index` leads to, without decoding the rest of it.'''
+
+        return self.decode_line_index(self.buffer, self.offsets[index])
+
+    def add(self, offset: int) -> None:
+        '''Adds the delta whose payload is already in the buffer at `offset`.'''
+
+        self.offsets.append(offset)
+
+    def append(self, payload: bytes) -> None:
+        '''Copies the payload of a delta record to the end of the buffer and adds it.'''
+
+        offset = len(self.buffer)
+        self.buffer += payload
+        self.offsets.append(offset)
+
+
+
+class TraceStore():
+    '''Stores the execution contexts of a program as full keyframes every `keyframe_interval`
+       contexts plus the deltas in between, and materializes any context on demand.
+
+       Behaves like a read-only list of `ExecutionContext`s. The list may still grow while the
+       deltas are being streamed in from the emulator, until `is_complete` gets set.'''
+
+    _keyframes: list[ExecutionState]
+    '''The full states of the contexts at every `keyframe_interval`th index.'''
+    _cache: OrderedDict[int, ExecutionContext]
+    '''The most recently materialized contexts, in least recently used order.'''
+    _tail_index: int
+    '''The index of the last context the keyframes have been built up to.'''
+    _tail_state: ExecutionState
+    '''The state of the context at `_tail_index`.'''
+    _cursor_index: int
+    '''The index of the context `_cursor_state` belongs to.'''
+    _cursor_state: ExecutionState
+    '''The state of the last materialized context, so that stepping forward only applies a single delta.'''
+
+
+    def __init__(self,
+                 program: ExecutedProgram,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+
+        self.program = program
+        '''The program whose contexts are stored.'''
+        self.keyframe_interval = max(1, keyframe_interval)
+        '''The number of contexts between two keyframes. Smaller values use more memory but seek faster.'''
+        self.cache_size = cache_size
+        '''The maximum number of materialized contexts kept in memory.'''
+        self.is_complete = False
+        '''Whether every delta of the program has arrived, so that the last context is the end of the program.'''
+
+        self._cache = OrderedDict()
+
+        self._tail_index = 0
+        self._tail_state = self.program.initial_state.copy()
+        self._keyframes = [self._tail_state.copy()]
+
+        self._cursor_index = 0
+        self._cursor_state = self._tail_state.copy()
+
+
+    def __len__(self) -> int:
+        return len(self.program.deltas) + 1
+
+    def __getitem__(self, index: int) -> ExecutionContext:
+        length = len(self)
+
+        if index < 0:
+            index += length
+
+        if not 0 <= index < length:
+            raise IndexError('context index out of range')
+
+        context = self._cache.get(index)
+        if context is not None:
+            self._cache.move_to_end(index)
+        else:
+            if index > self._tail_index:
+                self._build_keyframes(index)
+
+            context = self.program.materialize(self._seek(index))
+
+            self._cache[index] = context
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        # the last context only becomes the end of the program once the whole trace has arrived
+        context.has_program_ended = self.is_complete and index == length - 1
+
+        return context
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def line_index(self, index: int) -> int:
+        '''Returns the index of the code line the context at `index` is about to execute, without materializing it.'''
+
+        if index == 0:
+            return self.program.initial_state.insn[0]
+
+        return self.program.deltas.line_index(index - 1)
+
+
+    def _build_keyframes(self, index: int) -> None:
+        '''Replays the deltas up to the context at `index` that have not been replayed yet,
+           and keeps a copy of the state at every keyframe.'''
+
+        for i in range(self._tail_index + 1, index + 1):
+            self.program.apply_delta(self._tail_state, self.program.deltas[i - 1])
+
+            if i % self.keyframe_interval == 0:
+                self._keyframes.append(self._tail_state.copy())
+
+        self._tail_index = index
+
+    def _seek(self, index: int) -> ExecutionState:
+        '''Returns the state of the context at `index` by applying deltas to the nearest preceding
+           keyframe, or to the last materialized state if that is closer.'''
+
+        keyframe_index = (index // self.keyframe_interval) * self.keyframe_interval
+
+        if not keyframe_index <= self._cursor_index <= index:
+            self._cursor_index = keyframe_index
+            self._cursor_state = self._keyframes[keyframe_index // self.keyframe_interval].copy()
+
+        for delta in self.program.deltas[self._cursor_index:index]:
+            self.program.apply_delta(self._cursor_state, delta)
+
+        self._cursor_index = index
+
+        return self._cursor_state
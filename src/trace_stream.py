@@ -0,0 +1,186 @@
+import os
+import mmap
+import time
+import subprocess
+import threading
+from deserializer import *
+from trace_cache import TraceCache
+from emulator_progress import EmulatorProgress
+
+
+EMULATION_SETTINGS = ['--quiet', '--progress', '--output', SERIALIZER_STDOUT]
+'''The options the emulator is run with, which the cached traces are keyed by.'''
+
+
+
+class _TeeReader():
+    '''Wraps a stream, copying everything read from it into a file.'''
+
+    def __init__(self, stream: BinaryIO, copy: BinaryIO):
+        self.stream = stream
+        self.copy = copy
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.copy.write(data)
+        return data
+
+
+
+class TraceStream():
+    '''An `asemu` process streaming its binary trace through a pipe.
+
+       The records are deserialized as they arrive: the program becomes available as soon as its
+       first execution context has been read, and the rest of the trace is read in the background.
+       Creating a stream only starts the emulator, `wait_until_ready` waits for the first context.
+
+       With a `TraceCache`, the compiled program and the complete trace are stored in the cache,
+       and an unchanged file is loaded from its cached trace without starting the emulator at all.'''
+
+    _process: subprocess.Popen = None
+    '''The running emulator process, `None` if the trace was loaded from the cache.'''
+    _reader: threading.Thread = None
+    '''The thread reading the rest of the trace.'''
+    _cache_file = None
+    '''The temporary file the trace is copied into while it is read, until it is stored in the cache.'''
+    progress: EmulatorProgress = None
+    '''The phase the emulator is in, `None` if the trace was loaded from the cache.'''
+    work_dir: str = None
+    '''The private directory the emulator keeps its files in, `None` if the trace was loaded from the cache.'''
+
+
+    def __init__(self,
+                 emulator_path: str,
+                 file_path: str,
+                 cache: TraceCache = None):
+
+        self.error: Exception = None
+        '''The error that stopped reading the trace, if any.'''
+        self.cache = cache
+        '''The cache the trace is loaded from or stored in, if any.'''
+        self.deserialize_seconds: float = 0
+        '''The CPU time the threads reading the trace spent on it, excluding the time they waited for the emulator.'''
+
+        self.program: ExecutedProgram = None
+        '''The program being emulated, whose contexts keep growing until the trace has been read.'''
+
+        args = [emulator_path, *EMULATION_SETTINGS, file_path]
+
+        if cache is not None:
+            self._trace_path = cache.trace_path(file_path, EMULATION_SETTINGS)
+
+            if cache.lookup(self._trace_path):
+                started = time.thread_time()
+                with open(self._trace_path, 'rb') as file:
+                    # the mapping stays valid after the file gets closed
+                    self.program = Deserializer().parse_mapped_trace(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+                self.deserialize_seconds = time.thread_time() - started
+                return
+
+            binary_path = cache.binary_path(file_path)
+            cache.lookup(binary_path)
+            args[1:1] = ['--binary', binary_path]
+
+        self.work_dir = create_work_dir()
+        args[1:1] = ['--workdir', self.work_dir]
+
+        self._process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.progress = EmulatorProgress(self._process.stderr)
+
+        if cache is not None:
+            self._cache_file = cache.create_temp_file()
+
+
+    def wait_until_ready(self) -> None:
+        '''Waits until the first execution context has been read, then reads the rest of the trace in the background.'''
+
+        if self._process is None:
+            return
+
+        stream = self._process.stdout
+        if self._cache_file is not None:
+            stream = _TeeReader(stream, self._cache_file)
+
+        deserializer = Deserializer()
+        records = deserializer.stream_binary_trace(stream)
+        started = time.thread_time()
+
+        try:
+            for rec_type in records:
+                if rec_type == REC_CONTEXT:
+                    break
+        except Exception:
+            # the emulator failed before emulating anything, e.g. because the source did not compile
+            self.kill()
+            self._process.wait()
+            self._discard_cache_file()
+            raise
+
+        self.deserialize_seconds += time.thread_time() - started
+        self.program = deserializer.program
+
+        self._reader = threading.Thread(target=self._read_rest, args=(records,), daemon=True)
+        self._reader.start()
+
+
+    def is_loading(self) -> bool:
+        '''Whether the rest of the trace is still being read.'''
+
+        return self._reader is not None and self._reader.is_alive()
+
+    def kill(self) -> None:
+        '''Stops the emulator right away, keeping the contexts read so far. Can be called from any thread.'''
+
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+
+    def close(self) -> None:
+        '''Stops the emulator if it is still running and waits for the reader to finish.'''
+
+        if self._process is None:
+            return
+
+        self.kill()
+        self._process.wait()
+        if self._reader is not None:
+            self._reader.join()
+        self._process.stdout.close()
+        self._discard_cache_file()
+        remove_work_dir(self.work_dir)
+
+
+    def _read_rest(self, records: Iterator[int]) -> None:
+        started = time.thread_time()
+
+        try:
+            for _ in records:
+                pass
+        except Exception as ex:
+            # the contexts read so far are still valid, e.g. when the emulator got killed
+            self.error = ex
+            self.program.contexts.is_complete = True
+            return
+        finally:
+            self.deserialize_seconds += time.thread_time() - started
+
+        if self._cache_file is None:
+            return
+
+        # a trace cut short by the wall-clock limit depends on the machine's load, it is not worth keeping
+        self._process.wait()
+        if self._process.returncode != 0 or self.program.ex_info.truncation_reason == TRUNCATION_TIMEOUT:
+            return
+
+        self._cache_file.close()
+        self.cache.store(self._trace_path, self._cache_file.name)
+        self._cache_file = None
+
+    def _discard_cache_file(self) -> None:
+        '''Removes the temporary copy of a trace that did not get stored in the cache.'''
+
+        if self._cache_file is None:
+            return
+
+        self._cache_file.close()
+        os.remove(self._cache_file.name)
+        self._cache_file = None
@@ -1,6 +1,7 @@
 import os
 import sys
-import dearpygui.dearpygui as dpg
+import shutil
+import tempfile
 
 
 
@@ -35,7 +36,10 @@ reg_subparts = {
 }
 '''A mapping of the register names to their subparts.'''
 
-irrelevant_symbols = ('_IO_stdin_used', '__data_start', '__dso_handle', 'completed.0')
+irrelevant_symbols = ('_IO_stdin_used', '__data_start', '__dso_handle', 'completed.0', '__bss_start', '_edata', '_end')
+
+WORK_DIR_PREFIX = 'hohoemu-'
+'''The start of the names of the temporary directories the emulator runs in.'''
 
 
 def get_program_dir():
@@ -48,9 +52,23 @@ def get_program_dir():
         # we are running in a normal Python environment
         return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+def create_work_dir() -> str:
+    '''Creates a private temporary directory for the files of a single emulator run,
+       so emulators running at the same time do not overwrite each other's files.'''
+
+    return tempfile.mkdtemp(prefix=WORK_DIR_PREFIX)
+
+def remove_work_dir(path: str) -> None:
+    '''Removes a directory created by `create_work_dir` along with the files left in it.'''
+
+    shutil.rmtree(path, ignore_errors=True)
+
 def calculate_dialog_position(width: int, height: int) -> tuple[int, int]:
     '''Calculates the position of a dialog window based on the viewport size.'''
 
+    # imported here, so the headless tools can use the rest of the module without Dear PyGui installed
+    import dearpygui.dearpygui as dpg
+
     pos_x = (dpg.get_viewport_width() // 2) - (width // 2)
     pos_y = (dpg.get_viewport_height() // 2) - (height // 2)
 
@@ -0,0 +1,187 @@
+'''Measures the deserializer, stepping through the contexts of a program and updating the section windows
+   on synthetic traces generated by gen_trace.py, and writes the results as JSON, so runs before and after
+   a change can be compared.
+
+   The section windows are measured in a Dear PyGui context without a viewport, and skipped when Dear PyGui
+   is not installed.
+
+   Usage: python tools/bench.py [-o RESULTS] [-n NUM_INSNS...] [--data-size N] [--bss-size N] [--symbols N] [-r REPEAT]'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from deserializer import *
+from gen_trace import generate_trace
+
+
+NUM_SEEKS = 1000
+'''The number of random contexts jumped to by the seek benchmark.'''
+NUM_WINDOW_UPDATES = 500
+'''The number of steps the section windows are updated for.'''
+
+
+
+def best_time(func, repeat: int) -> float:
+    '''Returns the shortest of `repeat` runs of `func` in seconds.'''
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def parse(trace_path: str) -> ExecutedProgram:
+    return Deserializer().get_executed_program(trace_path)
+
+def step_through(program: ExecutedProgram, direction: int) -> None:
+    '''Steps through every context the way the GUI does, decoding each one.'''
+
+    program.index = 0 if direction > 0 else len(program.contexts) - 1
+    program.get_current_context()
+
+    while program.step(direction) == 0:
+        program.get_current_context()
+
+
+def bench_deserializer(trace_path: str, num_insns: int, repeat: int) -> dict:
+    '''Measures parsing the trace, the memory it takes and stepping and seeking through its contexts.'''
+
+    results = {}
+
+    seconds = best_time(lambda: parse(trace_path), repeat)
+    results['parse'] = { 'seconds': seconds, 'us_per_context': seconds / num_insns * 1e6 }
+
+    # the memory is measured on its own, tracing the allocations slows everything down
+    tracemalloc.start()
+    program = parse(trace_path)
+    parse_peak = tracemalloc.get_traced_memory()[1]
+    step_through(program, 1)
+    step_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results['memory'] = {
+        'parse_peak_bytes': parse_peak,
+        'step_peak_bytes': step_peak,
+        'bytes_per_context': step_peak / num_insns,
+    }
+
+    program = parse(trace_path)
+    for name, direction in (('step_forward', 1), ('step_backward', -1)):
+        seconds = best_time(lambda: step_through(program, direction), repeat)
+        results[name] = { 'seconds': seconds, 'us_per_step': seconds / num_insns * 1e6 }
+
+    rnd = random.Random(0)
+    indices = [rnd.randrange(num_insns) for _ in range(NUM_SEEKS)]
+
+    def seek():
+        for index in indices:
+            program.index = index
+            program.get_current_context()
+
+    seconds = best_time(seek, repeat)
+    results['seek'] = { 'seconds': seconds, 'us_per_seek': seconds / NUM_SEEKS * 1e6 }
+
+    return results
+
+def bench_section_windows(trace_path: str, repeat: int) -> dict:
+    '''Measures the `update_*` methods of the register, the stack and the symbols windows.'''
+
+    try:
+        import dearpygui.dearpygui as dpg
+    except ImportError:
+        return { 'skipped': 'Dear PyGui is not installed' }
+
+    from gui import GUI
+    from program_tab import ProgramTab
+
+    dpg.create_context()
+
+    try:
+        # only the themes of the GUI are needed, not its viewport and rendering loop
+        gui = GUI.__new__(GUI)
+        gui.create_themes()
+
+        with dpg.window():
+            with dpg.tab_bar() as tab_bar:
+                tab = ProgramTab(gui, parent=tab_bar)
+
+        tab.program = parse(trace_path)
+        tab.symbols_section.build_symbol_widgets(tab.program.static_mem.rodata)
+        tab.symbols_section.build_symbol_widgets(tab.program.get_current_context().dynamic_mem.data)
+        tab.symbols_section.build_symbol_widgets(tab.program.get_current_context().dynamic_mem.bss)
+
+        num_updates = min(NUM_WINDOW_UPDATES, len(tab.program.contexts))
+        results = {}
+
+        for name, update in (('update_register_values', tab.register_section.update_register_values),
+                             ('update_stack_window', tab.stack_section.update_stack_window),
+                             ('update_symbols_window', tab.symbols_section.update_symbols_window)):
+
+            def run():
+                for index in range(num_updates):
+                    tab.program.index = index
+                    update()
+
+            seconds = best_time(run, repeat)
+            results[name] = { 'seconds': seconds, 'us_per_update': seconds / num_updates * 1e6 }
+
+        return results
+    finally:
+        dpg.destroy_context()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the deserializer and the section windows on synthetic traces.')
+    parser.add_argument('-o', '--output', help='the file the results are written to (default: stdout)')
+    parser.add_argument('-n', '--insns', type=int, nargs='+', default=[10_000, 100_000],
+                        help='the number of instructions of the generated traces, one run each')
+    parser.add_argument('--data-size', type=int, default=256, help='the size of the .data segment in bytes')
+    parser.add_argument('--bss-size', type=int, default=256, help='the size of the .bss segment in bytes')
+    parser.add_argument('--symbols', type=int, default=16, help='the number of symbols in .data and in .bss each')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='the number of runs the best time is taken of')
+    args = parser.parse_args()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'runs': [],
+    }
+
+    for num_insns in args.insns:
+        config = { 'insns': num_insns, 'data_size': args.data_size, 'bss_size': args.bss_size, 'symbols': args.symbols }
+        print(f'Measuring { config }', file=sys.stderr)
+
+        with tempfile.NamedTemporaryFile(suffix='.trace') as trace:
+            trace.write(generate_trace(num_insns, args.data_size, args.bss_size, args.symbols))
+            trace.flush()
+
+            report['runs'].append({
+                'config': config,
+                'trace_bytes': os.path.getsize(trace.name),
+                'deserializer': bench_deserializer(trace.name, num_insns, args.repeat),
+                'section_windows': bench_section_windows(trace.name, args.repeat),
+            })
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''Emulates the programs of a corpus generated by gen_corpus.py that list their expected symbols, and checks that
+   the emulator reports exactly those symbols in their .data and .bss segments, e.g. no symbols of the linker.
+
+   Usage: python tools/check_symbols.py CORPUS_DIR [EMULATOR]'''
+
+import os
+import sys
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from deserializer import *
+from gen_corpus import EXPECTED_SYMBOLS
+
+
+
+def get_symbol_names(emulator_path: str, file_path: str) -> dict[str, list[str]]:
+    '''Emulates the file in a work directory of its own and returns the names of its .data and .bss symbols.'''
+
+    work_dir = create_work_dir()
+
+    try:
+        process = subprocess.run([emulator_path, '--quiet', '--workdir', work_dir, file_path],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip() or f'The emulator exited with status { process.returncode }')
+
+        program = Deserializer().get_executed_program(os.path.join(work_dir, SERIALIZED_OUTPUT_NAME))
+        dynamic_mem = program.get_current_context().dynamic_mem
+
+        return { seg.name: [sym.name for sym in seg.symbols] for seg in (dynamic_mem.data, dynamic_mem.bss) }
+    finally:
+        remove_work_dir(work_dir)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+
+    corpus_dir = sys.argv[1]
+    emulator_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(get_program_dir(), 'asemu')
+
+    problems = []
+    for name, expected in EXPECTED_SYMBOLS.items():
+        try:
+            symbols = get_symbol_names(emulator_path, os.path.join(corpus_dir, name))
+        except Exception as ex:
+            problems.append(f'{ name }: { ex }')
+            continue
+
+        for seg_name, expected_names in expected.items():
+            if symbols[seg_name] != expected_names:
+                problems.append(f'{ name }: .{ seg_name } has the symbols { symbols[seg_name] } instead of { expected_names }')
+
+    if problems:
+        sys.exit('\n'.join(problems))
+
+    print(f'The symbols of { len(EXPECTED_SYMBOLS) } programs are correct')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+'''Generates assembly programs whose .text, .rodata and .data sections are far larger than
+   the ones written by hand, to check that the emulator and the loading of the compiled program scale with them.
+
+   The sections of a program have to fit below the emulator's stack, so a scale that would make them overlap it
+   is rejected before any file gets written.
+
+   Usage: python tools/gen_corpus.py OUTPUT_DIR [SCALE]'''
+
+import os
+import sys
+
+
+TEXT_ADDR = 0x401000
+STACK_END_ADDR = 0x43f000
+'''The address .text is linked at and the lowest address of the emulator's fixed stack, see src/emu/emu.h.'''
+STATIC_MEMORY_LIMIT = STACK_END_ADDR - TEXT_ADDR - 4 * 0x1000
+'''The number of bytes the sections of a program can take, leaving a page for the alignment of .text, .rodata,
+   .data and .bss each.'''
+MAX_INSN_SIZE = 8
+'''An upper bound on the size of the instructions the generators emit, the longest of them takes 7 bytes.'''
+
+
+
+def large_text(scale: int) -> tuple[str, int]:
+    '''A main function with thousands of instructions, split into many small labeled blocks.'''
+
+    lines = ['    .intel_syntax noprefix', '    .text', '    .globl main', 'main:',
+             '    push rbp', '    mov rbp, rsp', '    xor rax, rax', '    mov rcx, 1']
+
+    for block in range(200 * scale):
+        lines += [f'.Lblock{block}:',
+                  f'    add rax, {block % 97}',
+                  '    imul rcx, rcx, 3',
+                  '    xor rcx, rax',
+                  f'    sub rax, {block % 13}',
+                  '    test rcx, rcx',
+                  f'    jz .Lblock{block + 1}',
+                  '    nop']
+    lines += [f'.Lblock{200 * scale}:', '    pop rbp', '    ret']
+
+    num_insns = 6 + 7 * 200 * scale
+    return '\n'.join(lines) + '\n', num_insns * MAX_INSN_SIZE
+
+
+def large_rodata(scale: int) -> tuple[str, int]:
+    '''Long string constants, many times the size of a hand-written .rodata section.'''
+
+    lines = ['    .intel_syntax noprefix', '    .section .rodata']
+    rodata_size = 0
+
+    for i in range(20 * scale):
+        text = ''.join(chr(ord('a') + (i + j) % 26) for j in range(100 + 37 * i % 4000))
+        lines += [f'msg{i}:', f'    .string "{text}"']
+        rodata_size += len(text) + 1
+
+    lines += ['    .text', '    .globl main', 'main:',
+              '    push rbp', '    mov rbp, rsp', '    xor rax, rax']
+    for i in range(20 * scale):
+        lines += [f'    lea rsi, [rip + msg{i}]', '    movzx rdx, byte ptr [rsi]', '    add rax, rdx']
+    lines += ['    pop rbp', '    ret']
+
+    num_insns = 5 + 3 * 20 * scale
+    return '\n'.join(lines) + '\n', rodata_size + num_insns * MAX_INSN_SIZE
+
+
+def large_data(scale: int) -> tuple[str, int]:
+    '''Big initialized arrays with a very long symbol name in .data, and a buffer in .bss.'''
+
+    lines = ['    .intel_syntax noprefix', '    .data']
+    data_size = 0
+
+    # every 30 arrays take the same space, so the size of the sections grows linearly with the scale
+    for i in range(30 * scale):
+        num_values = 64 + 16 * (i % 30)
+        values = ', '.join(str((i * 31 + j) % 65536) for j in range(num_values))
+        lines += [f'array{i}:', f'    .quad {values}']
+        data_size += 8 * num_values
+
+    long_name = 'a_symbol_name_that_is_much_longer_than_sixty_four_characters_' * 4
+    lines += [f'{long_name}:', '    .quad 42']
+    data_size += 8
+
+    lines += ['    .bss', 'buffer:', f'    .zero {4096 * scale}']
+
+    lines += ['    .text', '    .globl main', 'main:',
+              '    push rbp', '    mov rbp, rsp', '    xor rax, rax']
+    for i in range(30 * scale):
+        lines += [f'    add rax, qword ptr [rip + array{i}]', f'    mov qword ptr [rip + buffer + {8 * i}], rax']
+    lines += [f'    add rax, qword ptr [rip + {long_name}]', '    pop rbp', '    ret']
+
+    num_insns = 6 + 2 * 30 * scale
+    return '\n'.join(lines) + '\n', data_size + 4096 * scale + num_insns * MAX_INSN_SIZE
+
+
+def unaligned_data(scale: int) -> tuple[str, int]:
+    '''A .data section whose size is not a multiple of 8, so the .bss section starts above __bss_start.'''
+
+    lines = ['    .intel_syntax noprefix', '    .data',
+             'flag:', '    .byte 1',
+             'counts:', '    .byte ' + ', '.join(str(i % 256) for i in range(4 * scale)),
+             '    .bss', '    .align 8',
+             'buffer:', f'    .zero {64 * scale}',
+             'total:', '    .zero 8']
+
+    lines += ['    .text', '    .globl main', 'main:',
+              '    push rbp', '    mov rbp, rsp',
+              '    movzx rax, byte ptr [rip + flag]',
+              '    add al, byte ptr [rip + counts]',
+              '    mov qword ptr [rip + buffer], rax',
+              '    mov qword ptr [rip + total], rax',
+              '    pop rbp', '    ret']
+
+    return '\n'.join(lines) + '\n', 1 + 4 * scale + 8 + 64 * scale + 8 + 8 * MAX_INSN_SIZE
+
+
+GENERATORS = {
+    'large_text.s':     large_text,
+    'large_rodata.s':   large_rodata,
+    'large_data.s':     large_data,
+    'unaligned_data.s': unaligned_data,
+}
+'''The generated programs by their file names, each generator returns the source of its program
+   and an upper bound on the number of bytes the program's sections take.'''
+EXPECTED_SYMBOLS = {
+    'unaligned_data.s': { 'data': ['flag', 'counts'], 'bss': ['buffer', 'total'] },
+}
+'''The symbols the emulator has to list in the .data and the .bss segment of some of the generated programs, checked by check_symbols.py.'''
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+
+    out_dir = sys.argv[1]
+    scale = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    if scale < 1:
+        sys.exit('The scale has to be at least 1')
+
+    programs = { name: generate(scale) for name, generate in GENERATORS.items() }
+
+    # the emulator cannot map a stack overlapping the sections
+    for name, (_, size) in programs.items():
+        if size > STATIC_MEMORY_LIMIT:
+            sys.exit(f'The sections of {name} would take up to {size} bytes at scale {scale}, more than the '
+                     f'{STATIC_MEMORY_LIMIT} bytes between {TEXT_ADDR:#x} and the stack at {STACK_END_ADDR:#x}, '
+                     f'use a smaller scale')
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name, (source, _) in programs.items():
+        path = os.path.join(out_dir, name)
+        with open(path, 'w') as f:
+            f.write(source)
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''Generates synthetic binary traces in the format the emulator writes, of any length and with any number
+   of .data/.bss bytes and symbols, so the deserializer and the GUI can be measured on traces far larger
+   than the ones of hand-written programs, without compiling or emulating anything.
+
+   Usage: python tools/gen_trace.py OUTPUT_PATH [NUM_INSNS] [DATA_SIZE] [BSS_SIZE] [NUM_SYMBOLS]'''
+
+import os
+import sys
+import random
+import struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from deserializer import *
+
+
+TEXT_ADDR = 0x401000
+RODATA_ADDR = 0x402000
+DATA_ADDR = 0x404000
+STACK_START_ADDR = 0x440000
+STACK_END_ADDR = 0x43f000
+STACK_BYTES = 128
+'''The same addresses and stack window as the ones the emulator uses.'''
+NUM_CODE_LINES = 64
+'''The number of lines of the generated code, which the instructions loop over.'''
+INSN_BYTECODE = b'\x48\x89\xc0\x90'
+
+
+
+def _record(rec_type: int, payload: bytes) -> bytes:
+    return struct.pack('<HHI', rec_type, 0, len(payload)) + payload
+
+def _segment(addr: int, seg_bytes: bytes, symbols: list[tuple[str, int, int]]) -> bytes:
+    out = struct.pack('<QQH', addr, len(seg_bytes), len(symbols)) + seg_bytes
+    for name, sym_addr, size in symbols:
+        out += struct.pack('<QQH', sym_addr, size, len(name)) + name.encode()
+
+    return out
+
+def _symbols(prefix: str, addr: int, size: int, num_symbols: int) -> list[tuple[str, int, int]]:
+    '''Splits a segment evenly into `num_symbols` symbols.'''
+
+    num_symbols = min(num_symbols, size)
+    if num_symbols == 0:
+        return []
+
+    sym_size = size // num_symbols
+    return [(f'{ prefix }{ i }', addr + i * sym_size, sym_size if i < num_symbols - 1 else size - i * sym_size)
+            for i in range(num_symbols)]
+
+
+def generate_trace(num_insns: int, data_size: int = 64, bss_size: int = 64, num_symbols: int = 8, seed: int = 0) -> bytes:
+    '''Returns a binary trace of `num_insns` execution contexts looping over a small piece of code.
+
+       Every instruction changes RIP and a few other registers, and every fourth one writes 8 bytes
+       to the stack, the .data or the .bss segment, like a typical student program would.'''
+
+    rnd = random.Random(seed)
+    bss_addr = DATA_ADDR + data_size
+
+    out = struct.pack('<8sII', TRACE_MAGIC, TRACE_FORMAT_VERSION, 0)
+
+    lines = [(TEXT_ADDR + 0x106 + 4 * i, f'        mov rax, { i }') for i in range(NUM_CODE_LINES)]
+    payload = struct.pack('<I', len(lines))
+    for addr, line in lines:
+        payload += struct.pack('<QH', addr, len(line)) + line.encode()
+    out += _record(REC_ASSEMBLY, payload)
+
+    out += _record(REC_REGISTER_NAMES, struct.pack('<H', len(REGISTER_NAMES))
+                   + b''.join(bytes([len(name)]) + name.encode() for name in REGISTER_NAMES))
+
+    data = bytearray(rnd.randrange(256) for _ in range(data_size))
+    bss = bytearray(bss_size)
+    stack = bytearray(STACK_BYTES)
+
+    payload = struct.pack('<5QH', TEXT_ADDR, bss_addr + bss_size, STACK_START_ADDR, STACK_END_ADDR, lines[0][0], STACK_BYTES)
+    payload += _segment(TEXT_ADDR, INSN_BYTECODE * NUM_CODE_LINES, [])
+    payload += _segment(RODATA_ADDR, b'Hello, world!\0', [('msg', RODATA_ADDR, 14)])
+    payload += _segment(DATA_ADDR, bytes(data), _symbols('var', DATA_ADDR, data_size, num_symbols))
+    payload += _segment(bss_addr, bytes(bss), _symbols('buf', bss_addr, bss_size, num_symbols))
+    out += _record(REC_LAYOUT, payload)
+
+    regs = [0] * len(REGISTER_NAMES)
+    rip, rsp = REGISTER_SLOTS['RIP'], REGISTER_SLOTS['RSP']
+    regs[rsp] = STACK_START_ADDR - 8
+    regs[rip] = lines[0][0]
+
+    # the writable regions, with the buffers mirroring them
+    regions = [(STACK_START_ADDR - STACK_BYTES, stack), (DATA_ADDR, data), (bss_addr, bss)]
+    regions = [(addr, buf) for addr, buf in regions if len(buf) >= 8]
+
+    records = [out]
+    for i in range(num_insns):
+        line_idx = i % NUM_CODE_LINES
+        header = (line_idx, len(INSN_BYTECODE), lines[line_idx][0], INSN_BYTECODE)
+
+        if i == 0:
+            records.append(_record(REC_CONTEXT, struct.pack(f'<iIQ16s{ len(regs) }Q', *header, *regs)
+                                   + bytes(stack) + bytes(data) + bytes(bss)))
+            continue
+
+        changed = { rip: lines[line_idx][0] }
+        for slot in rnd.sample(range(REGISTER_SLOTS['RIP']), 2):
+            if slot != rsp:
+                changed[slot] = rnd.randrange(1 << 64)
+
+        writes = []
+        if i % 4 == 0 and regions:
+            addr, buf = rnd.choice(regions)
+            offset = rnd.randrange(len(buf) - 7)
+            value = rnd.randbytes(8)
+            buf[offset:offset + 8] = value
+            writes.append((addr + offset, value))
+
+        payload = struct.pack('<iIQ16sHH', *header, len(changed), len(writes))
+        payload += b''.join(struct.pack('<BQ', slot, value) for slot, value in sorted(changed.items()))
+        payload += b''.join(struct.pack('<QI', addr, len(value)) + value for addr, value in writes)
+        records.append(_record(REC_DELTA, payload))
+
+    records.append(_record(REC_END, struct.pack('<I', num_insns)))
+
+    return b''.join(records)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+
+    args = [int(arg) for arg in sys.argv[2:]]
+
+    with open(sys.argv[1], 'wb') as file:
+        file.write(generate_trace(*args))
+
+
+if __name__ == '__main__':
+    main()